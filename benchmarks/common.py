@@ -0,0 +1,62 @@
+from typing import Any
+import subprocess
+import platform
+import json
+import time
+import sys
+import os
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PEGASUS_DIR = os.path.join(ROOT_DIR, 'pegasus')
+
+# The server modules import each other as top level modules
+sys.path.insert(0, PEGASUS_DIR)
+
+
+def get_revision() -> str | None:
+    try:
+        result = subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'),
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    revision = result.stdout.strip()
+
+    # Uncommitted changes make the revision alone misleading
+    status = subprocess.run(('git', 'status', '--porcelain', '--untracked-files=no'), cwd=ROOT_DIR, capture_output=True, text=True)
+    if status.stdout.strip():
+        revision += '-dirty'
+
+    return revision
+
+
+def create_report(kind: str, config: dict[str, Any], results: dict[str, Any]) -> dict[str, Any]:
+    return {
+        'kind': kind,
+        'revision': get_revision(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'config': config,
+        'results': results,
+    }
+
+
+def save_report(report: dict[str, Any], path: str | None) -> None:
+    if path is None:
+        return
+
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+        file.write('\n')
+
+    print(f'Saved to "{path}"')
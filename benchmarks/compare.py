@@ -0,0 +1,93 @@
+from typing import Any, Iterator
+import argparse
+import json
+import sys
+
+
+# Metric, and whether a higher value is better
+MICRO_METRICS = (('ops_per_sec', True),)
+LOAD_METRICS = (('requests_per_sec', True), ('latency_ms.p50', False), ('latency_ms.p99', False))
+TRANSPORT_METRICS = tuple(
+    (f'{mode}.{metric}', higher_is_better) for mode in ('keepalive', 'connect') for metric, higher_is_better in LOAD_METRICS
+)
+
+METRICS = {'micro': MICRO_METRICS, 'load': LOAD_METRICS, 'transport': TRANSPORT_METRICS}
+
+
+def load_report(path: str) -> dict[str, Any]:
+    with open(path) as file:
+        return json.load(file)
+
+
+def get_value(result: dict[str, Any], metric: str) -> float:
+    value: Any = result
+
+    for key in metric.split('.'):
+        value = value[key]
+
+    return float(value)
+
+
+def compare_reports(base: dict[str, Any], head: dict[str, Any]) -> Iterator[tuple[str, str, float, float, float, bool]]:
+    metrics = METRICS[base['kind']]
+
+    for name, base_result in base['results'].items():
+        head_result = head['results'].get(name)
+
+        if head_result is None:
+            continue
+
+        for metric, higher_is_better in metrics:
+            base_value = get_value(base_result, metric)
+            head_value = get_value(head_result, metric)
+
+            change = (head_value - base_value) / base_value * 100 if base_value else 0
+            improved = change > 0 if higher_is_better else change < 0
+
+            yield name, metric, base_value, head_value, change, improved
+
+
+def get_args() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser('compare', description='Compare two benchmark reports of the same kind.')
+    arg_parser.add_argument('base', metavar='BASE.json')
+    arg_parser.add_argument('head', metavar='HEAD.json')
+    arg_parser.add_argument(
+        '--threshold',
+        metavar='PERCENT',
+        type=float,
+        default=5,
+        help='Changes for the worse above this are reported as regressions, and the exit code is 1. [5]'
+    )
+    return arg_parser.parse_args()
+
+
+def main() -> None:
+    args = get_args()
+
+    base = load_report(args.base)
+    head = load_report(args.head)
+
+    if base['kind'] != head['kind']:
+        print(f"ERROR: Can't compare a \"{base['kind']}\" report with a \"{head['kind']}\" one", file=sys.stderr)
+        sys.exit(2)
+
+    print(f"Base: {base['revision']} ({base['python']}, {base['platform']})")
+    print(f"Head: {head['revision']} ({head['python']}, {head['platform']})")
+    print()
+
+    regressions = 0
+
+    for name, metric, base_value, head_value, change, improved in compare_reports(base, head):
+        mark = ''
+        if not improved and abs(change) > args.threshold:
+            mark = '  REGRESSION'
+            regressions += 1
+
+        print(f'{name:<28} {metric:<28} {base_value:>14,.3f} -> {head_value:>14,.3f} {change:>+8.1f}%{mark}')
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+from common import PEGASUS_DIR, ROOT_DIR, create_report, save_report
+from multiprocessing import Pool
+from typing import Any
+import subprocess
+import selectors
+import argparse
+import socket
+import shlex
+import time
+import sys
+
+
+# "HOST", PORT, or the path of a Unix domain socket
+Target = tuple[str, int] | str
+
+APPS = {
+    'echo': None,
+    'flask': 'flaskapp:app',
+}
+
+
+def connect(addr: Target, timeout: float | None = None) -> socket.socket:
+    if isinstance(addr, str):
+        client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client_socket.settimeout(timeout)
+
+        try:
+            client_socket.connect(addr)
+        except OSError:
+            client_socket.close()
+            raise
+
+        return client_socket
+
+    client_socket = socket.create_connection(addr, timeout=timeout)
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return client_socket
+
+
+class ClientConnection:
+    # A keep-alive connection that sends the next request as soon as the previous response is complete
+
+    __slots__ = ('addr', 'socket', 'request', 'buffer', 'sent_at', 'expected_size', 'closed_by_server', 'responses')
+
+    def __init__(self, addr: Target, request: bytes) -> None:
+        self.addr: Target = addr
+        self.socket = self._connect()
+        self.request: bytes = request
+        self.buffer = bytearray()
+        self.sent_at: float = 0
+        self.expected_size: int | None = None
+        self.closed_by_server: bool = False
+        self.responses: int = 0
+
+    def _connect(self) -> socket.socket:
+        client_socket = connect(self.addr)
+        client_socket.setblocking(False)
+        return client_socket
+
+    def reconnect(self) -> None:
+        self.socket.close()
+        self.socket = self._connect()
+
+    def send(self) -> None:
+        self.buffer.clear()
+        self.expected_size = None
+        self.closed_by_server = False
+        self.sent_at = time.perf_counter()
+        self.socket.sendall(self.request)
+
+    def feed(self, data: bytes) -> bool:
+        # Returns True once the whole response was received
+        self.buffer += data
+
+        if self.expected_size is None:
+            head_end = self.buffer.find(b'\r\n\r\n')
+
+            if head_end == -1:
+                return False
+
+            content_length = 0
+            for line in bytes(self.buffer[:head_end]).split(b'\r\n')[1:]:
+                key, _, value = line.partition(b':')
+
+                key = key.strip().lower()
+
+                if key == b'content-length':
+                    content_length = int(value)
+                elif key == b'connection' and value.strip().lower() == b'close':
+                    self.closed_by_server = True
+
+            self.expected_size = head_end + 4 + content_length
+
+        return len(self.buffer) >= self.expected_size
+
+
+def run_client(addr: Target, request: bytes, connections: int, duration: float) -> tuple[list[float], int, int]:
+    selector = selectors.DefaultSelector()
+    latencies: list[float] = []
+    errors = 0
+
+    conns = [ClientConnection(addr, request) for _ in range(connections)]
+    for conn in conns:
+        selector.register(conn.socket, selectors.EVENT_READ, conn)
+        conn.send()
+
+    deadline = time.perf_counter() + duration
+
+    while time.perf_counter() < deadline and selector.get_map():
+        for key, _ in selector.select(timeout=1):
+            conn: ClientConnection = key.data
+
+            try:
+                data = conn.socket.recv(65536)
+            except OSError:
+                data = b''
+
+            if not data:
+                errors += 1
+                selector.unregister(conn.socket)
+                conn.socket.close()
+                continue
+
+            if not conn.feed(data):
+                continue
+
+            latencies.append(time.perf_counter() - conn.sent_at)
+            conn.responses += 1
+
+            if time.perf_counter() >= deadline:
+                continue
+
+            # The server limits the requests per connection
+            if conn.closed_by_server:
+                selector.unregister(conn.socket)
+                conn.reconnect()
+                selector.register(conn.socket, selectors.EVENT_READ, conn)
+
+            conn.send()
+
+    for key in list(selector.get_map().values()):
+        key.data.socket.close()
+
+    selector.close()
+
+    # Connections that were never served, e.g. while every thread is held by other keep-alive connections
+    starved = sum(1 for conn in conns if not conn.responses)
+
+    return latencies, errors, starved
+
+
+def wait_for_server(addr: Target, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            connect(addr, timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+
+            time.sleep(0.05)
+
+
+def get_percentile(sorted_values: list[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0
+
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))
+    return sorted_values[index]
+
+
+def run_load(args: argparse.Namespace, app_name: str) -> dict[str, Any]:
+    addr = ('127.0.0.1', args.port)
+
+    command = [
+        sys.executable, PEGASUS_DIR,
+        '--host', addr[0],
+        '--port', str(addr[1]),
+        '--access-log', 'off',
+        *shlex.split(args.server_args),
+    ]
+
+    app = APPS[app_name]
+    if app is not None:
+        command.extend(('--chdir', ROOT_DIR, app))
+
+    method = 'GET' if args.body is None else 'POST'
+    request = f'{method} {args.path} HTTP/1.1\r\nHost: {addr[0]}:{addr[1]}\r\nUser-Agent: pegasus-bench\r\n'.encode()
+    if args.body is not None:
+        request += b'Content-Type: text/plain\r\nContent-Length: %d\r\n' % len(args.body.encode())
+    request += b'\r\n' + (args.body or '').encode()
+
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    try:
+        wait_for_server(addr, timeout=10)
+
+        # Connections are split between client processes, so the client is not the bottleneck
+        connections = [args.connections // args.processes] * args.processes
+        for i in range(args.connections % args.processes):
+            connections[i] += 1
+
+        started_at = time.perf_counter()
+
+        with Pool(args.processes) as pool:
+            client_results = pool.starmap(
+                run_client,
+                [(addr, request, count, args.duration) for count in connections if count]
+            )
+
+        elapsed = time.perf_counter() - started_at
+
+    finally:
+        server.terminate()
+        _, stderr = server.communicate(timeout=30)
+
+        if server.returncode not in (0, -15) and stderr:
+            print(stderr.decode(), file=sys.stderr)
+
+    latencies = sorted(latency for client_latencies, _, _ in client_results for latency in client_latencies)
+    errors = sum(client_errors for _, client_errors, _ in client_results)
+    starved = sum(client_starved for _, _, client_starved in client_results)
+
+    return {
+        'command': shlex.join(command),
+        'requests': len(latencies),
+        'errors': errors,
+        'starved_connections': starved,
+        'elapsed': elapsed,
+        'requests_per_sec': len(latencies) / elapsed,
+        'latency_ms': {
+            'p50': get_percentile(latencies, 50) * 1000,
+            'p90': get_percentile(latencies, 90) * 1000,
+            'p99': get_percentile(latencies, 99) * 1000,
+            'max': (latencies[-1] if latencies else 0) * 1000,
+        },
+    }
+
+
+def get_args() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser('load', description='End to end load test of pegasus on localhost.')
+    arg_parser.add_argument('--app', choices=('echo', 'flask', 'all'), default='all', help='Application to serve. [all]')
+    arg_parser.add_argument('--duration', metavar='SECONDS', type=float, default=10, help='Duration of each run. [10]')
+    arg_parser.add_argument('--connections', metavar='INT', type=int, default=64, help='Concurrent keep-alive connections. [64]')
+    arg_parser.add_argument('--processes', metavar='INT', type=int, default=2, help='Client processes generating the load. [2]')
+    arg_parser.add_argument('--port', metavar='PORT', type=int, default=8765, help='Port of the server. [8765]')
+    arg_parser.add_argument('--path', default='/', help='Requested path. [/]')
+    arg_parser.add_argument('--body', metavar='TEXT', default=None, help='Send POST requests with this body.')
+    arg_parser.add_argument(
+        '--server-args',
+        metavar='ARGS',
+        default='',
+        help='Extra arguments for the server, e.g. "--engine eventloop --workers 2".'
+    )
+    arg_parser.add_argument('--output', metavar='PATH', help='Save the results as JSON.')
+    return arg_parser.parse_args()
+
+
+def main() -> None:
+    args = get_args()
+
+    results: dict[str, dict[str, Any]] = {}
+
+    for app_name in (APPS if args.app == 'all' else (args.app,)):
+        results[app_name] = result = run_load(args, app_name)
+        latency = result['latency_ms']
+
+        print(
+            f"{app_name:<8} {result['requests_per_sec']:>10,.0f} req/s "
+            f"p50 {latency['p50']:.2f} ms  p90 {latency['p90']:.2f} ms  p99 {latency['p99']:.2f} ms  "
+            f"errors {result['errors']}  starved connections {result['starved_connections']}"
+        )
+
+    config = {
+        'duration': args.duration,
+        'connections': args.connections,
+        'processes': args.processes,
+        'path': args.path,
+        'body': args.body,
+        'server_args': args.server_args,
+    }
+    save_report(create_report('load', config, results), args.output)
+
+
+if __name__ == '__main__':
+    main()
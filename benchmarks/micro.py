@@ -0,0 +1,136 @@
+from common import create_report, save_report
+from typing import Any, Callable
+import argparse
+import timeit
+import io
+
+# Importable once `common` adds the server directory to the path
+from http_parser import HTTPRequest, HTTPRequestParser, HTTPResponse
+from web_server import WebServer
+from wsgi_server import create_environ_template, wsgi_server
+
+
+SMALL_GET = b'GET /index.html?page=1 HTTP/1.1\r\nHost: 127.0.0.1:8080\r\nUser-Agent: bench\r\nAccept: */*\r\n\r\n'
+
+MANY_HEADERS = (
+    b'GET /api/v1/items HTTP/1.1\r\n'
+    + b''.join(b'X-Header-%d: %s\r\n' % (i, b'v' * 40) for i in range(50))
+    + b'\r\n'
+)
+
+LARGE_BODY_SIZE = 1048576
+LARGE_BODY = b'POST /upload HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: %d\r\n\r\n' % LARGE_BODY_SIZE + b'x' * LARGE_BODY_SIZE
+
+BYTES_RESPONSE: HTTPResponse = {
+    'status': '200 OK',
+    'headers': [('Content-Type', 'application/json'), ('Content-Length', '27'), ('Cache-Control', 'no-cache')],
+    'body': b'{"message": "Hello, World"}'
+}
+
+STREAMED_RESPONSE: HTTPResponse = {
+    'status': '200 OK',
+    'headers': [('Content-Type', 'text/plain')],
+    'body': iter(())
+}
+
+WSGI_REQUEST: HTTPRequest = {
+    'method': 'POST',
+    'url': '/echo/a/b?foo=echo&bar=69',
+    'version': 'HTTP/1.1',
+    'headers': [
+        ('Host', '127.0.0.1:8080'),
+        ('User-Agent', 'curl/8.0'),
+        ('Accept', '*/*'),
+        ('Content-Type', 'application/json'),
+        ('Content-Length', '2'),
+    ],
+    'body': None
+}
+
+SERVER_ADDR = ('127.0.0.1', 8080)
+ENVIRON_TEMPLATE = create_environ_template(SERVER_ADDR)
+
+
+def parse(data: bytes) -> None:
+    parser = HTTPRequestParser(max_body_size=None)
+    parser.feed(data)
+
+    assert parser.completed
+    parser.get_result()
+    parser.take_body()
+
+
+def parse_byte_at_a_time(data: bytes) -> None:
+    parser = HTTPRequestParser()
+
+    for i in range(len(data)):
+        parser.feed(data[i:i + 1])
+
+    assert parser.completed
+
+
+def wsgi_app(environ: Any, start_response: Any) -> list[bytes]:
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+    return [b'ok']
+
+
+def build_environ() -> None:
+    request: HTTPRequest = {**WSGI_REQUEST, 'body': io.BytesIO(b'{}')}
+    wsgi_server(wsgi_app, request, ('127.0.0.1', 50000), SERVER_ADDR, environ_template=ENVIRON_TEMPLATE)
+
+
+BENCHMARKS: dict[str, Callable[[], Any]] = {
+    'parser_small_get': lambda: parse(SMALL_GET),
+    'parser_many_headers': lambda: parse(MANY_HEADERS),
+    'parser_large_body': lambda: parse(LARGE_BODY),
+    'parser_byte_at_a_time': lambda: parse_byte_at_a_time(SMALL_GET),
+    'serialize_bytes_response': lambda: WebServer._serialize_http_response(BYTES_RESPONSE, keep_alive=True),
+    'serialize_streamed_head': lambda: WebServer._serialize_http_response(STREAMED_RESPONSE, keep_alive=True, chunked=True),
+    'wsgi_environ': build_environ,
+}
+
+
+def run_benchmark(function: Callable[[], Any], repeat: int, min_time: float) -> dict[str, float]:
+    timer = timeit.Timer(function)
+
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+
+    # The fastest run is the one with less noise from the rest of the system
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    return {
+        'ops_per_sec': 1 / best,
+        'us_per_op': best * 1e6,
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def get_args() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser('micro', description='Microbenchmarks of the parser, serializer and WSGI environ.')
+    arg_parser.add_argument('--output', metavar='PATH', help='Save the results as JSON.')
+    arg_parser.add_argument('--repeat', metavar='INT', type=int, default=5, help='Runs of each benchmark, the fastest is kept. [5]')
+    arg_parser.add_argument('--min-time', metavar='SECONDS', type=float, default=0.2, help='Minimum duration of each run. [0.2]')
+    arg_parser.add_argument('--filter', metavar='TEXT', default='', help='Only run the benchmarks whose name contains this text.')
+    return arg_parser.parse_args()
+
+
+def main() -> None:
+    args = get_args()
+
+    results: dict[str, dict[str, float]] = {}
+
+    for name, function in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+
+        results[name] = result = run_benchmark(function, args.repeat, args.min_time)
+        print(f"{name:<28} {result['ops_per_sec']:>14,.0f} ops/s {result['us_per_op']:>12.3f} us/op")
+
+    report = create_report('micro', {'repeat': args.repeat, 'min_time': args.min_time}, results)
+    save_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+from common import PEGASUS_DIR, create_report, save_report
+from load import Target, connect, get_percentile, run_client, wait_for_server
+from multiprocessing import Pool
+from typing import Any
+import subprocess
+import argparse
+import tempfile
+import socket
+import shlex
+import time
+import sys
+import os
+
+
+# Server arguments of each variant, all of them listen on TCP except "unix"
+VARIANTS: dict[str, tuple[str, ...]] = {
+    'tcp': (),
+    'tcp-nodelay': ('--tcp-nodelay',),
+    'tcp-defer-accept': ('--tcp-defer-accept', '1'),
+    'tcp-fastopen': ('--tcp-fastopen', '256'),
+    'socket-buffers': ('--socket-rcvbuf', '1048576', '--socket-sndbuf', '1048576'),
+    'unix': (),
+}
+
+
+def run_connect_client(addr: Target, request: bytes, duration: float, fastopen: bool) -> tuple[list[float], int]:
+    # A new connection for each request, which is where accepting and the handshake matter
+    latencies: list[float] = []
+    errors = 0
+
+    deadline = time.perf_counter() + duration
+
+    while time.perf_counter() < deadline:
+        started_at = time.perf_counter()
+
+        try:
+            if fastopen and not isinstance(addr, str):
+                # The request is sent with the SYN once the client has a cookie from a previous connection
+                client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                client_socket.sendto(request, socket.MSG_FASTOPEN, addr)
+            else:
+                client_socket = connect(addr)
+                client_socket.sendall(request)
+
+            with client_socket:
+                # The request asks to close the connection, so the response ends with it
+                while client_socket.recv(65536):
+                    pass
+
+        except OSError:
+            errors += 1
+            continue
+
+        latencies.append(time.perf_counter() - started_at)
+
+    return latencies, errors
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int) -> dict[str, Any]:
+    latencies.sort()
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_sec': len(latencies) / elapsed,
+        'latency_ms': {
+            'p50': get_percentile(latencies, 50) * 1000,
+            'p90': get_percentile(latencies, 90) * 1000,
+            'p99': get_percentile(latencies, 99) * 1000,
+        },
+    }
+
+
+def run_variant(args: argparse.Namespace, name: str, unix_path: str) -> dict[str, Any]:
+    addr: Target = unix_path if name == 'unix' else ('127.0.0.1', args.port)
+    bind = f'unix:{unix_path}' if isinstance(addr, str) else f'{addr[0]}:{addr[1]}'
+
+    command = [
+        sys.executable, PEGASUS_DIR,
+        '--bind', bind,
+        '--access-log', 'off',
+        *VARIANTS[name],
+        *shlex.split(args.server_args),
+    ]
+
+    request = b'GET / HTTP/1.1\r\nHost: localhost\r\nUser-Agent: pegasus-bench\r\n\r\n'
+    close_request = b'GET / HTTP/1.1\r\nHost: localhost\r\nUser-Agent: pegasus-bench\r\nConnection: close\r\n\r\n'
+
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    try:
+        wait_for_server(addr, timeout=10)
+
+        connections = [args.connections // args.processes] * args.processes
+        for i in range(args.connections % args.processes):
+            connections[i] += 1
+
+        with Pool(args.processes) as pool:
+            started_at = time.perf_counter()
+            keepalive_results = pool.starmap(
+                run_client,
+                [(addr, request, count, args.duration) for count in connections if count]
+            )
+            keepalive_elapsed = time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            connect_results = pool.starmap(
+                run_connect_client,
+                [(addr, close_request, args.duration, name == 'tcp-fastopen')] * args.processes
+            )
+            connect_elapsed = time.perf_counter() - started_at
+
+    finally:
+        server.terminate()
+        _, stderr = server.communicate(timeout=30)
+
+        if server.returncode not in (0, -15) and stderr:
+            print(stderr.decode(), file=sys.stderr)
+
+    return {
+        'command': shlex.join(command),
+        'keepalive': summarize(
+            [latency for latencies, _, _ in keepalive_results for latency in latencies],
+            keepalive_elapsed,
+            sum(errors for _, errors, _ in keepalive_results)
+        ),
+        'connect': summarize(
+            [latency for latencies, _ in connect_results for latency in latencies],
+            connect_elapsed,
+            sum(errors for _, errors in connect_results)
+        ),
+    }
+
+
+def get_args() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(
+        'transport',
+        description='Latency of each socket option, with keep-alive connections and with a new connection per request.'
+    )
+    arg_parser.add_argument(
+        '--variant',
+        choices=(*VARIANTS, 'all'),
+        default='all',
+        help='Socket option to measure, "tcp" is the baseline. [all]'
+    )
+    arg_parser.add_argument('--duration', metavar='SECONDS', type=float, default=5, help='Duration of each run. [5]')
+    arg_parser.add_argument('--connections', metavar='INT', type=int, default=16, help='Concurrent keep-alive connections. [16]')
+    arg_parser.add_argument('--processes', metavar='INT', type=int, default=2, help='Client processes generating the load. [2]')
+    arg_parser.add_argument('--port', metavar='PORT', type=int, default=8765, help='Port of the server. [8765]')
+    arg_parser.add_argument(
+        '--server-args',
+        metavar='ARGS',
+        default='',
+        help='Extra arguments for the server, e.g. "--engine eventloop".'
+    )
+    arg_parser.add_argument('--output', metavar='PATH', help='Save the results as JSON.')
+    return arg_parser.parse_args()
+
+
+def main() -> None:
+    args = get_args()
+
+    results: dict[str, dict[str, Any]] = {}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        unix_path = os.path.join(tmp_dir, 'pegasus.sock')
+
+        for name in (VARIANTS if args.variant == 'all' else (args.variant,)):
+            results[name] = result = run_variant(args, name, unix_path)
+
+            for mode in ('keepalive', 'connect'):
+                mode_result = result[mode]
+                latency = mode_result['latency_ms']
+
+                print(
+                    f"{name:<18} {mode:<10} {mode_result['requests_per_sec']:>10,.0f} req/s "
+                    f"p50 {latency['p50']:.3f} ms  p90 {latency['p90']:.3f} ms  p99 {latency['p99']:.3f} ms  "
+                    f"errors {mode_result['errors']}"
+                )
+
+    config = {
+        'duration': args.duration,
+        'connections': args.connections,
+        'processes': args.processes,
+        'server_args': args.server_args,
+    }
+    save_report(create_report('transport', config, results), args.output)
+
+
+if __name__ == '__main__':
+    main()
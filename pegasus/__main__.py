@@ -1,11 +1,23 @@
 from http_parser import HTTP_STATUS_PHRASES, HTTPHeader, HTTPRequest, HTTPResponse, http_status
 from web_server import WEB_SERVER_NAME, Address, WebServer
-from wsgi_server import wsgi_server
+from asgi_server import ASGIMessage, ASGIReceive, ASGIScope, ASGISend, is_asgi_application
+from wsgi_server import create_environ_template, wsgi_server
+from access_log import DEFAULT_ACCESS_LOG_FORMAT, validate_access_log_format
+from response_compression import DEFAULT_CONTENT_TYPES, SUPPORTED_ENCODINGS
+from prefork import Master
+from listeners import parse_bind
+from profiler import TRIGGER_HEADER
+from interpreter_pool import InterpreterPool, interpreters
+from worker_pool import is_gil_enabled
 from types import ModuleType
 from typing import TYPE_CHECKING, Any, Iterable, NoReturn
+import ipaddress
 import socket
 import argparse
+import atexit
+import time
 import os
+import gc
 import sys
 
 
@@ -32,10 +44,36 @@ def echo_wsgi_app(environ: 'WSGIEnvironment', start_response: 'StartResponse') -
     return [body]
 
 
+async def echo_asgi_app(scope: ASGIScope, receive: ASGIReceive, send: ASGISend) -> None:
+    if scope['type'] != 'http':
+        return
+
+    body = b''
+    more_body = True
+
+    while more_body:
+        message: ASGIMessage = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+    headers: list[tuple[bytes, bytes]] = []
+
+    if scope['method'] != 'GET' and body:
+        headers.extend((
+            (b'content-length', b'%d' % len(body)),
+            (b'content-type', b'text/plain'),
+        ))
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body if scope['method'] != 'GET' else b''})
+
+
 def handle_request_echo(request: HTTPRequest, addr: Address) -> HTTPResponse:
     status = http_status.HTTP_200_OK
 
-    if request['method'].upper() == 'GET' or request['body'] is None:
+    body = request['body'].read() if request['body'] is not None else None
+
+    if request['method'].upper() == 'GET' or body is None:
         return {
             'status': '%d %s' % (status, HTTP_STATUS_PHRASES[status]),
             'headers': [],
@@ -45,10 +83,10 @@ def handle_request_echo(request: HTTPRequest, addr: Address) -> HTTPResponse:
     return {
         'status': '%d %s' % (status, HTTP_STATUS_PHRASES[status]),
         'headers': [
-            ('content-length', str(len(request['body']))),
+            ('content-length', str(len(body))),
             ('content-type', 'text/plain'),
         ],
-        'body': request['body']
+        'body': body
     }
 
 
@@ -66,7 +104,7 @@ def get_args() -> argparse.Namespace:
 
     def type_address(addr: str) -> str:
         try:
-            socket.getaddrinfo(addr, None, socket.AF_INET, socket.SOCK_STREAM)
+            socket.getaddrinfo(addr, None, socket.AF_UNSPEC, socket.SOCK_STREAM)
         except socket.gaierror as error:
             raise_argument_error(error.strerror, addr)
 
@@ -83,16 +121,16 @@ def get_args() -> argparse.Namespace:
 
         return port
 
-    def type_threads(threads_raw: str) -> int:
+    def type_positive_int(value_raw: str) -> int:
         try:
-            threads = int(threads_raw)
+            value = int(value_raw)
         except ValueError as error:
             raise_argument_error(error.args[0])
 
-        if threads <= 0:
-            raise_argument_error('The minimum is 1', threads)
+        if value <= 0:
+            raise_argument_error('The minimum is 1', value)
 
-        return threads
+        return value
 
     def type_backlog(backlog_raw: str) -> int | None:
         try:
@@ -102,6 +140,139 @@ def get_args() -> argparse.Namespace:
 
         return backlog if backlog >= 0 else None
 
+    def type_keepalive_timeout(timeout_raw: str) -> float:
+        try:
+            timeout = float(timeout_raw)
+        except ValueError as error:
+            raise_argument_error(error.args[0])
+
+        if timeout < 0:
+            raise_argument_error('The minimum is 0', timeout)
+
+        return timeout
+
+    def type_timeout(timeout_raw: str) -> float:
+        try:
+            timeout = float(timeout_raw)
+        except ValueError as error:
+            raise_argument_error(error.args[0])
+
+        if timeout <= 0:
+            raise_argument_error('Must be greater than 0', timeout)
+
+        return timeout
+
+    def type_non_negative_int(value_raw: str) -> int:
+        try:
+            value = int(value_raw)
+        except ValueError as error:
+            raise_argument_error(error.args[0])
+
+        if value < 0:
+            raise_argument_error('The minimum is 0', value)
+
+        return value
+
+    def type_cache_vary(headers_raw: str) -> tuple[str, ...]:
+        headers = tuple(header.strip().lower() for header in headers_raw.split(',') if header.strip())
+
+        for header in headers:
+            if not all(char.isalnum() or char in '!#$%&\'*+-.^_`|~' for char in header):
+                raise_argument_error('Invalid header name', header)
+
+        return headers
+
+    def type_compression(encodings_raw: str) -> tuple[str, ...]:
+        encodings = tuple(encoding.strip().lower() for encoding in encodings_raw.split(',') if encoding.strip())
+
+        for encoding in encodings:
+            if encoding not in SUPPORTED_ENCODINGS:
+                raise_argument_error(f'Unsupported encoding, the available ones are {", ".join(SUPPORTED_ENCODINGS)}', encoding)
+
+        return encodings
+
+    def type_content_types(content_types_raw: str) -> tuple[str, ...]:
+        return tuple(content_type.strip().lower() for content_type in content_types_raw.split(',') if content_type.strip())
+
+    def type_static(mount: str) -> tuple[str, str]:
+        prefix, separator, directory = mount.partition(':')
+
+        if not separator or not prefix.startswith('/'):
+            raise_argument_error('Expected URL_PREFIX:DIR', mount)
+
+        if not os.path.isdir(directory):
+            raise_argument_error('Directory does not exist', directory)
+
+        # Relative to where the server was started, before changing to the application directory
+        return prefix, os.path.realpath(directory)
+
+    def type_access_log(path: str) -> str | None:
+        if path == 'off':
+            return None
+
+        if path != '-' and not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            raise_argument_error('Directory does not exist', os.path.dirname(path))
+
+        return path
+
+    def type_access_log_format(format: str) -> str:
+        try:
+            validate_access_log_format(format)
+        except (KeyError, IndexError, ValueError) as error:
+            raise_argument_error(f'Invalid format ({error!r})', format)
+
+        return format
+
+    def type_bind(bind: str) -> str:
+        if bind.startswith('unix:'):
+            path = bind[len('unix:'):]
+
+            if not path or not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+                raise_argument_error('Directory does not exist', os.path.dirname(path))
+
+            # Relative to where the server was started, before changing to the application directory
+            return 'unix:' + os.path.abspath(path)
+
+        if ':' not in bind:
+            raise_argument_error('Expected HOST:PORT, [HOST]:PORT or unix:PATH', bind)
+
+        host, port = bind.rsplit(':', 1)
+        type_address(host.strip('[]') or '0.0.0.0')
+        type_port(port)
+
+        return f"{host or '0.0.0.0'}:{port}"
+
+    def type_sample_rate(rate_raw: str) -> float:
+        try:
+            rate = float(rate_raw)
+        except ValueError as error:
+            raise_argument_error(error.args[0])
+
+        if not 0 <= rate <= 1:
+            raise_argument_error('Must be between 0 and 1', rate)
+
+        return rate
+
+    def type_networks(networks_raw: str) -> tuple[str, ...]:
+        networks = tuple(network.strip() for network in networks_raw.split(',') if network.strip())
+
+        for network in networks:
+            try:
+                ipaddress.ip_network(network)
+            except ValueError as error:
+                raise_argument_error(error.args[0])
+
+        return networks
+
+    def type_profile_dir(path: str) -> str:
+        # Created when the profiles are saved, relative to where the server was started
+        path = os.path.abspath(path)
+
+        if not os.path.isdir(os.path.dirname(path)):
+            raise_argument_error('Directory does not exist', os.path.dirname(path))
+
+        return path
+
     arg_parser = argparse.ArgumentParser(WEB_SERVER_NAME, description='A blazingly fast WSGI web server.')
     arg_parser.add_argument(
         '--chdir',
@@ -117,7 +288,17 @@ def get_args() -> argparse.Namespace:
         'app',
         nargs='?',
         metavar='MODULE:APP',
-        help='WSGI application to be used. Uses an echo app by default.'
+        help='WSGI or ASGI application to be used. Uses an echo app by default.'
+    )
+    arg_parser.add_argument(
+        '--interface',
+        choices=('auto', 'wsgi', 'asgi'),
+        default='auto',
+        help=(
+            'Interface of the application. '
+            '"auto" uses ASGI if the application is a coroutine function, or its `__call__` is one. '
+            'ASGI applications are served from an asyncio event loop, so waiting requests don\'t hold threads. [auto]'
+        )
     )
     arg_parser.add_argument(
         '--host',
@@ -133,16 +314,137 @@ def get_args() -> argparse.Namespace:
         default=8080,
         help='Port to which the server will bind. [8080]'
     )
+    arg_parser.add_argument(
+        '--bind',
+        metavar='HOST:PORT|[HOST]:PORT|unix:PATH',
+        type=type_bind,
+        action='append',
+        default=[],
+        help='Address to listen at, instead of --host and --port. Can be used several times to listen at each one.'
+    )
+    arg_parser.add_argument(
+        '--tcp-nodelay',
+        action='store_true',
+        help='Disable Nagle\'s algorithm on accepted connections, so small responses are not delayed.'
+    )
+    arg_parser.add_argument(
+        '--tcp-defer-accept',
+        metavar='SECONDS',
+        type=type_positive_int,
+        default=None,
+        help='Accept connections only once the request arrives, waiting up to SECONDS for it (Linux only). Disabled by default.'
+    )
+    arg_parser.add_argument(
+        '--tcp-fastopen',
+        metavar='QUEUE',
+        type=type_positive_int,
+        default=None,
+        help='Let returning clients send the request with the SYN, with up to QUEUE pending. Disabled by default.'
+    )
+    arg_parser.add_argument(
+        '--socket-rcvbuf',
+        metavar='BYTES',
+        type=type_positive_int,
+        default=None,
+        help='Receive buffer size of accepted connections. Uses the system default by default.'
+    )
+    arg_parser.add_argument(
+        '--socket-sndbuf',
+        metavar='BYTES',
+        type=type_positive_int,
+        default=None,
+        help='Send buffer size of accepted connections. Uses the system default by default.'
+    )
+    arg_parser.add_argument(
+        '--workers',
+        metavar='INT',
+        type=type_positive_int,
+        default=1,
+        help=(
+            'The number of worker processes sharing the listening socket. '
+            'If greater than 1, a master process supervises them. [1]'
+        )
+    )
+    arg_parser.add_argument(
+        '--preload',
+        action='store_true',
+        help=(
+            'Import the application in the master process before forking the workers, so they share its memory. '
+            'Restarted workers keep the application loaded at startup. '
+            'With a single worker, the application is imported the same way and its objects are excluded from garbage collection.'
+        )
+    )
+    arg_parser.add_argument(
+        '--warmup',
+        metavar='MODULE:FUNCTION',
+        default=None,
+        help='Function called with the application once it is imported, before serving requests.'
+    )
     arg_parser.add_argument(
         '--threads',
         metavar='INT',
-        type=type_threads,
+        type=type_positive_int,
         default=(os.cpu_count() or 1) * 2,
         help=(
-            'The maximum number of active threads handling requests. '
+            'The maximum number of active threads handling requests per worker. '
             f'Uses os.cpu_count() * 2 by default. [{(os.cpu_count() or 1) * 2}]'
         )
     )
+    arg_parser.add_argument(
+        '--min-threads',
+        metavar='INT',
+        type=type_positive_int,
+        default=1,
+        help=(
+            'The minimum number of threads kept alive while idle. '
+            'More threads are started while requests wait in the queue, up to --threads. [1]'
+        )
+    )
+    arg_parser.add_argument(
+        '--interpreters',
+        metavar='INT',
+        type=type_positive_int,
+        nargs='?',
+        const=os.cpu_count() or 1,
+        default=None,
+        help=(
+            'Run the WSGI application in INT subinterpreters, each one with its own GIL, so requests are handled in parallel '
+            'by a single process (Python 3.12+). The application must support subinterpreters. '
+            'Not needed on free-threaded builds without the GIL. '
+            f'Disabled by default, uses os.cpu_count() if INT is omitted. [{os.cpu_count() or 1}]'
+        )
+    )
+    arg_parser.add_argument(
+        '--queue-size',
+        metavar='INT',
+        type=type_positive_int,
+        default=256,
+        help='The maximum number of accepted connections waiting for a free thread. [256]'
+    )
+    arg_parser.add_argument(
+        '--max-in-flight',
+        metavar='INT',
+        type=type_positive_int,
+        default=None,
+        help=(
+            'Respond "503 Service Unavailable" instead of queueing once this many connections ("threaded" engine) '
+            'or requests ("eventloop" engine) are being served or waiting for a thread. Unlimited by default.'
+        )
+    )
+    arg_parser.add_argument(
+        '--max-queue-wait',
+        metavar='SECONDS',
+        type=type_timeout,
+        default=None,
+        help='Respond "503 Service Unavailable" while the oldest queued task has been waiting for longer than this. Disabled by default.'
+    )
+    arg_parser.add_argument(
+        '--retry-after',
+        metavar='SECONDS',
+        type=type_non_negative_int,
+        default=1,
+        help='Value of the "Retry-After" header of the "503 Service Unavailable" responses. [1]'
+    )
     arg_parser.add_argument(
         '--backlog',
         metavar='INT',
@@ -153,10 +455,261 @@ def get_args() -> argparse.Namespace:
             'If negative, a default reasonable value is chosen by the system. [1024]'
         )
     )
-    return arg_parser.parse_args()
+    arg_parser.add_argument(
+        '--keepalive-timeout',
+        metavar='SECONDS',
+        type=type_keepalive_timeout,
+        default=5,
+        help=(
+            'Seconds to wait for the next request on a persistent connection before closing it. '
+            'If 0, persistent connections are disabled. [5]'
+        )
+    )
+    arg_parser.add_argument(
+        '--header-timeout',
+        metavar='SECONDS',
+        type=type_timeout,
+        default=5,
+        help='Seconds to receive the status line and headers of a request, in total. [5]'
+    )
+    arg_parser.add_argument(
+        '--body-timeout',
+        metavar='SECONDS',
+        type=type_timeout,
+        default=5,
+        help='Seconds without receiving anything while reading the body of a request. [5]'
+    )
+    arg_parser.add_argument(
+        '--write-timeout',
+        metavar='SECONDS',
+        type=type_timeout,
+        default=5,
+        help='Seconds without sending anything while writing a response. [5]'
+    )
+    arg_parser.add_argument(
+        '--max-requests-per-connection',
+        metavar='INT',
+        type=type_positive_int,
+        default=1000,
+        help='The maximum number of requests served through a single connection before closing it. [1000]'
+    )
+    arg_parser.add_argument(
+        '--engine',
+        choices=('threaded', 'eventloop'),
+        default='threaded',
+        help=(
+            'How connections are handled. '
+            '"threaded" holds a thread for the whole life of each connection. '
+            '"eventloop" reads and writes every connection from event loops and only uses threads to run the application. '
+            '[threaded]'
+        )
+    )
+    arg_parser.add_argument(
+        '--event-loops',
+        metavar='INT',
+        type=type_positive_int,
+        default=1,
+        help='The number of event loops used by the "eventloop" engine. [1]'
+    )
+    arg_parser.add_argument(
+        '--http2',
+        action='store_true',
+        help=(
+            'Accept cleartext HTTP/2 from clients with prior knowledge and from HTTP/1.1 requests with "Upgrade: h2c". '
+            'The streams of a connection are handled concurrently. Only with the "threaded" engine.'
+        )
+    )
+    arg_parser.add_argument(
+        '--http2-max-streams',
+        metavar='INT',
+        type=type_positive_int,
+        default=100,
+        help='The maximum number of concurrent streams of an HTTP/2 connection. [100]'
+    )
+    arg_parser.add_argument(
+        '--max-headers',
+        metavar='INT',
+        type=type_positive_int,
+        default=100,
+        help='The maximum number of headers in a request. [100]'
+    )
+    arg_parser.add_argument(
+        '--max-header-size',
+        metavar='BYTES',
+        type=type_positive_int,
+        default=16384,
+        help='The maximum size of the status line and headers of a request. [16384]'
+    )
+    arg_parser.add_argument(
+        '--max-url-length',
+        metavar='INT',
+        type=type_positive_int,
+        default=8192,
+        help='The maximum length of the URL of a request. [8192]'
+    )
+    arg_parser.add_argument(
+        '--max-body-size',
+        metavar='BYTES',
+        type=type_positive_int,
+        default=None,
+        help='The maximum size of the body of a request. Unlimited by default.'
+    )
+    arg_parser.add_argument(
+        '--max-pipelined-requests',
+        metavar='INT',
+        type=type_positive_int,
+        default=16,
+        help=(
+            'The maximum number of pipelined requests of a connection handled at the same time by the "eventloop" engine. '
+            'The "threaded" engine handles them one by one. [16]'
+        )
+    )
+    arg_parser.add_argument(
+        '--recv-size',
+        metavar='BYTES',
+        type=type_positive_int,
+        default=65536,
+        help='The maximum size of each read from a connection. [65536]'
+    )
+    arg_parser.add_argument(
+        '--cache-size',
+        metavar='BYTES',
+        type=type_positive_int,
+        default=None,
+        help=(
+            'Cache the responses to GET requests that allow it with "Cache-Control: max-age", up to this many bytes. '
+            'Concurrent requests for a response that is not cached yet wait for the first one. Disabled by default.'
+        )
+    )
+    arg_parser.add_argument(
+        '--cache-vary',
+        metavar='HEADER[,HEADER...]',
+        type=type_cache_vary,
+        default=(),
+        help='Request headers that are part of the cache key. Responses that vary on other headers are not cached.'
+    )
+    arg_parser.add_argument(
+        '--compression',
+        metavar='ENCODING[,ENCODING...]',
+        type=type_compression,
+        default=(),
+        help=(
+            'Compress responses with the first of these encodings the client accepts. '
+            f'Available: {", ".join(SUPPORTED_ENCODINGS)}. Disabled by default.'
+        )
+    )
+    arg_parser.add_argument(
+        '--compression-min-size',
+        metavar='BYTES',
+        type=type_non_negative_int,
+        default=1024,
+        help='Smaller responses are not compressed. [1024]'
+    )
+    arg_parser.add_argument(
+        '--compression-types',
+        metavar='TYPE[,TYPE...]',
+        type=type_content_types,
+        default=DEFAULT_CONTENT_TYPES,
+        help=(
+            'Content types that are compressed. Types ending with "/" match any subtype, and starting with "+" match the suffix. '
+            f'[{",".join(DEFAULT_CONTENT_TYPES)}]'
+        )
+    )
+    arg_parser.add_argument(
+        '--compression-cache-size',
+        metavar='BYTES',
+        type=type_positive_int,
+        default=16777216,
+        help='Compressed bodies of responses with a validator or "max-age" are cached up to this many bytes. [16777216]'
+    )
+    arg_parser.add_argument(
+        '--static',
+        metavar='URL_PREFIX:DIR',
+        type=type_static,
+        action='append',
+        default=[],
+        help=(
+            'Serve the files of DIR under URL_PREFIX without calling the application, with "sendfile". '
+            'Can be used several times.'
+        )
+    )
+    arg_parser.add_argument(
+        '--access-log',
+        metavar='PATH|-|off',
+        type=type_access_log,
+        default='-',
+        help='File where requests are logged. "-" is the standard output and "off" disables it. [-]'
+    )
+    arg_parser.add_argument(
+        '--access-log-format',
+        metavar='FORMAT',
+        type=type_access_log_format,
+        default=DEFAULT_ACCESS_LOG_FORMAT,
+        help=(
+            'Format of each line of the access log. '
+            'Fields: {remote_addr} {remote_port} {method} {url} {version} {status} {time} {duration_ms}. '
+            f'[{DEFAULT_ACCESS_LOG_FORMAT}]'
+        )
+    )
+    arg_parser.add_argument(
+        '--access-log-policy',
+        choices=('drop', 'block'),
+        default='drop',
+        help=(
+            'What to do when lines are logged faster than they are written. '
+            '"drop" discards them and "block" makes requests wait. [drop]'
+        )
+    )
+    arg_parser.add_argument(
+        '--metrics',
+        metavar='HOST:PORT|unix:PATH',
+        type=type_bind,
+        default=None,
+        help=(
+            'Expose metrics in the Prometheus text format at this address. '
+            'With several workers, each one uses the next port or appends its index to the socket path. Disabled by default.'
+        )
+    )
+    arg_parser.add_argument(
+        '--profile-sample-rate',
+        metavar='FRACTION',
+        type=type_sample_rate,
+        default=0,
+        help=(
+            'Fraction of the requests profiled with cProfile, one at a time. The profiles are aggregated by route, '
+            'and each process saves them to --profile-dir on SIGUSR1. Disabled by default.'
+        )
+    )
+    arg_parser.add_argument(
+        '--profile-trusted',
+        metavar='CIDR[,CIDR...]',
+        type=type_networks,
+        default=(),
+        help=f'Requests from these networks with the "{TRIGGER_HEADER}" header are always profiled. Disabled by default.'
+    )
+    arg_parser.add_argument(
+        '--profile-dir',
+        metavar='DIR',
+        type=type_profile_dir,
+        default='profiles',
+        help='Directory where the profiles are saved, as pstats files. [profiles]'
+    )
+    args = arg_parser.parse_args()
+
+    if args.interpreters is not None:
+        if interpreters is None:
+            arg_parser.error('--interpreters requires Python 3.12+')
+
+        if not args.app or args.interface == 'asgi':
+            arg_parser.error('--interpreters requires a WSGI application')
+
+        if args.preload:
+            arg_parser.error('--interpreters can\'t be used with --preload, each subinterpreter imports the application')
+
+    return args
 
 
-def get_wsgi_application(app_module_path: str) -> 'WSGIApplication':
+def get_application(app_module_path: str) -> Any:
     module_path, app_name = app_module_path.split(':', 1)
 
     curr: ModuleType = __import__(module_path)
@@ -171,19 +724,129 @@ def main() -> None:
     args = get_args()
 
     server_addr = (args.host, args.port)
+    binds: tuple[str, ...] = tuple(args.bind)
+
+    if binds:
+        _, address = parse_bind(binds[0])
+
+        # The application sees the first address as the server one, Unix sockets have no port
+        server_addr = ('localhost', 80) if isinstance(address, str) else address
     app: 'WSGIApplication' = echo_wsgi_app
 
-    if args.app:
-        if args.chdir:
-            os.chdir(args.chdir)
-            sys.path.insert(1, os.getcwd())
+    if args.app and args.chdir:
+        os.chdir(args.chdir)
+        sys.path.insert(1, os.getcwd())
+
+    # Free-threaded builds already run the threads in parallel, with a single copy of the application
+    use_interpreters = args.interpreters is not None and is_gil_enabled()
+
+    if args.interpreters is not None and not use_interpreters:
+        print('INFO: The GIL is disabled, the application runs in the threads instead of subinterpreters')
+
+    def load_app() -> None:
+        nonlocal app
+
+        if use_interpreters:
+            interpreter_pool = InterpreterPool(args.app, args.interpreters, server_addr, multiprocess, args.warmup)
+            interpreter_pool.start()
+            atexit.register(interpreter_pool.close)
+            server.on_request = interpreter_pool.handle_request
+            return
+
+        loaded_app = get_application(args.app) if args.app else echo_asgi_app if args.interface == 'asgi' else app
+
+        if args.interface == 'asgi' or (args.interface == 'auto' and is_asgi_application(loaded_app)):
+            server.asgi_app = loaded_app
+        else:
+            app = loaded_app
+
+        if args.warmup:
+            started_at = time.perf_counter()
+            get_application(args.warmup)(loaded_app)
+            print(f'INFO: Warmed up in {time.perf_counter() - started_at:.2f} s')
+
+    def preload_app() -> None:
+        # Collections while importing would leave freed holes in the pages the workers share
+        gc.disable()
+        started_at = time.perf_counter()
+
+        try:
+            load_app()
+        finally:
+            # What exists now is never collected, so the workers don't write to its pages when collecting
+            gc.freeze()
+            gc.enable()
+
+        print(f'INFO: Preloaded the application in {time.perf_counter() - started_at:.2f} s ({gc.get_freeze_count()} objects frozen)')
 
-        app = get_wsgi_application(args.app)
+    multiprocess = args.workers > 1
+    environ_template = create_environ_template(server_addr, multiprocess)
 
     def handle_request(request: HTTPRequest, request_addr: Address) -> HTTPResponse:
-        return wsgi_server(app, request, request_addr, server_addr)
+        return wsgi_server(app, request, request_addr, server_addr, multiprocess, environ_template)
+
+    with WebServer(
+        server_addr,
+        on_request=handle_request,
+        max_threads=args.threads,
+        min_threads=args.min_threads,
+        queue_size=args.queue_size,
+        backlog=args.backlog,
+        keepalive_timeout=args.keepalive_timeout,
+        header_timeout=args.header_timeout,
+        body_timeout=args.body_timeout,
+        write_timeout=args.write_timeout,
+        max_requests_per_connection=args.max_requests_per_connection,
+        engine=args.engine,
+        event_loops=args.event_loops,
+        max_headers=args.max_headers,
+        max_header_size=args.max_header_size,
+        max_url_length=args.max_url_length,
+        max_body_size=args.max_body_size,
+        max_pipelined_requests=args.max_pipelined_requests,
+        recv_size=args.recv_size,
+        max_in_flight=args.max_in_flight,
+        max_queue_wait=args.max_queue_wait,
+        retry_after=args.retry_after,
+        cache_size=args.cache_size,
+        cache_vary=args.cache_vary,
+        compression=args.compression,
+        compression_min_size=args.compression_min_size,
+        compression_types=args.compression_types,
+        compression_cache_size=args.compression_cache_size,
+        static=tuple(args.static),
+        binds=binds,
+        tcp_nodelay=args.tcp_nodelay,
+        tcp_defer_accept=args.tcp_defer_accept,
+        tcp_fastopen=args.tcp_fastopen,
+        socket_rcvbuf=args.socket_rcvbuf,
+        socket_sndbuf=args.socket_sndbuf,
+        profile_sample_rate=args.profile_sample_rate,
+        profile_trusted=args.profile_trusted,
+        profile_dir=args.profile_dir,
+        http2=args.http2,
+        http2_max_streams=args.http2_max_streams,
+        access_log=args.access_log,
+        access_log_format=args.access_log_format,
+        access_log_policy=args.access_log_policy,
+        metrics_bind=args.metrics
+    ) as server:
+        if args.workers > 1:
+            if args.preload:
+                preload_app()
+                Master(server, args.workers).run()
+                return
+
+            # Each worker imports the application after being forked
+            Master(server, args.workers, on_worker_start=load_app).run()
+            return
+
+        # Without workers the objects of the application are still frozen, so collections don't traverse them
+        if args.preload:
+            preload_app()
+        else:
+            load_app()
 
-    with WebServer(server_addr, on_request=handle_request, max_threads=args.threads, backlog=args.backlog) as server:
         server.listen()
 
 
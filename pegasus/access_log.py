@@ -0,0 +1,145 @@
+from typing import IO, Literal
+from threading import Thread
+import queue
+import time
+import sys
+
+
+AccessLogPolicy = Literal['drop', 'block']
+
+DEFAULT_ACCESS_LOG_FORMAT = 'INFO: {remote_addr}:{remote_port} - "{method} {url} {version}" {status}'
+
+ACCESS_LOG_FIELDS = ('remote_addr', 'remote_port', 'method', 'url', 'version', 'status', 'time', 'duration_ms')
+
+# timestamp, client address, method, url, version, status, error message, duration in seconds
+LogEntry = tuple[float, tuple[str, int], str, str, str, str, str | None, float]
+
+
+def validate_access_log_format(format: str) -> None:
+    # Raises KeyError, IndexError or ValueError if the format is not valid
+    format.format(**{field: '' for field in ACCESS_LOG_FIELDS})
+
+
+class AccessLog:
+    # Lines are formatted and written by a background thread, so requests never wait for the output
+
+    __slots__ = ('path', 'format', 'policy', 'batch_size', '_queue', '_thread', '_file', '_dropped')
+
+    def __init__(
+        self,
+        path: str,
+        format: str = DEFAULT_ACCESS_LOG_FORMAT,
+        policy: AccessLogPolicy = 'drop',
+        queue_size: int = 8192,
+        batch_size: int = 256
+    ) -> None:
+        assert queue_size > 0
+        assert batch_size > 0
+
+        validate_access_log_format(format)
+
+        # "-" is the standard output
+        self.path: str = path
+        self.format: str = format
+        # What to do with new lines while the queue is full
+        self.policy: AccessLogPolicy = policy
+        self.batch_size: int = batch_size
+
+        self._queue: queue.Queue[LogEntry | None] = queue.Queue(queue_size)
+        self._thread: Thread | None = None
+        self._file: IO[str] | None = None
+        self._dropped: int = 0
+
+    def start(self) -> None:
+        # Called after forking, threads and buffers are not shared between workers
+        if self.path == '-':
+            self._file = sys.stdout
+        else:
+            self._file = open(self.path, 'a', encoding='utf-8')
+
+        self._thread = Thread(target=self._write_lines, name='access-log', daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float | None = 10) -> None:
+        if self._thread is None:
+            return
+
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+        if self._file is not None and self._file is not sys.stdout:
+            self._file.close()
+
+        self._file = None
+
+    def log(self, addr: tuple[str, int], method: str, url: str, version: str, status: str, duration: float) -> None:
+        self._put((time.time(), addr, method, url, version, status, None, duration))
+
+    def log_error(self, addr: tuple[str, int], status: str, msg: str) -> None:
+        self._put((time.time(), addr, '', '', '', status, msg, 0))
+
+    def _put(self, entry: LogEntry) -> None:
+        if self.policy == 'block':
+            self._queue.put(entry)
+            return
+
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            # Counted under the lock of the queue, many threads drop lines at once
+            with self._queue.mutex:
+                self._dropped += 1
+
+    def _format_entry(self, entry: LogEntry) -> str:
+        timestamp, addr, method, url, version, status, error_msg, duration = entry
+
+        if error_msg is not None:
+            line = f'ERROR: {addr[0]}:{addr[1]} - {status}'
+
+            if error_msg:
+                line += f' - {error_msg.rstrip()}'
+
+            return line + '\n'
+
+        return self.format.format(
+            remote_addr=addr[0],
+            remote_port=addr[1],
+            method=method,
+            url=url,
+            version=version,
+            status=status,
+            time=time.strftime('%d/%b/%Y:%H:%M:%S %z', time.localtime(timestamp)),
+            duration_ms=f'{duration * 1000:.3f}'
+        ) + '\n'
+
+    def _write_lines(self) -> None:
+        assert self._file is not None
+
+        while True:
+            entries = [self._queue.get()]
+
+            # Everything queued meanwhile is written at once
+            while len(entries) < self.batch_size and entries[-1] is not None:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = [self._format_entry(entry) for entry in entries if entry is not None]
+
+            with self._queue.mutex:
+                dropped = self._dropped
+                self._dropped = 0
+
+            if dropped:
+                lines.append(f'WARNING: {dropped} access log lines were dropped, the queue was full\n')
+
+            try:
+                self._file.write(''.join(lines))
+                self._file.flush()
+            except (OSError, ValueError):
+                pass
+
+            if entries[-1] is None:
+                return
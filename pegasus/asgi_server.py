@@ -0,0 +1,653 @@
+from http_parser import http_status, HTTPHeader, HTTPRequest, HTTPResponse, ParsingError, generate_http_status
+from request_body import CONTINUE_RESPONSE
+from file_wrapper import FileWrapper
+from listeners import UNIX_CLIENT_ADDR
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+from urllib.parse import unquote
+from http import HTTPStatus
+import traceback
+import asyncio
+import inspect
+import socket
+import time
+
+
+if TYPE_CHECKING:
+    from web_server import WebServer
+
+
+Address = tuple[str, int]
+
+ASGIScope = dict[str, Any]
+ASGIMessage = dict[str, Any]
+ASGIReceive = Callable[[], Awaitable[ASGIMessage]]
+ASGISend = Callable[[ASGIMessage], Awaitable[None]]
+ASGIApplication = Callable[[ASGIScope, ASGIReceive, ASGISend], Awaitable[None]]
+
+ASGI_VERSION = {'version': '3.0', 'spec_version': '2.3'}
+
+DISCONNECT_MESSAGE: ASGIMessage = {'type': 'http.disconnect'}
+
+# Request body received but not read by the application yet, reading from the socket is paused past it
+MAX_BUFFERED_BODY = 1048576
+
+# Files are sent in slices of this size, each one has to be sent before the write timeout
+SENDFILE_SLICE = 262144
+
+
+def is_asgi_application(app: object) -> bool:
+    # ASGI 3 applications are coroutine functions, or objects whose `__call__` is one
+    return inspect.iscoroutinefunction(app) or inspect.iscoroutinefunction(getattr(app, '__call__', None))
+
+
+def get_status(status: int) -> str:
+    try:
+        return '%d %s' % (status, HTTPStatus(status).phrase)
+    except ValueError:
+        return '%d Unknown' % status
+
+
+class ClientDisconnected(OSError):
+    pass
+
+
+class LifespanError(Exception):
+    pass
+
+
+class Lifespan:
+    # Runs the "lifespan" scope, so the application can set up and release what its requests share
+
+    __slots__ = ('app', 'state', 'supported', '_messages', '_startup', '_shutdown', '_task')
+
+    def __init__(self, app: ASGIApplication) -> None:
+        self.app: ASGIApplication = app
+        # Copied into the scope of every request
+        self.state: dict[str, Any] = {}
+        self.supported: bool = True
+
+        self._messages: asyncio.Queue[ASGIMessage] = asyncio.Queue()
+        self._startup: asyncio.Future[None] | None = None
+        self._shutdown: asyncio.Future[None] | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    async def startup(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        self._startup = loop.create_future()
+        self._shutdown = loop.create_future()
+        self._task = loop.create_task(self._run())
+
+        await self._messages.put({'type': 'lifespan.startup'})
+        await self._startup
+
+    async def shutdown(self, timeout: float = 30) -> None:
+        if not self.supported or self._task is None or self._task.done():
+            return
+
+        assert self._shutdown is not None
+
+        await self._messages.put({'type': 'lifespan.shutdown'})
+        await asyncio.wait_for(self._shutdown, timeout)
+
+    async def _run(self) -> None:
+        assert self._startup is not None and self._shutdown is not None
+
+        scope: ASGIScope = {'type': 'lifespan', 'asgi': ASGI_VERSION, 'state': self.state}
+
+        try:
+            await self.app(scope, self._messages.get, self._send)
+
+        except Exception as error:
+            # Applications without lifespan support fail on the unknown scope
+            if not self._startup.done():
+                self.supported = False
+                print(f'WARNING: The application does not support the ASGI lifespan ({error!r})')
+            else:
+                traceback.print_exc()
+
+        finally:
+            for future in (self._startup, self._shutdown):
+                if not future.done():
+                    future.set_result(None)
+
+    async def _send(self, message: ASGIMessage) -> None:
+        assert self._startup is not None and self._shutdown is not None
+
+        message_type = message['type']
+        future = self._startup if message_type.startswith('lifespan.startup.') else self._shutdown
+
+        if future.done():
+            return
+
+        if message_type.endswith('.failed'):
+            future.set_exception(LifespanError(message.get('message', '')))
+        else:
+            future.set_result(None)
+
+
+class RequestCycle:
+    # A request and its response, the application talks to it with `receive` and `send`
+
+    __slots__ = (
+        'conn', 'request', 'scope', 'body', 'request_completed', 'response_started', 'head_sent', 'response_completed',
+        'status', 'headers', 'chunked', 'keep_alive', 'started_at', 'wakeup'
+    )
+
+    def __init__(self, conn: 'HTTPConnection', request: HTTPRequest) -> None:
+        self.conn: HTTPConnection = conn
+        self.request: HTTPRequest = request
+
+        path, _, query_string = request['url'].partition('?')
+        self.scope: ASGIScope = {
+            'type': 'http',
+            'asgi': ASGI_VERSION,
+            'http_version': request['version'][len('HTTP/'):],
+            'method': request['method'],
+            'scheme': 'http',
+            'path': unquote(path),
+            'raw_path': path.encode('latin-1'),
+            'query_string': query_string.encode('latin-1'),
+            'root_path': '',
+            # The parser already lowercases the names
+            'headers': [(key.encode('latin-1'), value.encode('latin-1')) for key, value in request['headers']],
+            'client': conn.addr,
+            'server': conn.server.web_server.addr,
+            'state': conn.server.lifespan.state.copy() if conn.server.lifespan is not None else {},
+        }
+
+        # Received, but not read by the application yet
+        self.body = bytearray()
+        self.request_completed: bool = False
+        self.response_started: bool = False
+        self.head_sent: bool = False
+        self.response_completed: bool = False
+        self.status: int = 0
+        self.headers: list[HTTPHeader] = []
+        self.chunked: bool = False
+        self.keep_alive: bool = False
+        self.started_at: float = time.perf_counter()
+        # Set when there is more body, or the client disconnected
+        self.wakeup = asyncio.Event()
+
+    async def run(self, app: ASGIApplication) -> None:
+        try:
+            await app(self.scope, self.receive, self.send)
+
+        except ClientDisconnected:
+            pass
+
+        except Exception:
+            traceback.print_exc()
+            self._fail()
+
+        else:
+            if not self.response_completed:
+                print(f'ERROR: The application returned without completing the response to "{self.request["url"]}"')
+                self._fail()
+
+        finally:
+            # After sending the head, the client can only know something went wrong if the connection is closed
+            if not self.response_completed:
+                self.response_completed = True
+                self.conn.finish_cycle(False)
+
+    async def send_static(self, response: HTTPResponse) -> None:
+        # Responses of the static files, they were already logged
+        conn = self.conn
+        server = conn.server.web_server
+
+        self.status = int(response['status'][:3])
+        self.response_started = True
+        self.head_sent = True
+
+        try:
+            keep_alive = server._should_keep_alive(self.request, response, conn.requests_served)
+            head, body, self.keep_alive = server._serialize_response(self.request, response, keep_alive)
+            conn.write_buffers(head)
+
+            if isinstance(body, FileWrapper):
+                try:
+                    await conn.sendfile(body)
+                finally:
+                    body.close()
+
+            self.response_completed = True
+            self.wakeup.set()
+            conn.finish_cycle(self.keep_alive)
+
+        except ClientDisconnected:
+            pass
+
+        finally:
+            if not self.response_completed:
+                self.response_completed = True
+                conn.finish_cycle(False)
+
+    def _fail(self) -> None:
+        if self.response_completed or self.head_sent or self.conn.closed:
+            return
+
+        self.status = http_status.HTTP_500_INTERNAL_SERVER_ERROR
+        self.conn.write(self.conn.server.web_server._process_error({
+            'status': generate_http_status(self.status),
+            'headers': [],
+            'body': None
+        }, self.conn.addr))
+
+        self.response_completed = True
+        self.conn.finish_cycle(False)
+
+    async def receive(self) -> ASGIMessage:
+        conn = self.conn
+
+        while not self.response_completed and not conn.closed:
+            if not self.request_completed:
+                if self.body or conn.parser.completed:
+                    data = bytes(self.body)
+                    self.body.clear()
+                    self.request_completed = conn.parser.completed
+
+                    conn.resume_reading()
+
+                    return {'type': 'http.request', 'body': data, 'more_body': not self.request_completed}
+
+                # The client is waiting for confirmation before sending the body
+                if conn.parser.expect_continue:
+                    conn.parser.expect_continue = False
+                    conn.write(CONTINUE_RESPONSE)
+
+            # Once the body was read in full, the next message is the disconnection
+            self.wakeup.clear()
+            await self.wakeup.wait()
+
+        return DISCONNECT_MESSAGE
+
+    async def send(self, message: ASGIMessage) -> None:
+        conn = self.conn
+        message_type = message['type']
+
+        if conn.closed:
+            raise ClientDisconnected('The client disconnected.')
+
+        if self.response_completed:
+            raise RuntimeError('The response was already completed.')
+
+        if message_type == 'http.response.start':
+            if self.response_started:
+                raise RuntimeError('"http.response.start" sent twice.')
+
+            self.response_started = True
+            self.status = message['status']
+            self.headers = [(key.decode('latin-1'), value.decode('latin-1')) for key, value in message.get('headers', ())]
+            return
+
+        if message_type != 'http.response.body':
+            raise RuntimeError(f'Unexpected message "{message_type}".')
+
+        if not self.response_started:
+            raise RuntimeError('"http.response.body" sent before "http.response.start".')
+
+        body: bytes = message.get('body', b'')
+        more_body: bool = message.get('more_body', False)
+
+        if not self.head_sent:
+            self.head_sent = True
+            conn.write_buffers(self._serialize_head(body, more_body))
+
+            if not more_body:
+                self._complete()
+                return
+
+        if body:
+            conn.write(b'%x\r\n%s\r\n' % (len(body), body) if self.chunked else body)
+
+        if not more_body:
+            if self.chunked:
+                conn.write(b'0\r\n\r\n')
+
+            self._complete()
+            return
+
+        await conn.drain()
+
+    def _serialize_head(self, body: bytes, more_body: bool) -> list[bytes]:
+        server = self.conn.server.web_server
+
+        response: HTTPResponse = {'status': get_status(self.status), 'headers': self.headers, 'body': None}
+        self.keep_alive = server._should_keep_alive(self.request, response, self.conn.requests_served)
+
+        # The whole body in a single message, its length is known
+        if not more_body:
+            response['body'] = bytes(body)
+            return server._serialize_http_response(response, self.keep_alive)
+
+        response['body'] = iter(())
+
+        if any(key.lower() == 'content-length' for key, _ in self.headers):
+            return server._serialize_http_response(response, self.keep_alive)
+
+        # HTTP/1.0 clients don't understand chunks, the end of the body is signaled by closing the connection
+        if self.request['version'] == 'HTTP/1.0':
+            self.keep_alive = False
+            return server._serialize_http_response(response)
+
+        self.chunked = True
+        return server._serialize_http_response(response, self.keep_alive, chunked=True)
+
+    def _complete(self) -> None:
+        self.response_completed = True
+        self.wakeup.set()
+
+        server = self.conn.server.web_server
+        duration = time.perf_counter() - self.started_at
+
+        server._log_client(self.conn.addr, self.request, {'status': get_status(self.status), 'headers': [], 'body': None}, duration)
+        server._metrics.increment('requests')
+        server._metrics.observe('app', duration)
+
+        self.conn.finish_cycle(self.keep_alive)
+
+
+class HTTPConnection(asyncio.Protocol):
+    __slots__ = (
+        'server', 'transport', 'addr', 'parser', 'cycle', 'requests_served', 'received_data', 'closed', 'accepted_at',
+        'request_started_at', '_reading_paused', '_writing_paused', '_drain_waiter', '_timer'
+    )
+
+    def __init__(self, server: 'ASGIServer') -> None:
+        self.server: ASGIServer = server
+        self.transport: asyncio.Transport | None = None
+        self.addr: Address = ('', 0)
+        self.parser = server.web_server._create_parser()
+        self.cycle: RequestCycle | None = None
+        self.requests_served: int = 0
+        # Whether part of the next request was received
+        self.received_data: bool = False
+        self.closed: bool = False
+        self.accepted_at: float = time.perf_counter()
+        self.request_started_at: float = 0
+
+        self._reading_paused: bool = False
+        self._writing_paused: bool = False
+        self._drain_waiter: asyncio.Future[None] | None = None
+        self._timer: asyncio.TimerHandle | None = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.Transport)
+
+        self.transport = transport
+        # asyncio already disables Nagle's algorithm on TCP sockets
+        peername = transport.get_extra_info('peername')
+        self.addr = (peername[0], peername[1]) if peername else UNIX_CLIENT_ADDR
+
+        self.server.web_server._metrics.connection_opened()
+        self._set_timeout(self.server.web_server.header_timeout)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.closed = True
+        self._set_timeout(None)
+        self.server.web_server._metrics.connection_closed()
+
+        if self.cycle is not None:
+            self.cycle.wakeup.set()
+
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_exception(ClientDisconnected('The client disconnected.'))
+
+    def pause_writing(self) -> None:
+        self._writing_paused = True
+
+    def resume_writing(self) -> None:
+        self._writing_paused = False
+
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+
+    def data_received(self, data: bytes) -> None:
+        web_server = self.server.web_server
+
+        if not self.received_data:
+            self.received_data = True
+            self.request_started_at = time.perf_counter()
+
+            if not self.requests_served:
+                web_server._metrics.observe('accept_to_first_byte', self.request_started_at - self.accepted_at)
+            else:
+                self._set_timeout(web_server.header_timeout)
+
+        self._parse(self.parser.feed(data))
+
+    def _parse(self, error: ParsingError | None) -> None:
+        web_server = self.server.web_server
+
+        if error:
+            web_server._metrics.increment('parse_errors')
+            body = (error.msg + '\n') if error.msg and error.msg[-1] != '\n' else error.msg
+            self.send_error(error.status, body.encode())
+            return
+
+        if self.cycle is None:
+            if not self.parser.headers_completed:
+                return
+
+            web_server._metrics.observe('header_parse', time.perf_counter() - self.request_started_at)
+
+            if web_server.max_in_flight is not None and self.server.in_flight >= web_server.max_in_flight:
+                web_server._log_rejected(self.addr)
+                self.write(web_server._overload_response)
+                self.close()
+                return
+
+            self._start_cycle()
+
+        cycle = self.cycle
+        assert cycle is not None
+
+        if not cycle.request_completed:
+            cycle.body += self.parser.take_body()
+            cycle.wakeup.set()
+
+        if self.parser.completed:
+            # Pipelined requests wait in the socket until the response is complete, and the application has no time limit
+            self._set_timeout(None)
+            self.pause_reading()
+        else:
+            # Slow but steady uploads are not timed out
+            self._set_timeout(web_server.body_timeout)
+
+            if len(cycle.body) > MAX_BUFFERED_BODY:
+                self.pause_reading()
+
+    def _start_cycle(self) -> None:
+        self.requests_served += 1
+        self.server.in_flight += 1
+
+        self.cycle = RequestCycle(self, self.parser.get_result())
+        web_server = self.server.web_server
+
+        # Static files are sent without entering the application
+        response = web_server._serve_static(self.cycle.request, self.addr) if web_server._static_files is not None else None
+        coroutine = self.cycle.run(self.server.app) if response is None else self.cycle.send_static(response)
+
+        asyncio.get_running_loop().create_task(coroutine)
+
+    def finish_cycle(self, keep_alive: bool) -> None:
+        if self.cycle is not None:
+            self.cycle.wakeup.set()
+
+        self.cycle = None
+        self.server.in_flight -= 1
+
+        # Without reading the rest of the body, the next request can't be found
+        if not keep_alive or not self.parser.completed:
+            self.close()
+            return
+
+        self.parser.reset()
+        self.received_data = False
+        self._set_timeout(self.server.web_server.keepalive_timeout)
+        self.resume_reading()
+
+        if self.parser.has_buffered_data:
+            self.received_data = True
+            self.request_started_at = time.perf_counter()
+            self._set_timeout(self.server.web_server.header_timeout)
+            self._parse(self.parser.feed(b''))
+
+    def write(self, data: bytes) -> None:
+        if self.transport is not None and not self.closed:
+            self.transport.write(data)
+
+    def write_buffers(self, buffers: list[bytes]) -> None:
+        if self.transport is not None and not self.closed:
+            self.transport.writelines(buffers)
+
+    async def drain(self) -> None:
+        if self.closed:
+            raise ClientDisconnected('The client disconnected.')
+
+        if not self._writing_paused:
+            return
+
+        self._drain_waiter = asyncio.get_running_loop().create_future()
+
+        try:
+            await asyncio.wait_for(self._drain_waiter, self.server.web_server.write_timeout)
+        except TimeoutError:
+            self.server.web_server._metrics.increment('timeouts')
+            self.close()
+            raise ClientDisconnected('Timed out writing the response.')
+
+        finally:
+            self._drain_waiter = None
+
+    async def sendfile(self, file: FileWrapper) -> None:
+        assert file.offset is not None and file.length is not None
+        loop = asyncio.get_running_loop()
+
+        while file.length:
+            if self.transport is None or self.closed:
+                raise ClientDisconnected('The client disconnected.')
+
+            count = min(file.length, SENDFILE_SLICE)
+
+            try:
+                sent = await asyncio.wait_for(
+                    loop.sendfile(self.transport, file.filelike, file.offset, count),
+                    self.server.web_server.write_timeout
+                )
+            except TimeoutError:
+                self.server.web_server._metrics.increment('timeouts')
+                self.close()
+                raise ClientDisconnected('Timed out writing the response.')
+
+            except ConnectionError:
+                self.close()
+                raise ClientDisconnected('The client disconnected.')
+
+            # The file is shorter than announced, the client can only know the body ended when the connection is closed
+            if sent < count:
+                self.close()
+                raise ClientDisconnected('The file was truncated while being sent.')
+
+            file.offset += sent
+            file.length -= sent
+
+    def pause_reading(self) -> None:
+        if not self._reading_paused and self.transport is not None and not self.closed:
+            self._reading_paused = True
+            self.transport.pause_reading()
+
+    def resume_reading(self) -> None:
+        if self._reading_paused and self.transport is not None and not self.closed:
+            self._reading_paused = False
+            self.transport.resume_reading()
+
+    def send_error(self, status: int, body: bytes | None = None) -> None:
+        data = self.server.web_server._process_error({'status': generate_http_status(status), 'headers': [], 'body': body}, self.addr)
+
+        self.write(data)
+        self.close()
+
+    def close(self) -> None:
+        if self.transport is not None and not self.closed:
+            # What was written is still sent before closing
+            self.transport.close()
+            self.closed = True
+
+        self._set_timeout(None)
+
+        if self.cycle is not None:
+            self.cycle.wakeup.set()
+
+    def _set_timeout(self, timeout: float | None) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if timeout is not None and not self.closed:
+            self._timer = asyncio.get_running_loop().call_later(timeout, self._handle_timeout)
+
+    def _handle_timeout(self) -> None:
+        self._timer = None
+
+        # An idle persistent connection is closed silently
+        if self.cycle is None and self.received_data:
+            self.server.web_server._metrics.increment('timeouts')
+            self.send_error(http_status.HTTP_408_REQUEST_TIMEOUT)
+            return
+
+        if self.cycle is not None:
+            self.server.web_server._metrics.increment('timeouts')
+
+        self.close()
+
+
+class ASGIServer:
+    # Serves an ASGI application from a single asyncio event loop, requests don't hold threads while they wait
+
+    __slots__ = ('web_server', 'app', 'lifespan', 'in_flight')
+
+    def __init__(self, web_server: 'WebServer', app: ASGIApplication) -> None:
+        self.web_server: WebServer = web_server
+        self.app: ASGIApplication = app
+        self.lifespan: Lifespan | None = None
+        # Requests whose response is not complete yet
+        self.in_flight: int = 0
+
+    def run(self) -> None:
+        asyncio.run(self._serve())
+
+    async def _serve(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        self.lifespan = Lifespan(self.app)
+
+        try:
+            await self.lifespan.startup()
+        except LifespanError as error:
+            print(f'ERROR: The application failed to start ({error})')
+            raise SystemExit(1)
+
+        backlog = self.web_server.backlog
+        servers = [
+            await loop.create_server(
+                lambda: HTTPConnection(self),
+                sock=listener,
+                backlog=backlog if backlog is not None else socket.SOMAXCONN
+            )
+            for listener in self.web_server._listeners
+        ]
+
+        try:
+            await asyncio.gather(*(server.serve_forever() for server in servers))
+
+        finally:
+            for server in servers:
+                server.close()
+
+            try:
+                await self.lifespan.shutdown()
+            except (LifespanError, TimeoutError) as error:
+                print(f'ERROR: The application failed to shut down ({error!r})')
@@ -0,0 +1,577 @@
+from http_parser import generate_http_status, http_status, HTTPRequest
+from request_body import CONTINUE_RESPONSE
+from file_wrapper import FileWrapper
+from listeners import prepare_client
+from typing import TYPE_CHECKING
+from collections import deque
+from threading import Condition
+import itertools
+import selectors
+import traceback
+import tempfile
+import socket
+import heapq
+import time
+
+
+if TYPE_CHECKING:
+    from web_server import Address, WebServer
+
+
+# Streamed responses stop being produced while this many bytes are waiting to be written
+MAX_BUFFERED_RESPONSE = 1048576
+
+# Buffers gathered in a single write, below the IOV_MAX of every supported platform
+MAX_WRITE_BUFFERS = 64
+
+# Bytes of a file sent in a single `sendfile`, so a big file doesn't hold the event loop
+MAX_SENDFILE_SIZE = 1048576
+
+
+class ResponseSlot:
+    # Response of a dispatched request, filled by a worker thread and written by the event loop in request order
+
+    __slots__ = ('conn', 'chunks', 'buffered', 'finished', 'keep_alive', 'cancelled', 'ready_at', '_condition')
+
+    def __init__(self, conn: 'Connection') -> None:
+        self.conn: Connection = conn
+        self.chunks: deque[bytes | FileWrapper] = deque()
+        self.buffered: int = 0
+        self.finished: bool = False
+        self.keep_alive: bool = False
+        self.cancelled: bool = False
+        # When the application produced the first part of the response
+        self.ready_at: float | None = None
+        self._condition = Condition()
+
+    def push(self, data: bytes) -> None:
+        if not data:
+            return
+
+        with self._condition:
+            while self.buffered >= MAX_BUFFERED_RESPONSE and not self.cancelled:
+                self._condition.wait()
+
+            if self.cancelled:
+                raise ConnectionAbortedError('The connection was closed.')
+
+            self.chunks.append(data)
+            self.buffered += len(data)
+
+            if self.ready_at is None:
+                self.ready_at = time.perf_counter()
+
+        self.conn.loop.notify(self.conn)
+
+    def push_file(self, file: FileWrapper) -> None:
+        # The file is not buffered, it's sent from the kernel when its turn comes
+        with self._condition:
+            if self.cancelled:
+                file.close()
+                raise ConnectionAbortedError('The connection was closed.')
+
+            self.chunks.append(file)
+
+        self.conn.loop.notify(self.conn)
+
+    def finish(self, keep_alive: bool) -> None:
+        self.keep_alive = keep_alive
+        self.finished = True
+        self.conn.loop.notify(self.conn)
+
+    def consume(self, size: int) -> None:
+        with self._condition:
+            self.buffered -= size
+
+            if self.buffered < MAX_BUFFERED_RESPONSE:
+                self._condition.notify_all()
+
+    def cancel(self) -> None:
+        with self._condition:
+            self.cancelled = True
+            self._condition.notify_all()
+
+        for chunk in self.chunks:
+            if isinstance(chunk, FileWrapper):
+                chunk.close()
+
+
+class Connection:
+    __slots__ = (
+        'loop', 'socket', 'addr', 'parser', 'body', 'slots', 'requests_served', 'received_data', 'closing', 'out', 'file',
+        'events', 'deadline', 'accepted_at', 'request_started_at', 'headers_completed_at'
+    )
+
+    def __init__(self, loop: 'EventLoop', socket: socket.socket, addr: 'Address') -> None:
+        self.loop: EventLoop = loop
+        self.socket: socket.socket = socket
+        self.addr: Address = addr
+        self.parser = loop.server._create_parser()
+        self.body: tempfile.SpooledTemporaryFile[bytes] | None = None
+        self.slots: deque[ResponseSlot] = deque()
+        self.requests_served: int = 0
+        self.received_data: bool = False
+        self.closing: bool = False
+        self.out: list[memoryview] = []
+        self.file: FileWrapper | None = None
+        self.events: int = 0
+        self.deadline: float | None = None
+        self.accepted_at: float = time.perf_counter()
+        self.request_started_at: float = self.accepted_at
+        self.headers_completed_at: float | None = None
+
+
+# The last item is how long parsing the headers took
+Dispatch = tuple[Connection, HTTPRequest, ResponseSlot, int, float]
+
+
+class EventLoop:
+    __slots__ = (
+        'server', 'listeners', '_selector', '_connections', '_timeouts', '_timeout_ids', '_ready', '_waker', '_waker_socket',
+        '_running'
+    )
+
+    def __init__(self, server: 'WebServer', listeners: list[socket.socket]) -> None:
+        self.server: WebServer = server
+        self.listeners: list[socket.socket] = listeners
+
+        self._selector = selectors.DefaultSelector()
+        self._connections: set[Connection] = set()
+        self._timeouts: list[tuple[float, int, Connection]] = []
+        self._timeout_ids = itertools.count()
+        self._ready: deque[Connection] = deque()
+        self._waker, self._waker_socket = socket.socketpair()
+        self._running: bool = False
+
+        self._waker.setblocking(False)
+        self._waker_socket.setblocking(False)
+
+    def stop(self) -> None:
+        self._running = False
+        self._wake_up()
+
+    def close(self) -> None:
+        for conn in list(self._connections):
+            self._close_connection(conn)
+
+        self._selector.close()
+        self._waker.close()
+        self._waker_socket.close()
+
+    def notify(self, conn: Connection) -> None:
+        # Called from worker threads when a response slot of the connection changes
+        self._ready.append(conn)
+        self._wake_up()
+
+    def _wake_up(self) -> None:
+        try:
+            self._waker_socket.send(b'\0')
+        except OSError:
+            pass
+
+    def _set_deadline(self, conn: Connection, timeout: float | None) -> None:
+        if timeout is None:
+            conn.deadline = None
+            return
+
+        conn.deadline = time.monotonic() + timeout
+        heapq.heappush(self._timeouts, (conn.deadline, next(self._timeout_ids), conn))
+
+    def _can_read(self, conn: Connection) -> bool:
+        return (
+            not conn.closing
+            and len(conn.slots) < self.server.max_pipelined_requests
+            and conn.requests_served < self.server.max_requests_per_connection
+        )
+
+    def _update_events(self, conn: Connection) -> None:
+        events = 0
+
+        if self._can_read(conn):
+            events |= selectors.EVENT_READ
+
+        if conn.out or conn.file is not None or (conn.slots and conn.slots[0].chunks):
+            events |= selectors.EVENT_WRITE
+
+        if events == conn.events:
+            return
+
+        if not conn.events:
+            self._selector.register(conn.socket, events, conn)
+        elif not events:
+            self._selector.unregister(conn.socket)
+        else:
+            self._selector.modify(conn.socket, events, conn)
+
+        conn.events = events
+
+    def _close_connection(self, conn: Connection) -> None:
+        if conn not in self._connections:
+            return
+
+        self._connections.discard(conn)
+        self.server._metrics.connection_closed()
+        conn.deadline = None
+
+        if conn.events:
+            self._selector.unregister(conn.socket)
+            conn.events = 0
+
+        if conn.body is not None:
+            conn.body.close()
+            conn.body = None
+
+        if conn.file is not None:
+            conn.file.close()
+            conn.file = None
+
+        # Workers still producing responses for this connection are stopped
+        for slot in conn.slots:
+            slot.cancel()
+
+        conn.socket.close()
+
+    def _accept(self, listener: socket.socket) -> None:
+        while True:
+            try:
+                client_socket, addr = listener.accept()
+            except OSError:
+                return
+
+            client_socket.setblocking(False)
+            addr = prepare_client(client_socket, addr, self.server.tcp_nodelay)
+
+            conn = Connection(self, client_socket, addr)
+            self._connections.add(conn)
+            self.server._metrics.connection_opened()
+            self._update_events(conn)
+            self._set_deadline(conn, self.server.header_timeout)
+
+    def _respond_from_loop(self, conn: Connection, data: bytes, keep_alive: bool) -> None:
+        slot = ResponseSlot(conn)
+        slot.chunks.append(data)
+        slot.buffered = len(data)
+        slot.keep_alive = keep_alive
+        slot.finished = True
+
+        conn.slots.append(slot)
+
+    def _send_error(self, conn: Connection, status: int, body: bytes | None = None) -> None:
+        data = self.server._process_error({'status': generate_http_status(status), 'headers': [], 'body': body}, conn.addr)
+
+        conn.closing = True
+        conn.received_data = False
+
+        self._respond_from_loop(conn, data, False)
+        self._write(conn)
+
+    def _reject(self, conn: Connection) -> None:
+        if conn.body is not None:
+            conn.body.close()
+            conn.body = None
+
+        conn.headers_completed_at = None
+        conn.closing = True
+        conn.received_data = False
+
+        self.server._log_rejected(conn.addr)
+        self._respond_from_loop(conn, self.server._overload_response, False)
+
+    def _dispatch(self, conn: Connection) -> None:
+        # Shedding the request here keeps the queue short enough for the accepted ones to be served in time
+        if self.server._is_overloaded():
+            self._reject(conn)
+            return
+
+        request = conn.parser.get_result()
+
+        assert conn.headers_completed_at is not None
+        header_parse_time = conn.headers_completed_at - conn.request_started_at
+
+        if conn.body is not None:
+            conn.body.seek(0)
+            request['body'] = conn.body
+            conn.body = None
+
+            self.server._metrics.observe('body_read', time.perf_counter() - conn.headers_completed_at)
+
+        conn.headers_completed_at = None
+
+        slot = ResponseSlot(conn)
+
+        # The loop never waits for the queue, the workers may be waiting for it to write their responses
+        if not self.server._worker_pool.submit((conn, request, slot, conn.requests_served + 1, header_parse_time), False):
+            if request['body'] is not None:
+                request['body'].close()
+
+            self._reject(conn)
+            return
+
+        # The worker notifies the loop about the slot, so it's always added before the loop looks for it
+        conn.slots.append(slot)
+        conn.requests_served += 1
+        conn.received_data = False
+
+    def _parse(self, conn: Connection, data: bytes) -> None:
+        error = conn.parser.feed(data)
+
+        while True:
+            if error:
+                self.server._metrics.increment('parse_errors')
+                body = (error.msg + '\n') if error.msg and error.msg[-1] != '\n' else error.msg
+                self._send_error(conn, error.status, body.encode())
+                return
+
+            if not conn.parser.headers_completed:
+                return
+
+            if conn.headers_completed_at is None:
+                conn.headers_completed_at = time.perf_counter()
+                self.server._metrics.observe('header_parse', conn.headers_completed_at - conn.request_started_at)
+
+            if conn.parser.has_body:
+                if conn.body is None:
+                    conn.body = tempfile.SpooledTemporaryFile(self.server.body_spool_size)
+
+                conn.body.write(conn.parser.take_body())
+
+                # The client is waiting for confirmation before sending the body
+                if conn.parser.expect_continue:
+                    conn.parser.expect_continue = False
+                    self._respond_from_loop(conn, CONTINUE_RESPONSE, True)
+
+            if not conn.parser.completed:
+                return
+
+            self._dispatch(conn)
+            conn.parser.reset()
+
+            # The rest of the buffer is parsed once there is room for more requests in flight
+            if not conn.parser.has_buffered_data or not self._can_read(conn):
+                return
+
+            conn.received_data = True
+            conn.request_started_at = time.perf_counter()
+            error = conn.parser.feed(b'')
+
+    def _read(self, conn: Connection) -> None:
+        try:
+            data = conn.socket.recv(self.server.recv_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._close_connection(conn)
+            return
+
+        if data == b'':
+            if conn.received_data:
+                self._send_error(conn, http_status.HTTP_400_BAD_REQUEST, b'Empty package received.\n')
+                return
+
+            if not conn.slots:
+                self._close_connection(conn)
+                return
+
+            # Half-closed by the client, the responses in flight are still written
+            conn.closing = True
+            self._update_events(conn)
+            return
+
+        if not conn.slots:
+            if not conn.received_data and conn.requests_served:
+                # The headers of the next request have `header_timeout` seconds in total
+                self._set_deadline(conn, self.server.header_timeout)
+            elif conn.parser.headers_completed:
+                # Slow but steady uploads are not timed out
+                self._set_deadline(conn, self.server.body_timeout)
+
+        if not conn.received_data:
+            conn.received_data = True
+            conn.request_started_at = time.perf_counter()
+
+            if not conn.requests_served:
+                self.server._metrics.observe('accept_to_first_byte', conn.request_started_at - conn.accepted_at)
+
+        self._parse(conn, data)
+
+        if conn in self._connections:
+            self._write(conn)
+
+    def _write(self, conn: Connection) -> None:
+        while conn.slots:
+            slot = conn.slots[0]
+
+            if not conn.out and conn.file is None:
+                # Checked before the chunks, every chunk is pushed before the slot is finished
+                finished = slot.finished
+
+                if slot.chunks:
+                    chunk = slot.chunks.popleft()
+
+                    if isinstance(chunk, FileWrapper):
+                        conn.file = chunk
+                    else:
+                        conn.out.append(memoryview(chunk))
+
+                        # The buffers up to the next file are gathered in a single write
+                        while slot.chunks and len(conn.out) < MAX_WRITE_BUFFERS:
+                            chunk = slot.chunks[0]
+
+                            if isinstance(chunk, FileWrapper):
+                                break
+
+                            conn.out.append(memoryview(chunk))
+                            slot.chunks.popleft()
+
+                elif finished:
+                    conn.slots.popleft()
+
+                    if slot.ready_at is not None:
+                        self.server._metrics.observe('send', time.perf_counter() - slot.ready_at)
+
+                    if not slot.keep_alive:
+                        self._close_connection(conn)
+                        return
+
+                    # Requests buffered while the limit of requests in flight was reached
+                    if conn.parser.has_buffered_data and not conn.parser.completed and self._can_read(conn):
+                        conn.received_data = True
+                        conn.request_started_at = time.perf_counter()
+                        self._parse(conn, b'')
+
+                        if conn not in self._connections:
+                            return
+                    continue
+
+                else:
+                    break
+
+            if conn.file is not None:
+                try:
+                    conn.file.send_nonblocking(conn.socket, MAX_SENDFILE_SIZE)
+                except (BlockingIOError, InterruptedError):
+                    break
+                except (OSError, EOFError):
+                    self._close_connection(conn)
+                    return
+
+                # The rest is sent on the next iterations, so other connections are not starved
+                if conn.file.length:
+                    break
+
+                conn.file.close()
+                conn.file = None
+                continue
+
+            try:
+                sent = conn.socket.sendmsg(conn.out)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self._close_connection(conn)
+                return
+
+            slot.consume(sent)
+
+            while sent:
+                if sent < len(conn.out[0]):
+                    conn.out[0] = conn.out[0][sent:]
+                    break
+
+                sent -= len(conn.out.pop(0))
+
+            if conn.out:
+                break
+
+        if conn.out or conn.file is not None or (conn.slots and conn.slots[0].chunks):
+            self._set_deadline(conn, self.server.write_timeout)
+        elif conn.slots:
+            # Waiting for the application
+            self._set_deadline(conn, None)
+        elif conn.closing:
+            self._close_connection(conn)
+            return
+        elif not conn.received_data:
+            self._set_deadline(conn, self.server.keepalive_timeout)
+        elif conn.deadline is None:
+            self._set_deadline(conn, self.server.body_timeout if conn.parser.headers_completed else self.server.header_timeout)
+
+        self._update_events(conn)
+
+    def _handle_ready(self) -> None:
+        try:
+            while self._waker.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        while self._ready:
+            conn = self._ready.popleft()
+
+            if conn in self._connections:
+                self._handle_events(conn, selectors.EVENT_WRITE)
+
+    def _handle_timeouts(self) -> None:
+        now = time.monotonic()
+
+        while self._timeouts and self._timeouts[0][0] <= now:
+            deadline, _, conn = heapq.heappop(self._timeouts)
+
+            # Outdated entry, the deadline was moved or the connection closed
+            if conn.deadline != deadline:
+                continue
+
+            if conn.received_data and not conn.slots:
+                self.server._metrics.increment('timeouts')
+                self._send_error(conn, http_status.HTTP_408_REQUEST_TIMEOUT)
+                continue
+
+            self._close_connection(conn)
+
+    def _get_select_timeout(self) -> float | None:
+        if not self._timeouts:
+            return None
+
+        return max(0, self._timeouts[0][0] - time.monotonic())
+
+    def _handle_events(self, conn: Connection, events: int) -> None:
+        try:
+            if events & selectors.EVENT_WRITE:
+                self._write(conn)
+
+            if events & selectors.EVENT_READ and conn in self._connections:
+                self._read(conn)
+
+        except Exception:
+            # Only this connection is dropped, the loop keeps serving the others
+            traceback.print_exc()
+            self._close_connection(conn)
+
+    def run(self) -> None:
+        self._running = True
+
+        # Listeners are registered with themselves as data, and connections with their `Connection`
+        for listener in self.listeners:
+            self._selector.register(listener, selectors.EVENT_READ, listener)
+
+        self._selector.register(self._waker, selectors.EVENT_READ)
+
+        while self._running:
+            for key, events in self._selector.select(self._get_select_timeout()):
+                if key.data is key.fileobj:
+                    self._accept(key.data)
+                    continue
+
+                if key.fileobj is self._waker:
+                    self._handle_ready()
+                    continue
+
+                conn: Connection = key.data
+
+                # It may have been closed by a previous event of this iteration
+                if conn not in self._connections:
+                    continue
+
+                self._handle_events(conn, events)
+
+            self._handle_timeouts()
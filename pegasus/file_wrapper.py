@@ -0,0 +1,109 @@
+from typing import IO
+import socket
+import stat
+import io
+import os
+
+
+class FileWrapper:
+    # `wsgi.file_wrapper`, regular files are sent by the kernel with `sendfile` instead of being read in Python
+
+    __slots__ = ('filelike', 'blksize', 'offset', 'length', '_fd')
+
+    def __init__(self, filelike: IO[bytes], blksize: int = 8192, offset: int | None = None, length: int | None = None) -> None:
+        self.filelike: IO[bytes] = filelike
+        self.blksize: int = blksize
+        # Where the body starts and how long it is, by default from the current position to the end of the file
+        self.offset: int | None = offset
+        self.length: int | None = length
+
+        self._fd: int | None = None
+
+    def resolve_range(self) -> bool:
+        # Returns False if the file can't be sent with `sendfile`, then it's iterated as any other body
+        if self._fd is not None:
+            return True
+
+        try:
+            fd = self.filelike.fileno()
+            file_stat = os.fstat(fd)
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return False
+
+        if not stat.S_ISREG(file_stat.st_mode):
+            return False
+
+        if self.offset is None:
+            try:
+                self.offset = self.filelike.tell()
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                return False
+
+        size = max(0, file_stat.st_size - self.offset)
+        self.length = size if self.length is None else min(self.length, size)
+        self._fd = fd
+
+        return True
+
+    def send(self, socket: socket.socket) -> None:
+        # For blocking sockets, or with timeout
+        assert self._fd is not None and self.offset is not None and self.length is not None
+
+        if self.length:
+            socket.sendfile(self.filelike, self.offset, self.length)
+
+        self.offset += self.length
+        self.length = 0
+
+    def send_nonblocking(self, socket: socket.socket, count: int) -> int:
+        assert self._fd is not None and self.offset is not None and self.length is not None
+
+        if not self.length:
+            return 0
+
+        sent = os.sendfile(socket.fileno(), self._fd, self.offset, min(count, self.length))
+
+        # The file is shorter than when the length was resolved
+        if sent == 0:
+            raise EOFError('The file was truncated while being sent.')
+
+        self.offset += sent
+        self.length -= sent
+
+        return sent
+
+    def __iter__(self) -> 'FileWrapper':
+        return self
+
+    def __next__(self) -> bytes:
+        # Regular files are read at explicit offsets, their descriptor may share its position with other requests
+        if self.resolve_range():
+            assert self._fd is not None and self.offset is not None and self.length is not None
+
+            data = os.pread(self._fd, min(self.blksize, self.length), self.offset) if self.length else b''
+
+            if not data:
+                raise StopIteration
+
+            self.offset += len(data)
+            self.length -= len(data)
+
+            return data
+
+        if self.offset is not None:
+            self.filelike.seek(self.offset)
+            self.offset = None
+
+        size = self.blksize if self.length is None else min(self.blksize, self.length)
+        data = self.filelike.read(size) if size else b''
+
+        if not data:
+            raise StopIteration
+
+        if self.length is not None:
+            self.length -= len(data)
+
+        return data
+
+    def close(self) -> None:
+        self.filelike.close()
@@ -0,0 +1,448 @@
+from http_parser import HTTPHeader
+from typing import Iterable
+from collections import deque
+
+
+# Header fields every connection starts with (RFC 7541, appendix A), indexed from 1
+STATIC_TABLE: tuple[HTTPHeader, ...] = (
+    (':authority', ''), (':method', 'GET'), (':method', 'POST'), (':path', '/'), (':path', '/index.html'),
+    (':scheme', 'http'), (':scheme', 'https'), (':status', '200'), (':status', '204'), (':status', '206'),
+    (':status', '304'), (':status', '400'), (':status', '404'), (':status', '500'), ('accept-charset', ''),
+    ('accept-encoding', 'gzip, deflate'), ('accept-language', ''), ('accept-ranges', ''), ('accept', ''),
+    ('access-control-allow-origin', ''), ('age', ''), ('allow', ''), ('authorization', ''), ('cache-control', ''),
+    ('content-disposition', ''), ('content-encoding', ''), ('content-language', ''), ('content-length', ''),
+    ('content-location', ''), ('content-range', ''), ('content-type', ''), ('cookie', ''), ('date', ''), ('etag', ''),
+    ('expect', ''), ('expires', ''), ('from', ''), ('host', ''), ('if-match', ''), ('if-modified-since', ''),
+    ('if-none-match', ''), ('if-range', ''), ('if-unmodified-since', ''), ('last-modified', ''), ('link', ''),
+    ('location', ''), ('max-forwards', ''), ('proxy-authenticate', ''), ('proxy-authorization', ''), ('range', ''),
+    ('referer', ''), ('refresh', ''), ('retry-after', ''), ('server', ''), ('set-cookie', ''),
+    ('strict-transport-security', ''), ('transfer-encoding', ''), ('user-agent', ''), ('vary', ''), ('via', ''),
+    ('www-authenticate', '')
+)
+
+STATIC_INDEXES: dict[HTTPHeader, int] = {header: index for index, header in reversed(list(enumerate(STATIC_TABLE, 1)))}
+STATIC_NAME_INDEXES: dict[str, int] = {name: index for index, (name, _) in reversed(list(enumerate(STATIC_TABLE, 1)))}
+
+# Code and length in bits of each byte, and of the end of string symbol (RFC 7541, appendix B)
+HUFFMAN_CODES: tuple[tuple[int, int], ...] = (
+    (0x1ff8, 13), (0x7fffd8, 23), (0xfffffe2, 28), (0xfffffe3, 28), (0xfffffe4, 28), (0xfffffe5, 28),
+    (0xfffffe6, 28), (0xfffffe7, 28), (0xfffffe8, 28), (0xffffea, 24), (0x3ffffffc, 30), (0xfffffe9, 28),
+    (0xfffffea, 28), (0x3ffffffd, 30), (0xfffffeb, 28), (0xfffffec, 28), (0xfffffed, 28), (0xfffffee, 28),
+    (0xfffffef, 28), (0xffffff0, 28), (0xffffff1, 28), (0xffffff2, 28), (0x3ffffffe, 30), (0xffffff3, 28),
+    (0xffffff4, 28), (0xffffff5, 28), (0xffffff6, 28), (0xffffff7, 28), (0xffffff8, 28), (0xffffff9, 28),
+    (0xffffffa, 28), (0xffffffb, 28), (0x14, 6), (0x3f8, 10), (0x3f9, 10), (0xffa, 12),
+    (0x1ff9, 13), (0x15, 6), (0xf8, 8), (0x7fa, 11), (0x3fa, 10), (0x3fb, 10),
+    (0xf9, 8), (0x7fb, 11), (0xfa, 8), (0x16, 6), (0x17, 6), (0x18, 6),
+    (0x0, 5), (0x1, 5), (0x2, 5), (0x19, 6), (0x1a, 6), (0x1b, 6),
+    (0x1c, 6), (0x1d, 6), (0x1e, 6), (0x1f, 6), (0x5c, 7), (0xfb, 8),
+    (0x7ffc, 15), (0x20, 6), (0xffb, 12), (0x3fc, 10), (0x1ffa, 13), (0x21, 6),
+    (0x5d, 7), (0x5e, 7), (0x5f, 7), (0x60, 7), (0x61, 7), (0x62, 7),
+    (0x63, 7), (0x64, 7), (0x65, 7), (0x66, 7), (0x67, 7), (0x68, 7),
+    (0x69, 7), (0x6a, 7), (0x6b, 7), (0x6c, 7), (0x6d, 7), (0x6e, 7),
+    (0x6f, 7), (0x70, 7), (0x71, 7), (0x72, 7), (0xfc, 8), (0x73, 7),
+    (0xfd, 8), (0x1ffb, 13), (0x7fff0, 19), (0x1ffc, 13), (0x3ffc, 14), (0x22, 6),
+    (0x7ffd, 15), (0x3, 5), (0x23, 6), (0x4, 5), (0x24, 6), (0x5, 5),
+    (0x25, 6), (0x26, 6), (0x27, 6), (0x6, 5), (0x74, 7), (0x75, 7),
+    (0x28, 6), (0x29, 6), (0x2a, 6), (0x7, 5), (0x2b, 6), (0x76, 7),
+    (0x2c, 6), (0x8, 5), (0x9, 5), (0x2d, 6), (0x77, 7), (0x78, 7),
+    (0x79, 7), (0x7a, 7), (0x7b, 7), (0x7ffe, 15), (0x7fc, 11), (0x3ffd, 14),
+    (0x1ffd, 13), (0xffffffc, 28), (0xfffe6, 20), (0x3fffd2, 22), (0xfffe7, 20), (0xfffe8, 20),
+    (0x3fffd3, 22), (0x3fffd4, 22), (0x3fffd5, 22), (0x7fffd9, 23), (0x3fffd6, 22), (0x7fffda, 23),
+    (0x7fffdb, 23), (0x7fffdc, 23), (0x7fffdd, 23), (0x7fffde, 23), (0xffffeb, 24), (0x7fffdf, 23),
+    (0xffffec, 24), (0xffffed, 24), (0x3fffd7, 22), (0x7fffe0, 23), (0xffffee, 24), (0x7fffe1, 23),
+    (0x7fffe2, 23), (0x7fffe3, 23), (0x7fffe4, 23), (0x1fffdc, 21), (0x3fffd8, 22), (0x7fffe5, 23),
+    (0x3fffd9, 22), (0x7fffe6, 23), (0x7fffe7, 23), (0xffffef, 24), (0x3fffda, 22), (0x1fffdd, 21),
+    (0xfffe9, 20), (0x3fffdb, 22), (0x3fffdc, 22), (0x7fffe8, 23), (0x7fffe9, 23), (0x1fffde, 21),
+    (0x7fffea, 23), (0x3fffdd, 22), (0x3fffde, 22), (0xfffff0, 24), (0x1fffdf, 21), (0x3fffdf, 22),
+    (0x7fffeb, 23), (0x7fffec, 23), (0x1fffe0, 21), (0x1fffe1, 21), (0x3fffe0, 22), (0x1fffe2, 21),
+    (0x7fffed, 23), (0x3fffe1, 22), (0x7fffee, 23), (0x7fffef, 23), (0xfffea, 20), (0x3fffe2, 22),
+    (0x3fffe3, 22), (0x3fffe4, 22), (0x7ffff0, 23), (0x3fffe5, 22), (0x3fffe6, 22), (0x7ffff1, 23),
+    (0x3ffffe0, 26), (0x3ffffe1, 26), (0xfffeb, 20), (0x7fff1, 19), (0x3fffe7, 22), (0x7ffff2, 23),
+    (0x3fffe8, 22), (0x1ffffec, 25), (0x3ffffe2, 26), (0x3ffffe3, 26), (0x3ffffe4, 26), (0x7ffffde, 27),
+    (0x7ffffdf, 27), (0x3ffffe5, 26), (0xfffff1, 24), (0x1ffffed, 25), (0x7fff2, 19), (0x1fffe3, 21),
+    (0x3ffffe6, 26), (0x7ffffe0, 27), (0x7ffffe1, 27), (0x3ffffe7, 26), (0x7ffffe2, 27), (0xfffff2, 24),
+    (0x1fffe4, 21), (0x1fffe5, 21), (0x3ffffe8, 26), (0x3ffffe9, 26), (0xffffffd, 28), (0x7ffffe3, 27),
+    (0x7ffffe4, 27), (0x7ffffe5, 27), (0xfffec, 20), (0xfffff3, 24), (0xfffed, 20), (0x1fffe6, 21),
+    (0x3fffe9, 22), (0x1fffe7, 21), (0x1fffe8, 21), (0x7ffff3, 23), (0x3fffea, 22), (0x3fffeb, 22),
+    (0x1ffffee, 25), (0x1ffffef, 25), (0xfffff4, 24), (0xfffff5, 24), (0x3ffffea, 26), (0x7ffff4, 23),
+    (0x3ffffeb, 26), (0x7ffffe6, 27), (0x3ffffec, 26), (0x3ffffed, 26), (0x7ffffe7, 27), (0x7ffffe8, 27),
+    (0x7ffffe9, 27), (0x7ffffea, 27), (0x7ffffeb, 27), (0xffffffe, 28), (0x7ffffec, 27), (0x7ffffed, 27),
+    (0x7ffffee, 27), (0x7ffffef, 27), (0x7fffff0, 27), (0x3ffffee, 26), (0x3fffffff, 30)
+)
+
+EOS = 256
+
+DEFAULT_TABLE_SIZE = 4096
+
+# Counted for each entry of the dynamic table besides its name and value
+ENTRY_OVERHEAD = 32
+
+# Continuation bytes of an integer, larger ones can only be an attack
+MAX_INTEGER_BYTES = 5
+
+# Values that change with most responses are not added to the dynamic table, they would only evict the ones that repeat
+UNINDEXED_HEADERS = frozenset((':path', 'age', 'content-length', 'content-range', 'etag', 'last-modified'))
+
+# Credentials are never added to a table, not even by intermediaries
+SENSITIVE_HEADERS = frozenset(('authorization', 'cookie', 'proxy-authorization', 'set-cookie'))
+
+
+class HPACKError(Exception):
+    pass
+
+
+def _build_huffman_decoder() -> tuple[list[int], list[int], list[bool]]:
+    # A state for each node of the code tree, the input is consumed 4 bits at a time.
+    # Codes are at least 5 bits long, so each step emits one symbol at most
+    children: list[list[int]] = [[-1, -1]]
+    symbols: dict[int, int] = {}
+
+    for symbol, (code, length) in enumerate(HUFFMAN_CODES):
+        node = 0
+
+        for shift in range(length - 1, -1, -1):
+            bit = (code >> shift) & 1
+
+            if children[node][bit] == -1:
+                children[node][bit] = len(children)
+                children.append([-1, -1])
+
+            node = children[node][bit]
+
+        symbols[node] = symbol
+
+    states = [0] * (len(children) * 16)
+    emitted = [-1] * (len(children) * 16)
+
+    for node in range(len(children)):
+        if node in symbols:
+            continue
+
+        for nibble in range(16):
+            current = node
+
+            for shift in (3, 2, 1, 0):
+                current = children[current][(nibble >> shift) & 1]
+
+                if current in symbols:
+                    emitted[node * 16 + nibble] = symbols[current]
+                    current = 0
+
+            states[node * 16 + nibble] = current
+
+    # The padding is the most significant bits of EOS, all ones, and shorter than a byte
+    accepting = [False] * len(children)
+    accepting[0] = True
+
+    node = 0
+    for _ in range(7):
+        node = children[node][1]
+        accepting[node] = True
+
+    return states, emitted, accepting
+
+
+HUFFMAN_STATES, HUFFMAN_EMITTED, HUFFMAN_ACCEPTING = _build_huffman_decoder()
+
+
+def huffman_encode(data: bytes) -> bytes:
+    value = 0
+    bits = 0
+
+    for byte in data:
+        code, length = HUFFMAN_CODES[byte]
+        value = (value << length) | code
+        bits += length
+
+    padding = -bits % 8
+    value = (value << padding) | ((1 << padding) - 1)
+
+    return value.to_bytes((bits + padding) // 8, 'big')
+
+
+def huffman_encoded_length(data: bytes) -> int:
+    return (sum(HUFFMAN_CODES[byte][1] for byte in data) + 7) // 8
+
+
+def huffman_decode(data: bytes) -> bytes:
+    states = HUFFMAN_STATES
+    emitted = HUFFMAN_EMITTED
+
+    decoded = bytearray()
+    state = 0
+
+    for byte in data:
+        index = state * 16 + (byte >> 4)
+        symbol = emitted[index]
+        if symbol != -1:
+            if symbol == EOS:
+                raise HPACKError('Huffman string with an EOS symbol.')
+            decoded.append(symbol)
+        state = states[index]
+
+        index = state * 16 + (byte & 15)
+        symbol = emitted[index]
+        if symbol != -1:
+            if symbol == EOS:
+                raise HPACKError('Huffman string with an EOS symbol.')
+            decoded.append(symbol)
+        state = states[index]
+
+    if not HUFFMAN_ACCEPTING[state]:
+        raise HPACKError('Invalid Huffman string padding.')
+
+    return bytes(decoded)
+
+
+def encode_integer(value: int, prefix_bits: int, flags: int = 0) -> bytes:
+    # The flags are the bits of the first byte before the prefix
+    max_prefix = (1 << prefix_bits) - 1
+
+    if value < max_prefix:
+        return bytes((flags | value,))
+
+    encoded = bytearray((flags | max_prefix,))
+    value -= max_prefix
+
+    while value >= 128:
+        encoded.append((value & 127) | 128)
+        value >>= 7
+
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def decode_integer(data: bytes, offset: int, prefix_bits: int) -> tuple[int, int]:
+    # Returns the value and the offset after it
+    max_prefix = (1 << prefix_bits) - 1
+    value = data[offset] & max_prefix
+    offset += 1
+
+    if value < max_prefix:
+        return value, offset
+
+    for shift in range(0, MAX_INTEGER_BYTES * 7, 7):
+        if offset >= len(data):
+            raise HPACKError('Truncated integer.')
+
+        byte = data[offset]
+        offset += 1
+        value += (byte & 127) << shift
+
+        if not byte & 128:
+            return value, offset
+
+    raise HPACKError('Integer too large.')
+
+
+def encode_string(value: str) -> bytes:
+    # Huffman encoded only when it's shorter
+    data = value.encode('latin-1')
+    huffman_length = huffman_encoded_length(data)
+
+    if huffman_length < len(data):
+        return encode_integer(huffman_length, 7, 0x80) + huffman_encode(data)
+
+    return encode_integer(len(data), 7) + data
+
+
+def decode_string(data: bytes, offset: int) -> tuple[str, int]:
+    huffman = data[offset] & 0x80
+    length, offset = decode_integer(data, offset, 7)
+    end = offset + length
+
+    if end > len(data):
+        raise HPACKError('Truncated string.')
+
+    value = data[offset:end]
+    if huffman:
+        value = huffman_decode(value)
+
+    return value.decode('latin-1'), end
+
+
+class DynamicTable:
+    # Most recent entries first, their indexes follow the ones of the static table
+
+    __slots__ = ('max_size', 'size', 'entries', '_inserted', '_positions', '_name_positions')
+
+    def __init__(self, max_size: int = DEFAULT_TABLE_SIZE) -> None:
+        self.max_size: int = max_size
+        self.size: int = 0
+        self.entries: deque[HTTPHeader] = deque()
+
+        # Insertion number of the latest entry with each header and each name, so they are found without scanning the table
+        self._inserted: int = 0
+        self._positions: dict[HTTPHeader, int] = {}
+        self._name_positions: dict[str, int] = {}
+
+    def get(self, index: int) -> HTTPHeader:
+        if index <= 0:
+            raise HPACKError('Invalid index 0.')
+
+        if index <= len(STATIC_TABLE):
+            return STATIC_TABLE[index - 1]
+
+        index -= len(STATIC_TABLE) + 1
+
+        if index >= len(self.entries):
+            raise HPACKError('Index out of the table.')
+
+        return self.entries[index]
+
+    def find(self, header: HTTPHeader) -> tuple[int, bool]:
+        # The index of the header, or of its name and False if the value is not in any table. 0 if neither is
+        index = STATIC_INDEXES.get(header)
+        if index is not None:
+            return index, True
+
+        position = self._positions.get(header)
+        if position is not None:
+            return len(STATIC_TABLE) + self._inserted - position + 1, True
+
+        index = STATIC_NAME_INDEXES.get(header[0])
+        if index is not None:
+            return index, False
+
+        position = self._name_positions.get(header[0])
+        if position is not None:
+            return len(STATIC_TABLE) + self._inserted - position + 1, False
+
+        return 0, False
+
+    def add(self, header: HTTPHeader) -> None:
+        # Adding an entry larger than the table empties it
+        self.entries.appendleft(header)
+        self.size += len(header[0]) + len(header[1]) + ENTRY_OVERHEAD
+
+        self._inserted += 1
+        self._positions[header] = self._inserted
+        self._name_positions[header[0]] = self._inserted
+
+        self._evict()
+
+    def resize(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.size > self.max_size and self.entries:
+            position = self._inserted - len(self.entries) + 1
+            header = self.entries.pop()
+            self.size -= len(header[0]) + len(header[1]) + ENTRY_OVERHEAD
+
+            if self._positions.get(header) == position:
+                del self._positions[header]
+
+            if self._name_positions.get(header[0]) == position:
+                del self._name_positions[header[0]]
+
+
+class Encoder:
+    __slots__ = ('table', '_size_update')
+
+    def __init__(self, max_table_size: int = DEFAULT_TABLE_SIZE) -> None:
+        self.table = DynamicTable(max_table_size)
+        # Smallest size the table had since the last block, the peer is told before the next one
+        self._size_update: int | None = None
+
+    def resize(self, max_table_size: int) -> None:
+        # The peer's SETTINGS_HEADER_TABLE_SIZE, the table doesn't grow past the default
+        max_table_size = min(max_table_size, DEFAULT_TABLE_SIZE)
+
+        if max_table_size != self.table.max_size:
+            self.table.resize(max_table_size)
+            self._size_update = max_table_size if self._size_update is None else min(self._size_update, max_table_size)
+
+    def encode(self, headers: Iterable[HTTPHeader]) -> bytes:
+        block = bytearray()
+
+        if self._size_update is not None:
+            if self._size_update < self.table.max_size:
+                block += encode_integer(self._size_update, 5, 0x20)
+
+            block += encode_integer(self.table.max_size, 5, 0x20)
+            self._size_update = None
+
+        for header in headers:
+            index, exact = self.table.find(header)
+
+            if exact:
+                block += encode_integer(index, 7, 0x80)
+                continue
+
+            name, value = header
+
+            if name in SENSITIVE_HEADERS:
+                # Intermediaries can't index it either
+                block += encode_integer(index, 4, 0x10)
+            elif name in UNINDEXED_HEADERS or len(name) + len(value) + ENTRY_OVERHEAD > self.table.max_size // 2:
+                block += encode_integer(index, 4)
+            else:
+                block += encode_integer(index, 6, 0x40)
+                self.table.add(header)
+
+            if not index:
+                block += encode_string(name)
+
+            block += encode_string(value)
+
+        return bytes(block)
+
+
+class Decoder:
+    __slots__ = ('table', 'max_table_size')
+
+    def __init__(self, max_table_size: int = DEFAULT_TABLE_SIZE) -> None:
+        self.table = DynamicTable(max_table_size)
+        # Our SETTINGS_HEADER_TABLE_SIZE, the peer can make the table smaller but not larger
+        self.max_table_size: int = max_table_size
+
+    def decode(self, data: bytes) -> list[HTTPHeader]:
+        # The whole block is always decoded, otherwise the table would not be the same as the peer's
+        headers: list[HTTPHeader] = []
+        offset = 0
+
+        try:
+            while offset < len(data):
+                byte = data[offset]
+
+                if byte & 0x80:
+                    index, offset = decode_integer(data, offset, 7)
+                    headers.append(self.table.get(index))
+
+                elif byte & 0x40:
+                    header, offset = self._decode_literal(data, offset, 6)
+                    self.table.add(header)
+                    headers.append(header)
+
+                elif byte & 0x20:
+                    if headers:
+                        raise HPACKError('Table size update after a header.')
+
+                    size, offset = decode_integer(data, offset, 5)
+                    if size > self.max_table_size:
+                        raise HPACKError(f'Table size {size} larger than {self.max_table_size}.')
+
+                    self.table.resize(size)
+
+                else:
+                    # Without indexing and never indexed
+                    header, offset = self._decode_literal(data, offset, 4)
+                    headers.append(header)
+
+        except IndexError:
+            raise HPACKError('Truncated header block.')
+
+        return headers
+
+    def _decode_literal(self, data: bytes, offset: int, prefix_bits: int) -> tuple[HTTPHeader, int]:
+        index, offset = decode_integer(data, offset, prefix_bits)
+
+        if index:
+            name = self.table.get(index)[0]
+        else:
+            name, offset = decode_string(data, offset)
+
+        value, offset = decode_string(data, offset)
+        return (name, value), offset
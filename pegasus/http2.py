@@ -0,0 +1,1036 @@
+from http_parser import HTTP_METHODS, generate_http_status, http_status, parse_digits, HTTPHeader, HTTPRequest, HTTPResponse, ParsingError
+from hpack import ENTRY_OVERHEAD, Decoder, Encoder, HPACKError
+from file_wrapper import FileWrapper
+from typing import TYPE_CHECKING
+from email.utils import formatdate
+from threading import Condition, Lock
+import binascii
+import tempfile
+import base64
+import socket
+import struct
+import time
+
+
+if TYPE_CHECKING:
+    from web_server import Address, WebServer
+
+
+# Sent by the client before anything else, with prior knowledge or after "101 Switching Protocols"
+PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+
+SWITCHING_PROTOCOLS_RESPONSE = b'HTTP/1.1 101 Switching Protocols\r\nconnection: Upgrade\r\nupgrade: h2c\r\n\r\n'
+
+# Length and type, flags and stream id
+FRAME_HEADER = struct.Struct('!IBI')
+SETTING = struct.Struct('!HI')
+UINT32 = struct.Struct('!I')
+
+DATA = 0x0
+HEADERS = 0x1
+PRIORITY = 0x2
+RST_STREAM = 0x3
+SETTINGS = 0x4
+PUSH_PROMISE = 0x5
+PING = 0x6
+GOAWAY = 0x7
+WINDOW_UPDATE = 0x8
+CONTINUATION = 0x9
+
+END_STREAM = 0x1
+ACK = 0x1
+END_HEADERS = 0x4
+PADDED = 0x8
+PRIORITY_FLAG = 0x20
+
+SETTINGS_HEADER_TABLE_SIZE = 0x1
+SETTINGS_ENABLE_PUSH = 0x2
+SETTINGS_MAX_CONCURRENT_STREAMS = 0x3
+SETTINGS_INITIAL_WINDOW_SIZE = 0x4
+SETTINGS_MAX_FRAME_SIZE = 0x5
+SETTINGS_MAX_HEADER_LIST_SIZE = 0x6
+
+NO_ERROR = 0x0
+PROTOCOL_ERROR = 0x1
+INTERNAL_ERROR = 0x2
+FLOW_CONTROL_ERROR = 0x3
+STREAM_CLOSED = 0x5
+FRAME_SIZE_ERROR = 0x6
+REFUSED_STREAM = 0x7
+CANCEL = 0x8
+COMPRESSION_ERROR = 0x9
+ENHANCE_YOUR_CALM = 0xb
+
+DEFAULT_WINDOW_SIZE = 65535
+MAX_WINDOW_SIZE = 2 ** 31 - 1
+DEFAULT_MAX_FRAME_SIZE = 16384
+MAX_FRAME_SIZE = 2 ** 24 - 1
+
+# The most significant bit of stream ids is reserved
+STREAM_ID_MASK = 0x7fffffff
+
+# Bytes the client can send before being granted more, bodies are spooled as they arrive so they are granted right away
+CONNECTION_WINDOW_SIZE = 16777216
+STREAM_WINDOW_SIZE = 1048576
+
+# Only meaningful in HTTP/1.1, requests with them are malformed
+CONNECTION_HEADERS = frozenset(('connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'))
+
+_date: tuple[int, str] = (0, '')
+
+
+class HTTP2Error(Exception):
+    # Breaks the whole connection, the client is told why with GOAWAY
+    def __init__(self, error_code: int, msg: str) -> None:
+        super().__init__(msg)
+        self.error_code = error_code
+
+
+class StreamClosed(Exception):
+    pass
+
+
+def get_date() -> str:
+    global _date
+
+    now = int(time.time())
+
+    if _date[0] != now:
+        _date = (now, formatdate(now, usegmt=True))
+
+    return _date[1]
+
+
+def encode_frame(frame_type: int, flags: int, stream_id: int, payload: bytes = b'') -> bytes:
+    return FRAME_HEADER.pack(len(payload) << 8 | frame_type, flags, stream_id) + payload
+
+
+def get_upgrade_settings(request: HTTPRequest) -> bytes | None:
+    # The SETTINGS payload of an "Upgrade: h2c" request, None if it doesn't ask to upgrade
+    if request['version'] != 'HTTP/1.1':
+        return None
+
+    upgrade: list[str] = []
+    connection: list[str] = []
+    settings: list[str] = []
+
+    for key, value in request['headers']:
+        if key == 'upgrade':
+            upgrade.extend(token.strip().lower() for token in value.split(','))
+        elif key == 'connection':
+            connection.extend(token.strip().lower() for token in value.split(','))
+        elif key == 'http2-settings':
+            settings.append(value.strip())
+
+    if 'h2c' not in upgrade or 'upgrade' not in connection or 'http2-settings' not in connection or len(settings) != 1:
+        return None
+
+    try:
+        payload = base64.urlsafe_b64decode(settings[0] + '=' * (-len(settings[0]) % 4))
+    except (binascii.Error, ValueError):
+        return None
+
+    return payload if len(payload) % SETTING.size == 0 else None
+
+
+def create_request(headers: list[HTTPHeader], max_headers: int, max_header_size: int, max_url_length: int) -> HTTPRequest:
+    method: str | None = None
+    path: str | None = None
+    scheme: str | None = None
+    authority: str | None = None
+
+    request_headers: list[HTTPHeader] = []
+    cookies: list[str] = []
+    size = 0
+
+    for name, value in headers:
+        size += len(name) + len(value) + ENTRY_OVERHEAD
+
+        if name[:1] == ':':
+            if request_headers or cookies:
+                raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Pseudo-header after a regular header', name)
+
+            if name == ':method' and method is None:
+                method = value
+            elif name == ':path' and path is None:
+                path = value
+            elif name == ':scheme' and scheme is None:
+                scheme = value
+            elif name == ':authority' and authority is None:
+                authority = value
+            else:
+                raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Invalid pseudo-header', name)
+
+        elif name in CONNECTION_HEADERS or (name == 'te' and value != 'trailers') or name != name.lower():
+            raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Invalid header', name)
+
+        # Split to be compressed separately, joined again as they would be in HTTP/1.1
+        elif name == 'cookie':
+            cookies.append(value)
+
+        else:
+            request_headers.append((name, value))
+
+    if len(request_headers) + len(cookies) > max_headers:
+        raise ParsingError(http_status.HTTP_431_REQUEST_HEADER_FIELDS_TOO_LARGE, f'The maximum number of headers is {max_headers}')
+
+    if size > max_header_size:
+        raise ParsingError(
+            http_status.HTTP_431_REQUEST_HEADER_FIELDS_TOO_LARGE,
+            f'The maximum size of the headers is {max_header_size} bytes'
+        )
+
+    if method is None or path is None or scheme is None:
+        raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Missing pseudo-headers.')
+
+    if method not in HTTP_METHODS:
+        raise ParsingError(http_status.HTTP_501_NOT_IMPLEMENTED, 'Unsupported HTTP method', method)
+
+    if len(path) > max_url_length:
+        raise ParsingError(http_status.HTTP_414_URI_TOO_LONG, f'The maximum URL length is {max_url_length}')
+
+    if not path.startswith('/'):
+        raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Invalid path', path)
+
+    if cookies:
+        request_headers.append(('cookie', '; '.join(cookies)))
+
+    if authority is not None and not any(name == 'host' for name, _ in request_headers):
+        request_headers.append(('host', authority))
+
+    return {
+        'method': method,
+        'url': path,
+        'version': 'HTTP/2',
+        'headers': request_headers,
+        'body': None
+    }
+
+
+def get_content_length(headers: list[HTTPHeader]) -> int | None:
+    for name, value in headers:
+        if name == 'content-length':
+            content_length = parse_digits(value)
+
+            # A malformed request, the stream is reset instead of answered
+            if content_length is None:
+                raise ValueError(f'Invalid "content-length" value: {value!r}')
+
+            return content_length
+
+    return None
+
+
+class HTTP2Stream:
+    __slots__ = (
+        'conn', 'stream_id', 'request', 'error', 'body', 'content_length', 'received', 'send_window', 'recv_window',
+        'remote_closed', 'reset', 'dispatched', 'started_at', 'header_parse_time'
+    )
+
+    def __init__(self, conn: 'HTTP2Connection', stream_id: int, send_window: int) -> None:
+        self.conn: HTTP2Connection = conn
+        self.stream_id: int = stream_id
+        self.request: HTTPRequest | None = None
+        # Sent instead of calling the application
+        self.error: HTTPResponse | None = None
+        self.body: tempfile.SpooledTemporaryFile[bytes] | None = None
+        self.content_length: int | None = None
+        self.received: int = 0
+        self.send_window: int = send_window
+        self.recv_window: int = STREAM_WINDOW_SIZE
+        # The client sent the whole request
+        self.remote_closed: bool = False
+        # The stream was reset by either side, nothing else can be sent
+        self.reset: bool = False
+        self.dispatched: bool = False
+        self.started_at: float = time.perf_counter()
+        self.header_parse_time: float = 0
+
+
+class HTTP2Connection:
+    # Frames are read by the thread of the connection, and each stream is handled by a thread of the stream pool.
+    # The threads write whole frames to the socket one at a time
+
+    __slots__ = (
+        'server', 'socket', 'addr', 'server_name', '_buf', '_decoder', '_encoder', '_streams', '_last_stream_id', '_active',
+        '_requests', '_header_block', '_settings_received', '_send_window', '_recv_window', '_initial_window',
+        '_max_frame_size', '_goaway_sent', '_goaway_received', '_closed', '_last_activity', '_condition', '_write_lock'
+    )
+
+    def __init__(self, server: 'WebServer', socket: socket.socket, addr: 'Address', server_name: str) -> None:
+        self.server: WebServer = server
+        self.socket: socket.socket = socket
+        self.addr: Address = addr
+        self.server_name: str = server_name
+
+        self._buf = bytearray()
+        self._decoder = Decoder()
+        self._encoder = Encoder()
+
+        # Streams that are open on either side
+        self._streams: dict[int, HTTP2Stream] = {}
+        self._last_stream_id: int = 0
+        # Streams handed to the stream pool that have not finished
+        self._active: int = 0
+        self._requests: int = 0
+        # Stream id, flags and fragments of a header block waiting for CONTINUATION frames
+        self._header_block: tuple[int, int, bytearray] | None = None
+        self._settings_received: bool = False
+
+        self._send_window: int = DEFAULT_WINDOW_SIZE
+        self._recv_window: int = CONNECTION_WINDOW_SIZE
+        # Settings of the client
+        self._initial_window: int = DEFAULT_WINDOW_SIZE
+        self._max_frame_size: int = DEFAULT_MAX_FRAME_SIZE
+
+        self._goaway_sent: bool = False
+        self._goaway_received: bool = False
+        self._closed: bool = False
+        self._last_activity: float = time.monotonic()
+
+        # Guards the windows and the streams, and wakes the threads waiting for the client to grant more window
+        self._condition = Condition()
+        self._write_lock = Lock()
+
+    def run(self, data: bytes, upgrade_request: HTTPRequest | None = None, upgrade_settings: bytes = b'') -> None:
+        # Returns once the connection can be closed
+        self._buf += data
+
+        # Frames are written as soon as they are ready, a small one can't wait for the previous one to be acknowledged
+        if self.socket.family != socket.AF_UNIX:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        try:
+            settings = (
+                SETTING.pack(SETTINGS_MAX_CONCURRENT_STREAMS, self.server.http2_max_streams)
+                + SETTING.pack(SETTINGS_INITIAL_WINDOW_SIZE, STREAM_WINDOW_SIZE)
+                + SETTING.pack(SETTINGS_MAX_HEADER_LIST_SIZE, self.server.max_header_size)
+            )
+
+            with self._write_lock:
+                self.socket.sendall(
+                    encode_frame(SETTINGS, 0, 0, settings)
+                    + encode_frame(WINDOW_UPDATE, 0, 0, UINT32.pack(CONNECTION_WINDOW_SIZE - DEFAULT_WINDOW_SIZE))
+                )
+
+            # The request that asked to upgrade is the stream 1, and the client already sent it whole
+            if upgrade_request is not None:
+                self._apply_settings(upgrade_settings)
+
+                upgrade_request['headers'] = [
+                    (key, value) for key, value in upgrade_request['headers'] if key not in ('connection', 'upgrade', 'http2-settings')
+                ]
+
+                stream = HTTP2Stream(self, 1, self._initial_window)
+                stream.request = upgrade_request
+                stream.remote_closed = True
+
+                self._streams[1] = stream
+                self._last_stream_id = 1
+                self._requests += 1
+                self._dispatch(stream)
+
+            while len(self._buf) < len(PREFACE):
+                if not self._receive():
+                    return
+
+            if self._buf[:len(PREFACE)] != PREFACE:
+                raise HTTP2Error(PROTOCOL_ERROR, 'Invalid connection preface.')
+
+            del self._buf[:len(PREFACE)]
+
+            while not self._is_finished():
+                if len(self._buf) >= FRAME_HEADER.size:
+                    length_type, flags, stream_id = FRAME_HEADER.unpack_from(self._buf)
+                    length = length_type >> 8
+
+                    if length > DEFAULT_MAX_FRAME_SIZE:
+                        raise HTTP2Error(FRAME_SIZE_ERROR, f'Frame of {length} bytes.')
+
+                    end = FRAME_HEADER.size + length
+
+                    if len(self._buf) >= end:
+                        payload = bytes(self._buf[FRAME_HEADER.size:end])
+                        del self._buf[:end]
+
+                        self._handle_frame(length_type & 0xff, flags, stream_id & STREAM_ID_MASK, payload)
+                        continue
+
+                if not self._receive():
+                    return
+
+        except HTTP2Error as error:
+            self.server._metrics.increment('parse_errors')
+            self._send_goaway(error.error_code, str(error))
+
+        except (ConnectionError, TimeoutError):
+            pass
+
+        finally:
+            self._close()
+
+    def _receive(self) -> bool:
+        # Returns False once the client closed the connection, or it has been idle for too long
+        while True:
+            try:
+                data = self.socket.recv(self.server.recv_size)
+            except TimeoutError:
+                with self._condition:
+                    idle = not self._streams and not self._active and time.monotonic() - self._last_activity >= self.server.keepalive_timeout
+
+                if idle:
+                    self._send_goaway(NO_ERROR)
+                    return False
+
+                continue
+
+            if not data:
+                return False
+
+            self._buf += data
+            self._last_activity = time.monotonic()
+            return True
+
+    def _is_finished(self) -> bool:
+        with self._condition:
+            return (self._goaway_sent or self._goaway_received) and not self._streams and not self._active
+
+    def _close(self) -> None:
+        with self._condition:
+            self._closed = True
+            streams = list(self._streams.values())
+            self._streams.clear()
+            self._condition.notify_all()
+
+        for stream in streams:
+            if not stream.dispatched and stream.body is not None:
+                stream.body.close()
+
+        # The streams still being handled fail their next write, the socket is closed once they are done with it
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        with self._condition:
+            while self._active:
+                self._condition.wait()
+
+    def abort(self) -> None:
+        # Called from a stream, the connection thread sees the end of the connection
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _handle_frame(self, frame_type: int, flags: int, stream_id: int, payload: bytes) -> None:
+        if self._header_block is not None and (frame_type != CONTINUATION or stream_id != self._header_block[0]):
+            raise HTTP2Error(PROTOCOL_ERROR, 'Expected a CONTINUATION frame.')
+
+        if not self._settings_received and frame_type != SETTINGS:
+            raise HTTP2Error(PROTOCOL_ERROR, 'The first frame must be SETTINGS.')
+
+        if frame_type == DATA:
+            self._handle_data(flags, stream_id, payload)
+
+        elif frame_type == HEADERS:
+            if stream_id == 0:
+                raise HTTP2Error(PROTOCOL_ERROR, 'HEADERS frame without a stream.')
+
+            payload = self._remove_padding(flags, payload)
+
+            # Priorities are ignored, streams are handled as they arrive
+            if flags & PRIORITY_FLAG:
+                if len(payload) < 5:
+                    raise HTTP2Error(FRAME_SIZE_ERROR, 'Invalid HEADERS frame.')
+
+                payload = payload[5:]
+
+            if flags & END_HEADERS:
+                self._handle_header_block(stream_id, flags, payload)
+            else:
+                self._header_block = (stream_id, flags, bytearray(payload))
+
+        elif frame_type == CONTINUATION:
+            if self._header_block is None:
+                raise HTTP2Error(PROTOCOL_ERROR, 'Unexpected CONTINUATION frame.')
+
+            _, header_flags, block = self._header_block
+            block += payload
+
+            # The block can't be discarded without breaking the compression context
+            if len(block) > self.server.max_header_size * 2:
+                raise HTTP2Error(ENHANCE_YOUR_CALM, 'Header block too large.')
+
+            if flags & END_HEADERS:
+                self._header_block = None
+                self._handle_header_block(stream_id, header_flags, bytes(block))
+
+        elif frame_type == RST_STREAM:
+            if len(payload) != 4:
+                raise HTTP2Error(FRAME_SIZE_ERROR, 'Invalid RST_STREAM frame.')
+
+            if stream_id == 0 or stream_id > self._last_stream_id:
+                raise HTTP2Error(PROTOCOL_ERROR, 'RST_STREAM frame of an idle stream.')
+
+            with self._condition:
+                stream = self._streams.pop(stream_id, None)
+
+                if stream is not None:
+                    stream.reset = True
+                    self._condition.notify_all()
+
+            if stream is not None and not stream.dispatched and stream.body is not None:
+                stream.body.close()
+
+        elif frame_type == SETTINGS:
+            if stream_id != 0:
+                raise HTTP2Error(PROTOCOL_ERROR, 'SETTINGS frame of a stream.')
+
+            if flags & ACK:
+                if payload:
+                    raise HTTP2Error(FRAME_SIZE_ERROR, 'SETTINGS acknowledgement with a payload.')
+                return
+
+            if len(payload) % SETTING.size:
+                raise HTTP2Error(FRAME_SIZE_ERROR, 'Invalid SETTINGS frame.')
+
+            self._settings_received = True
+            self._apply_settings(payload)
+            self._send_frame(SETTINGS, ACK, 0)
+
+        elif frame_type == PING:
+            if len(payload) != 8:
+                raise HTTP2Error(FRAME_SIZE_ERROR, 'Invalid PING frame.')
+
+            if stream_id != 0:
+                raise HTTP2Error(PROTOCOL_ERROR, 'PING frame of a stream.')
+
+            if not flags & ACK:
+                self._send_frame(PING, ACK, 0, payload)
+
+        elif frame_type == GOAWAY:
+            if stream_id != 0:
+                raise HTTP2Error(PROTOCOL_ERROR, 'GOAWAY frame of a stream.')
+
+            self._goaway_received = True
+
+        elif frame_type == WINDOW_UPDATE:
+            if len(payload) != 4:
+                raise HTTP2Error(FRAME_SIZE_ERROR, 'Invalid WINDOW_UPDATE frame.')
+
+            self._handle_window_update(stream_id, UINT32.unpack(payload)[0] & STREAM_ID_MASK)
+
+        elif frame_type == PUSH_PROMISE:
+            raise HTTP2Error(PROTOCOL_ERROR, 'Clients can\'t push.')
+
+        # PRIORITY and unknown frames are ignored
+
+    def _remove_padding(self, flags: int, payload: bytes) -> bytes:
+        if not flags & PADDED:
+            return payload
+
+        if not payload or payload[0] >= len(payload):
+            raise HTTP2Error(PROTOCOL_ERROR, 'Invalid padding.')
+
+        return payload[1:len(payload) - payload[0]]
+
+    def _apply_settings(self, payload: bytes) -> None:
+        for offset in range(0, len(payload), SETTING.size):
+            identifier, value = SETTING.unpack_from(payload, offset)
+
+            if identifier == SETTINGS_HEADER_TABLE_SIZE:
+                with self._write_lock:
+                    self._encoder.resize(value)
+
+            elif identifier == SETTINGS_ENABLE_PUSH:
+                if value > 1:
+                    raise HTTP2Error(PROTOCOL_ERROR, 'Invalid SETTINGS_ENABLE_PUSH.')
+
+            elif identifier == SETTINGS_INITIAL_WINDOW_SIZE:
+                if value > MAX_WINDOW_SIZE:
+                    raise HTTP2Error(FLOW_CONTROL_ERROR, 'Invalid SETTINGS_INITIAL_WINDOW_SIZE.')
+
+                # Applies to the streams that are already open too
+                with self._condition:
+                    delta = value - self._initial_window
+                    self._initial_window = value
+
+                    for stream in self._streams.values():
+                        stream.send_window += delta
+
+                        if stream.send_window > MAX_WINDOW_SIZE:
+                            raise HTTP2Error(FLOW_CONTROL_ERROR, 'Stream window too large.')
+
+                    self._condition.notify_all()
+
+            elif identifier == SETTINGS_MAX_FRAME_SIZE:
+                if not DEFAULT_MAX_FRAME_SIZE <= value <= MAX_FRAME_SIZE:
+                    raise HTTP2Error(PROTOCOL_ERROR, 'Invalid SETTINGS_MAX_FRAME_SIZE.')
+
+                self._max_frame_size = value
+
+    def _handle_window_update(self, stream_id: int, increment: int) -> None:
+        if stream_id == 0:
+            if increment == 0:
+                raise HTTP2Error(PROTOCOL_ERROR, 'WINDOW_UPDATE without an increment.')
+
+            with self._condition:
+                self._send_window += increment
+
+                if self._send_window > MAX_WINDOW_SIZE:
+                    raise HTTP2Error(FLOW_CONTROL_ERROR, 'Connection window too large.')
+
+                self._condition.notify_all()
+            return
+
+        if stream_id > self._last_stream_id:
+            raise HTTP2Error(PROTOCOL_ERROR, 'WINDOW_UPDATE frame of an idle stream.')
+
+        with self._condition:
+            stream = self._streams.get(stream_id)
+
+            # Frames of closed streams can arrive before the client knows they are closed
+            if stream is None:
+                return
+
+            if increment == 0 or stream.send_window + increment > MAX_WINDOW_SIZE:
+                error_code = PROTOCOL_ERROR if increment == 0 else FLOW_CONTROL_ERROR
+            else:
+                stream.send_window += increment
+                self._condition.notify_all()
+                return
+
+        self.reset_stream(stream, error_code)
+
+    def _handle_header_block(self, stream_id: int, flags: int, block: bytes) -> None:
+        started_at = time.perf_counter()
+
+        try:
+            headers = self._decoder.decode(block)
+        except HPACKError as error:
+            raise HTTP2Error(COMPRESSION_ERROR, str(error))
+
+        header_parse_time = time.perf_counter() - started_at
+        self.server._metrics.observe('header_parse', header_parse_time)
+
+        stream = self._streams.get(stream_id)
+
+        # Trailers, they can only end the request
+        if stream is not None:
+            if not flags & END_STREAM or stream.remote_closed:
+                self.reset_stream(stream, PROTOCOL_ERROR)
+            else:
+                self._end_request(stream)
+            return
+
+        if stream_id % 2 == 0:
+            raise HTTP2Error(PROTOCOL_ERROR, 'Streams of the client have odd ids.')
+
+        if stream_id <= self._last_stream_id:
+            raise HTTP2Error(STREAM_CLOSED, 'HEADERS frame of a closed stream.')
+
+        self._last_stream_id = stream_id
+
+        # Streams after GOAWAY are ignored, the client retries them in a new connection
+        if self._goaway_sent:
+            return
+
+        if len(self._streams) >= self.server.http2_max_streams:
+            self._send_frame(RST_STREAM, 0, stream_id, UINT32.pack(REFUSED_STREAM))
+            return
+
+        stream = HTTP2Stream(self, stream_id, self._initial_window)
+        stream.header_parse_time = header_parse_time
+        stream.remote_closed = bool(flags & END_STREAM)
+
+        with self._condition:
+            self._streams[stream_id] = stream
+
+        self._requests += 1
+        if self._requests >= self.server.max_requests_per_connection:
+            self._send_goaway(NO_ERROR)
+
+        try:
+            request = create_request(
+                headers, self.server.max_headers, self.server.max_header_size, self.server.max_url_length
+            )
+            stream.content_length = get_content_length(request['headers'])
+
+            max_body_size = self.server.max_body_size
+            if max_body_size is not None and stream.content_length is not None and stream.content_length > max_body_size:
+                raise ParsingError(http_status.HTTP_413_CONTENT_TOO_LARGE, f'The maximum body size is {max_body_size} bytes')
+
+        except ParsingError as error:
+            self._fail_request(stream, error)
+            return
+
+        except ValueError:
+            self.server._metrics.increment('parse_errors')
+            self.reset_stream(stream, PROTOCOL_ERROR)
+            return
+
+        stream.request = request
+
+        if stream.remote_closed:
+            self._end_request(stream)
+        else:
+            stream.body = tempfile.SpooledTemporaryFile(self.server.body_spool_size)
+            request['body'] = stream.body
+
+    def _handle_data(self, flags: int, stream_id: int, payload: bytes) -> None:
+        if stream_id == 0:
+            raise HTTP2Error(PROTOCOL_ERROR, 'DATA frame without a stream.')
+
+        if stream_id > self._last_stream_id:
+            raise HTTP2Error(PROTOCOL_ERROR, 'DATA frame of an idle stream.')
+
+        # The padding counts too
+        self._recv_window -= len(payload)
+
+        if self._recv_window < 0:
+            raise HTTP2Error(FLOW_CONTROL_ERROR, 'The connection window was exceeded.')
+
+        if self._recv_window <= CONNECTION_WINDOW_SIZE // 2:
+            self._send_frame(WINDOW_UPDATE, 0, 0, UINT32.pack(CONNECTION_WINDOW_SIZE - self._recv_window))
+            self._recv_window = CONNECTION_WINDOW_SIZE
+
+        data = self._remove_padding(flags, payload)
+
+        # Frames of closed streams can arrive before the client knows they are closed
+        stream = self._streams.get(stream_id)
+        if stream is None or stream.remote_closed:
+            return
+
+        stream.recv_window -= len(payload)
+
+        if stream.recv_window < 0:
+            self.reset_stream(stream, FLOW_CONTROL_ERROR)
+            return
+
+        stream.received += len(data)
+
+        if stream.body is not None:
+            max_body_size = self.server.max_body_size
+
+            if max_body_size is not None and stream.received > max_body_size:
+                self._fail_request(stream, ParsingError(
+                    http_status.HTTP_413_CONTENT_TOO_LARGE, f'The maximum body size is {max_body_size} bytes'
+                ))
+
+            elif stream.content_length is not None and stream.received > stream.content_length:
+                self._fail_request(stream, ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Body longer than "Content-Length".'))
+
+            else:
+                stream.body.write(data)
+
+        if flags & END_STREAM:
+            self._end_request(stream)
+
+        elif stream.recv_window <= STREAM_WINDOW_SIZE // 2:
+            self._send_frame(WINDOW_UPDATE, 0, stream_id, UINT32.pack(STREAM_WINDOW_SIZE - stream.recv_window))
+            stream.recv_window = STREAM_WINDOW_SIZE
+
+    def _end_request(self, stream: HTTP2Stream) -> None:
+        with self._condition:
+            stream.remote_closed = True
+
+        # Failed requests were already dispatched
+        if stream.dispatched:
+            return
+
+        assert stream.request is not None
+
+        if stream.body is not None:
+            if stream.content_length is not None and stream.received != stream.content_length:
+                self._fail_request(stream, ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Body shorter than "Content-Length".'))
+                return
+
+            stream.body.seek(0)
+            self.server._metrics.observe('body_read', time.perf_counter() - stream.started_at)
+
+        self._dispatch(stream)
+
+    def _fail_request(self, stream: HTTP2Stream, error: ParsingError) -> None:
+        # The error is the response, the rest of the body is discarded
+        self.server._metrics.increment('parse_errors')
+
+        if stream.body is not None:
+            stream.body.close()
+            stream.body = None
+
+        body = (error.msg + '\n') if error.msg and error.msg[-1] != '\n' else error.msg
+        stream.error = {
+            'status': generate_http_status(error.status),
+            'headers': [('content-type', 'text/plain')],
+            'body': body.encode()
+        }
+
+        self._dispatch(stream)
+
+    def _dispatch(self, stream: HTTP2Stream) -> None:
+        with self._condition:
+            stream.dispatched = True
+            self._active += 1
+
+        # The streams wait for WINDOW_UPDATE frames read by this thread, so it never waits for the queue
+        if not self.server._http2_stream_pool.submit(stream, False):
+            self.reset_stream(stream, REFUSED_STREAM)
+
+            if stream.body is not None:
+                stream.body.close()
+
+            self.finish_stream(stream)
+            return
+
+        self.server._metrics.increment('http2_streams')
+
+    def finish_stream(self, stream: HTTP2Stream) -> None:
+        with self._condition:
+            self._active -= 1
+            self._last_activity = time.monotonic()
+
+            # The response was sent before the whole request arrived, so the client can stop sending it
+            send_reset = not stream.reset and not stream.remote_closed
+
+            stream.reset = True
+            self._streams.pop(stream.stream_id, None)
+
+            finished = (self._goaway_sent or self._goaway_received) and not self._streams and not self._active
+            self._condition.notify_all()
+
+        if send_reset:
+            self._send_rst_stream(stream.stream_id, NO_ERROR)
+
+        # Wakes the connection thread, it's waiting for a frame that is not going to arrive
+        if finished:
+            try:
+                self.socket.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+
+    def reset_stream(self, stream: HTTP2Stream, error_code: int) -> None:
+        with self._condition:
+            if stream.reset:
+                return
+
+            stream.reset = True
+            self._condition.notify_all()
+
+            if not stream.dispatched:
+                self._streams.pop(stream.stream_id, None)
+
+        if not stream.dispatched and stream.body is not None:
+            stream.body.close()
+
+        self._send_rst_stream(stream.stream_id, error_code)
+
+    def _send_rst_stream(self, stream_id: int, error_code: int) -> None:
+        try:
+            self._send_frame(RST_STREAM, 0, stream_id, UINT32.pack(error_code))
+        except (ConnectionError, TimeoutError):
+            self.abort()
+
+    def _send_goaway(self, error_code: int, msg: str = '') -> None:
+        self._goaway_sent = True
+
+        try:
+            self._send_frame(GOAWAY, 0, 0, UINT32.pack(self._last_stream_id) + UINT32.pack(error_code) + msg.encode())
+        except OSError:
+            pass
+
+    def _send_frame(self, frame_type: int, flags: int, stream_id: int, payload: bytes = b'') -> None:
+        with self._write_lock:
+            self.socket.sendall(encode_frame(frame_type, flags, stream_id, payload))
+
+    def send_response(self, stream: HTTP2Stream, response: HTTPResponse) -> None:
+        # Called from the thread of the stream, the body is closed and the stream finished in any case
+        body = response['body']
+
+        try:
+            headers: list[HTTPHeader] = [(':status', response['status'][:3])]
+            content_length: int | None = None
+            has_date = False
+            has_server = False
+
+            if isinstance(body, FileWrapper) and body.resolve_range():
+                assert body.length is not None
+                content_length = body.length
+
+            for key, value in response['headers']:
+                key = key.lower()
+
+                if key in CONNECTION_HEADERS:
+                    continue
+
+                if key == 'content-length':
+                    if content_length is not None:
+                        # The file is shorter than announced, its real length is sent instead
+                        declared_length = parse_digits(value)
+                        if declared_length is not None and declared_length < content_length:
+                            content_length = declared_length
+                        continue
+
+                elif key == 'date':
+                    has_date = True
+                elif key == 'server':
+                    has_server = True
+
+                headers.append((key, value))
+
+            if not has_date:
+                headers.append(('date', get_date()))
+
+            if not has_server:
+                headers.append(('server', self.server_name))
+
+            if isinstance(body, bytes) and not any(key == 'content-length' for key, _ in headers):
+                headers.append(('content-length', str(len(body))))
+
+            if content_length is not None:
+                assert isinstance(body, FileWrapper)
+                body.length = content_length
+                headers.append(('content-length', str(content_length)))
+
+            self._send_headers(stream, headers, not body)
+
+            if isinstance(body, bytes):
+                if body:
+                    self._send_data(stream, body, True)
+
+            elif isinstance(body, FileWrapper) and content_length is not None:
+                self._send_file(stream, body)
+
+            elif body is not None:
+                for chunk in body:
+                    if chunk:
+                        self._send_data(stream, chunk, False)
+
+                self._send_data(stream, b'', True)
+
+        except StreamClosed:
+            pass
+
+        except (ConnectionError, TimeoutError):
+            self.abort()
+
+        except BaseException:
+            self.reset_stream(stream, INTERNAL_ERROR)
+            raise
+
+        finally:
+            close = getattr(body, 'close', None)
+
+            if close is not None:
+                close()
+
+            self.finish_stream(stream)
+
+    def _send_headers(self, stream: HTTP2Stream, headers: list[HTTPHeader], end_stream: bool) -> None:
+        # Blocks are encoded in the order they are sent, the compression context is shared by the streams
+        with self._write_lock:
+            with self._condition:
+                if self._closed:
+                    raise ConnectionAbortedError('The connection was closed.')
+
+                if stream.reset:
+                    raise StreamClosed
+
+                if end_stream:
+                    self._close_local(stream)
+
+            block = self._encoder.encode(headers)
+            max_frame_size = self._max_frame_size
+
+            frames: list[bytes] = []
+            frame_type = HEADERS
+            flags = END_STREAM if end_stream else 0
+
+            for offset in range(0, max(len(block), 1), max_frame_size):
+                fragment = block[offset:offset + max_frame_size]
+
+                if offset + max_frame_size >= len(block):
+                    flags |= END_HEADERS
+
+                frames.append(FRAME_HEADER.pack(len(fragment) << 8 | frame_type, flags, stream.stream_id))
+                frames.append(fragment)
+
+                frame_type = CONTINUATION
+                flags = 0
+
+            self.socket.sendall(b''.join(frames))
+
+    def _close_local(self, stream: HTTP2Stream) -> None:
+        # Called before sending the end of the response. The client can open another stream as soon as it sees it,
+        # so the stream stops counting against the limit first
+        with self._condition:
+            if stream.remote_closed and self._streams.get(stream.stream_id) is stream:
+                del self._streams[stream.stream_id]
+
+    def _reserve_window(self, stream: HTTP2Stream, size: int) -> int:
+        # Waits for the client to allow sending part of the data, and returns how much
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise ConnectionAbortedError('The connection was closed.')
+
+                if stream.reset:
+                    raise StreamClosed
+
+                window = min(self._send_window, stream.send_window)
+
+                if window > 0 or size == 0:
+                    break
+
+                if not self._condition.wait(self.server.write_timeout):
+                    raise TimeoutError('The client did not allow sending the response.')
+
+            # The window is negative after the client lowered SETTINGS_INITIAL_WINDOW_SIZE, an empty frame is still sent
+            size = max(0, min(size, window, self._max_frame_size))
+            self._send_window -= size
+            stream.send_window -= size
+
+            return size
+
+    def _send_data(self, stream: HTTP2Stream, data: bytes, end_stream: bool) -> None:
+        view = memoryview(data)
+
+        while True:
+            size = self._reserve_window(stream, len(view))
+            flags = END_STREAM if end_stream and size == len(view) else 0
+
+            if flags:
+                self._close_local(stream)
+
+            with self._write_lock:
+                self.socket.sendall(FRAME_HEADER.pack(size << 8 | DATA, flags, stream.stream_id) + view[:size])
+
+            view = view[size:]
+
+            if not view:
+                return
+
+    def _send_file(self, stream: HTTP2Stream, file: FileWrapper) -> None:
+        # The payload of each frame is sent by the kernel with `sendfile`
+        assert file.offset is not None and file.length is not None
+
+        if not file.length:
+            self._send_data(stream, b'', True)
+            return
+
+        while file.length:
+            size = self._reserve_window(stream, file.length)
+            flags = END_STREAM if size == file.length else 0
+
+            if flags:
+                self._close_local(stream)
+
+            with self._write_lock:
+                self.socket.sendall(FRAME_HEADER.pack(size << 8 | DATA, flags, stream.stream_id))
+
+                # The frame can't be completed, the only way out is closing the connection
+                if self.socket.sendfile(file.filelike, file.offset, size) != size:
+                    raise ConnectionAbortedError('The file was truncated while being sent.')
+
+            file.offset += size
+            file.length -= size
@@ -1,27 +1,47 @@
-from typing import Literal, TypedDict
+from typing import IO, Iterable, Literal, TypedDict
 
 
 class http_status:
     HTTP_200_OK = 200
+    HTTP_206_PARTIAL_CONTENT = 206
+
+    HTTP_304_NOT_MODIFIED = 304
 
     HTTP_400_BAD_REQUEST = 400
+    HTTP_404_NOT_FOUND = 404
+    HTTP_405_METHOD_NOT_ALLOWED = 405
     HTTP_408_REQUEST_TIMEOUT = 408
     HTTP_411_LENGTH_REQUIRED = 411
+    HTTP_413_CONTENT_TOO_LARGE = 413
+    HTTP_414_URI_TOO_LONG = 414
+    HTTP_416_RANGE_NOT_SATISFIABLE = 416
+    HTTP_431_REQUEST_HEADER_FIELDS_TOO_LARGE = 431
 
     HTTP_500_INTERNAL_SERVER_ERROR = 500
     HTTP_501_NOT_IMPLEMENTED = 501
+    HTTP_503_SERVICE_UNAVAILABLE = 503
     HTTP_505_HTTP_VERSION_NOT_SUPPORTED = 505
 
 
 HTTP_STATUS_PHRASES: dict[int, str] = {
     200: 'OK',
+    206: 'Partial Content',
+
+    304: 'Not Modified',
 
     400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
     408: 'Request Timeout',
     411: 'Length Required',
+    413: 'Content Too Large',
+    414: 'URI Too Long',
+    416: 'Range Not Satisfiable',
+    431: 'Request Header Fields Too Large',
 
     500: 'Internal Server Error',
     501: 'Not Implemented',
+    503: 'Service Unavailable',
     505: 'HTTP Version Not Supported',
 }
 
@@ -30,13 +50,21 @@ def generate_http_status(status: int) -> str:
     return '%d %s' % (status, HTTP_STATUS_PHRASES[status])
 
 
+def parse_digits(value: str) -> int | None:
+    # `str.isdigit` also accepts digits like "²" that `int` rejects, only ASCII ones are valid in HTTP
+    if not value.isascii() or not value.isdigit():
+        return None
+
+    return int(value)
+
+
 class ParsingError(Exception):
     def __init__(self, status: int, msg: str, data: bytes | str | None = None) -> None:
         self.status = status
 
         if data:
             if isinstance(data, bytes):
-                data = data.decode()
+                data = data.decode('latin-1')
 
             msg += f": '{data}'"
 
@@ -44,160 +72,360 @@ class ParsingError(Exception):
 
 
 HTTPMethod = Literal['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+# Requests of HTTP/2 connections are not parsed here, they only share the representation
+HTTPVersion = Literal['HTTP/1.0', 'HTTP/1.1', 'HTTP/2']
 HTTPHeader = tuple[str, str]
 
 
 HTTP_METHODS: tuple[HTTPMethod, ...] = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+HTTP_VERSIONS: tuple[HTTPVersion, ...] = ('HTTP/1.0', 'HTTP/1.1')
+
+HEX_DIGITS = frozenset(b'0123456789abcdefABCDEF')
+MAX_CHUNK_SIZE_LINE = 1024
+
+CHUNK_SIZE = 0
+CHUNK_DATA = 1
+CHUNK_DATA_END = 2
+CHUNK_TRAILERS = 3
 
 
 class HTTPRequest(TypedDict):
     method: HTTPMethod
     url: str
+    version: HTTPVersion
     headers: list[HTTPHeader]
-    body: bytes | None
+    body: IO[bytes] | None
 
 
 class HTTPResponse(TypedDict):
     status: str
     headers: list[HTTPHeader]
-    body: bytes | None
+    body: bytes | Iterable[bytes] | None
 
 
 class HTTPRequestParser:
-    __slots__ = ('_method', '_url', '_headers', '_body', '_reached_end_of_headers', '_content_length', '_buf', 'completed')
-
-    def __init__(self) -> None:
+    __slots__ = (
+        'max_headers', 'max_header_size', 'max_url_length', 'max_body_size', '_method', '_url', '_version', '_headers',
+        '_body', '_body_received', '_content_length', '_chunked', '_chunk_state', '_chunk_left', '_buf', '_scan_offset',
+        'trailers', 'expect_continue', 'headers_completed', 'completed'
+    )
+
+    def __init__(
+        self,
+        max_headers: int = 100,
+        max_header_size: int = 16384,
+        max_url_length: int = 8192,
+        max_body_size: int | None = None
+    ) -> None:
+        self.max_headers: int = max_headers
+        self.max_header_size: int = max_header_size
+        self.max_url_length: int = max_url_length
+        self.max_body_size: int | None = max_body_size
+
+        self._buf = bytearray()
+        self.reset()
+
+    def reset(self) -> None:
+        # What is left in the buffer belongs to the next request of the connection (pipelining)
         self._method: HTTPMethod | None = None
         self._url: str | None = None
+        self._version: HTTPVersion | None = None
         self._headers: list[HTTPHeader] = []
-        self._body: bytes | None = None
+        self._body = bytearray()
+        self._body_received: int = 0
 
-        self._reached_end_of_headers: bool = False
         self._content_length: int | None = None
-        self._buf: bytes = b''
+        self._chunked: bool = False
+        self._chunk_state: int = CHUNK_SIZE
+        self._chunk_left: int = 0
+        self._scan_offset: int = 0
+        self.trailers: list[HTTPHeader] = []
+        self.expect_continue: bool = False
+        self.headers_completed: bool = False
         self.completed: bool = False
 
-    def _get_line(self, data: bytes) -> bytes | None:
-        line, *rest = data.split(b'\r\n', 1)
-        if not rest:
-            self._buf = line
-            return
+    @property
+    def has_buffered_data(self) -> bool:
+        return bool(self._buf)
 
-        self._buf = rest[0]
+    def take_buffered_data(self) -> bytes:
+        # What was received after the request, once the connection switches to another protocol
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
 
-        if line == b'':
-            self._reached_end_of_headers = True
-            if self._content_length is None:
-                self.completed = True
+    @property
+    def has_body(self) -> bool:
+        return self._chunked or bool(self._content_length)
 
-            self._feed()
-            return
-
-        return line
+    @property
+    def body_left(self) -> int | None:
+        # Bytes of the body that have not been received yet, unknown for chunked bodies
+        if self._chunked:
+            return None
 
-    def _parse_status_line(self, data: bytes) -> None:
-        line = self._get_line(data)
-
-        if not line:
-            return
+        return (self._content_length or 0) - self._body_received
 
-        method, url, version, *rest = line.split(b' ')
+    def _parse_status_line(self, line: bytes) -> None:
+        parts = line.split(b' ')
 
-        if rest:
+        if len(parts) != 3:
             raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Invalid status line.')
 
-        method_ = method.decode()
+        method, url, version = parts
+
+        method_ = method.decode('latin-1')
         if method_ not in HTTP_METHODS:
             raise ParsingError(http_status.HTTP_501_NOT_IMPLEMENTED, 'Unsupported HTTP method', method)
         self._method = method_
 
-        url_ = url.decode()
+        if len(url) > self.max_url_length:
+            raise ParsingError(http_status.HTTP_414_URI_TOO_LONG, f'The maximum URL length is {self.max_url_length}')
+
+        url_ = url.decode('latin-1')
         if not url_.startswith('/'):
             raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Invalid path', url)
         self._url = url_
 
-        if not version.startswith(b'HTTP/1.') and version[-1:-2] not in b'01':
+        version_ = version.decode('latin-1')
+        if version_ not in HTTP_VERSIONS:
             raise ParsingError(http_status.HTTP_505_HTTP_VERSION_NOT_SUPPORTED, 'Unsupported HTTP protocol version', version)
+        self._version = version_
 
-        self._feed()
-
-    def _parse_header(self, data: bytes) -> None:
-        line = self._get_line(data)
-
-        if not line:
-            return
-
+    @staticmethod
+    def _parse_header_line(line: bytes) -> HTTPHeader:
         name_value = line.split(b':', 1)
 
         if len(name_value) == 1:
             raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Invalid header', line)
 
-        name = name_value[0].lower().decode()
-        value = name_value[1].strip(b' ').decode()
+        name = name_value[0].lower().decode('latin-1')
+        value = name_value[1].strip(b' \t').decode('latin-1')
 
         if name.find(' ') != -1:
             raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Header names cannot have spaces', name)
 
+        return name, value
+
+    def _parse_header(self, line: bytes) -> None:
+        name, value = self._parse_header_line(line)
+
         if name == 'content-length':
-            if not value.isnumeric():
+            content_length = parse_digits(value)
+
+            if content_length is None:
                 raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Invalid "Content-Length" value', value)
 
-            self._content_length = int(value)
+            # Different lengths would frame the request differently for each server in the chain
+            if self._content_length is not None and content_length != self._content_length:
+                raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Conflicting "Content-Length" values', value)
+
+            self._content_length = content_length
+
+        elif name == 'transfer-encoding':
+            # Other codings would reach the application still applied to the body
+            if value.lower() != 'chunked':
+                raise ParsingError(http_status.HTTP_501_NOT_IMPLEMENTED, 'Unsupported "Transfer-Encoding"', value)
+
+            if self._chunked:
+                raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Repeated "Transfer-Encoding"', value)
+
+            self._chunked = True
+
+        elif name == 'expect' and value.lower() == '100-continue':
+            self.expect_continue = True
 
         self._headers.append((name, value))
-        self._feed()
 
-    def _feed_body(self, data: bytes) -> None:
-        if self._content_length is None:
-            raise ParsingError(http_status.HTTP_400_BAD_REQUEST, '"Content-Length" header required.')
+    def _parse_headers(self) -> None:
+        # Scanning again the last 3 bytes in case the previous chunk ended in the middle of the terminator
+        end = self._buf.find(b'\r\n\r\n', max(self._scan_offset - 3, 0))
+
+        if end == -1:
+            self._scan_offset = len(self._buf)
+
+            if len(self._buf) > self.max_header_size:
+                if self._buf.find(b'\r\n') == -1:
+                    raise ParsingError(http_status.HTTP_414_URI_TOO_LONG, f'The maximum URL length is {self.max_url_length}')
+
+                raise ParsingError(
+                    http_status.HTTP_431_REQUEST_HEADER_FIELDS_TOO_LARGE,
+                    f'The maximum size of the headers is {self.max_header_size} bytes'
+                )
+            return
+
+        if end > self.max_header_size:
+            raise ParsingError(
+                http_status.HTTP_431_REQUEST_HEADER_FIELDS_TOO_LARGE,
+                f'The maximum size of the headers is {self.max_header_size} bytes'
+            )
+
+        status_line, *header_lines = bytes(self._buf[:end]).split(b'\r\n')
+        del self._buf[:end + 4]
 
-        if not self._body:
-            self._body = b''
+        if len(header_lines) > self.max_headers:
+            raise ParsingError(
+                http_status.HTTP_431_REQUEST_HEADER_FIELDS_TOO_LARGE,
+                f'The maximum number of headers is {self.max_headers}'
+            )
 
-        left = self._content_length - len(self._body)
+        self._parse_status_line(status_line)
 
-        self._body += data[:left]
+        for line in header_lines:
+            self._parse_header(line)
 
-        if len(self._body) >= self._content_length:
-            assert len(self._body) == self._content_length
+        if self._chunked:
+            # A length along with chunks is a common way of smuggling requests through proxies
+            if self._content_length is not None:
+                raise ParsingError(http_status.HTTP_400_BAD_REQUEST, '"Content-Length" and "Transfer-Encoding" are exclusive.')
+
+            if self._version == 'HTTP/1.0':
+                raise ParsingError(http_status.HTTP_400_BAD_REQUEST, '"Transfer-Encoding" is not supported in HTTP/1.0.')
+
+        if self.max_body_size is not None and self._content_length is not None and self._content_length > self.max_body_size:
+            raise ParsingError(http_status.HTTP_413_CONTENT_TOO_LARGE, f'The maximum body size is {self.max_body_size} bytes')
+
+        self.headers_completed = True
+
+        if not self.has_body:
             self.completed = True
+            self.expect_continue = False
 
-    def _feed(self, data: bytes | None = None) -> None:
-        if not data and not self._buf or self.completed:
+    def _move_to_body(self, size: int) -> None:
+        if size >= len(self._buf):
+            self._body_received += len(self._buf)
+            self._body += self._buf
+            self._buf.clear()
             return
 
-        if not data:
-            data = self._buf
-            self._buf = b''
+        self._body_received += size
+        self._body += memoryview(self._buf)[:size]
+        del self._buf[:size]
+
+    def _feed_chunked_body(self) -> None:
+        while self._buf:
+            if self._chunk_state == CHUNK_SIZE:
+                end = self._buf.find(b'\r\n')
+
+                if end == -1:
+                    if len(self._buf) > MAX_CHUNK_SIZE_LINE:
+                        raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Chunk size line too long.')
+                    return
+
+                # Chunk extensions are ignored
+                size = bytes(self._buf[:end]).split(b';', 1)[0].strip(b' \t')
+                del self._buf[:end + 2]
+
+                if not size or not HEX_DIGITS.issuperset(size):
+                    raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Invalid chunk size', size)
+
+                self._chunk_left = int(size, 16)
+
+                if self.max_body_size is not None and self._body_received + self._chunk_left > self.max_body_size:
+                    raise ParsingError(http_status.HTTP_413_CONTENT_TOO_LARGE, f'The maximum body size is {self.max_body_size} bytes')
+
+                self._chunk_state = CHUNK_DATA if self._chunk_left else CHUNK_TRAILERS
+
+            elif self._chunk_state == CHUNK_DATA:
+                size = min(self._chunk_left, len(self._buf))
+                self._move_to_body(size)
+                self._chunk_left -= size
+
+                if not self._chunk_left:
+                    self._chunk_state = CHUNK_DATA_END
+
+            elif self._chunk_state == CHUNK_DATA_END:
+                if len(self._buf) < 2:
+                    return
+
+                if self._buf[:2] != b'\r\n':
+                    raise ParsingError(http_status.HTTP_400_BAD_REQUEST, 'Chunk data must end with CRLF.')
+
+                del self._buf[:2]
+                self._chunk_state = CHUNK_SIZE
+
+            else:
+                self._parse_trailers()
+                return
 
-        if self._method is None:
-            self._parse_status_line(data)
+    def _parse_trailers(self) -> None:
+        if self._buf[:2] == b'\r\n':
+            del self._buf[:2]
+            self.completed = True
+            return
+
+        end = self._buf.find(b'\r\n\r\n')
+
+        if end == -1:
+            if len(self._buf) > self.max_header_size:
+                raise ParsingError(
+                    http_status.HTTP_431_REQUEST_HEADER_FIELDS_TOO_LARGE,
+                    f'The maximum size of the trailers is {self.max_header_size} bytes'
+                )
             return
 
-        if not self._reached_end_of_headers:
-            self._parse_header(data)
+        trailer_lines = bytes(self._buf[:end]).split(b'\r\n')
+        del self._buf[:end + 4]
+
+        if len(trailer_lines) > self.max_headers:
+            raise ParsingError(
+                http_status.HTTP_431_REQUEST_HEADER_FIELDS_TOO_LARGE,
+                f'The maximum number of trailers is {self.max_headers}'
+            )
+
+        self.trailers = [self._parse_header_line(line) for line in trailer_lines]
+        self.completed = True
+
+    def _feed_body(self) -> None:
+        if self._chunked:
+            self._feed_chunked_body()
             return
 
-        self._feed_body(data)
+        assert self._content_length is not None
+
+        self._move_to_body(self._content_length - self._body_received)
+
+        if self._body_received >= self._content_length:
+            self.completed = True
 
     def feed(self, data: bytes) -> ParsingError | None:
+        self._buf += data
+
+        if self.completed:
+            return None
+
         try:
-            self._feed(data)
+            if not self.headers_completed:
+                self._parse_headers()
+
+            if self.headers_completed and not self.completed:
+                self._feed_body()
+
         except ParsingError as error:
             return error
-        except RecursionError:
-            return ParsingError(http_status.HTTP_500_INTERNAL_SERVER_ERROR, 'Could not process that many headers.')
+
+    def take_body(self, size: int = -1) -> bytes:
+        if size < 0 or size >= len(self._body):
+            data = bytes(self._body)
+            self._body.clear()
+            return data
+
+        data = bytes(memoryview(self._body)[:size])
+        del self._body[:size]
+        return data
 
     def get_result(self) -> HTTPRequest:
-        if not self.completed:
-            raise Exception('Getting the result before parsing is complete.')
+        if not self.headers_completed:
+            raise Exception('Getting the result before parsing the headers.')
 
         assert self._method
         assert self._url
+        assert self._version
 
         return {
             'method': self._method,
             'url': self._url,
+            'version': self._version,
             'headers': self._headers,
-            'body': self._body
+            'body': None
         }
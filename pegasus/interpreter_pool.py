@@ -0,0 +1,375 @@
+from http_parser import HTTPRequest, HTTPResponse
+from wsgi_server import Address, close_wsgi_result, create_environ_template, wsgi_server
+from threading import Lock, Thread
+from types import ModuleType
+from typing import Any
+import importlib
+import traceback
+import marshal
+import struct
+import queue
+import time
+import sys
+import io
+import os
+
+
+# Length of each message sent through the pipes
+MESSAGE_HEADER = struct.Struct('!I')
+
+READ_SIZE = 1024 * 1024
+
+# Runs in each subinterpreter, the values are passed when it starts
+SCRIPT = '''
+import sys
+sys.path[:] = path.split('\\0')
+
+import interpreter_pool
+interpreter_pool.run_interpreter(app_path, warmup_path, request_fd, response_fd, server_host, server_port, multiprocess)
+'''
+
+
+def get_interpreters_module() -> ModuleType | None:
+    # Python 3.13+, then 3.12. Both create interpreters with their own GIL by default, older ones share it
+    if sys.version_info < (3, 12):
+        return None
+
+    for name in ('_interpreters', '_xxsubinterpreters'):
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            pass
+
+    return None
+
+
+interpreters = get_interpreters_module()
+
+
+def get_application(path: str) -> Any:
+    module_path, name = path.split(':', 1)
+    return getattr(importlib.import_module(module_path), name)
+
+
+def write_message(fd: int, data: bytes) -> None:
+    view = memoryview(MESSAGE_HEADER.pack(len(data)) + data)
+
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def read_message(fd: int) -> bytes | None:
+    # None once the other side closed the pipe
+    header = read_exactly(fd, MESSAGE_HEADER.size)
+
+    if header is None:
+        return None
+
+    (length,) = MESSAGE_HEADER.unpack(header)
+    data = read_exactly(fd, length)
+
+    if data is None:
+        raise EOFError('The pipe was closed in the middle of a message.')
+
+    return data
+
+
+def read_exactly(fd: int, size: int) -> bytes | None:
+    data = bytearray()
+
+    while len(data) < size:
+        chunk = os.read(fd, min(size - len(data), READ_SIZE))
+
+        if not chunk:
+            if data:
+                raise EOFError('The pipe was closed in the middle of a message.')
+            return None
+
+        data += chunk
+
+    return bytes(data)
+
+
+def run_interpreter(
+    app_path: str,
+    warmup_path: str | None,
+    request_fd: int,
+    response_fd: int,
+    server_host: str,
+    server_port: int,
+    multiprocess: int
+) -> None:
+    # Loop of each subinterpreter: a request is read, the application is called and its response is written back
+    try:
+        app = get_application(app_path)
+
+        if warmup_path is not None:
+            get_application(warmup_path)(app)
+
+    except Exception:
+        write_message(response_fd, marshal.dumps(traceback.format_exc()))
+        return
+
+    write_message(response_fd, marshal.dumps(None))
+
+    server_addr = (server_host, server_port)
+    environ_template = create_environ_template(server_addr, bool(multiprocess))
+
+    while True:
+        data = read_message(request_fd)
+
+        if data is None:
+            return
+
+        method, url, version, headers, body, addr = marshal.loads(data)
+
+        request: HTTPRequest = {
+            'method': method,
+            'url': url,
+            'version': version,
+            'headers': headers,
+            'body': io.BytesIO(body) if body is not None else None
+        }
+
+        try:
+            response = wsgi_server(app, request, addr, server_addr, bool(multiprocess), environ_template)
+            message = marshal.dumps((response['status'], response['headers'], read_body(response)))
+        except Exception:
+            message = marshal.dumps(traceback.format_exc())
+
+        write_message(response_fd, message)
+
+
+def read_body(response: HTTPResponse) -> bytes | None:
+    # Only bytes cross the interpreters, streamed bodies and files are read whole
+    body = response['body']
+
+    if body is None or isinstance(body, bytes):
+        return body
+
+    try:
+        return b''.join(body)
+    finally:
+        close_wsgi_result(body)
+
+
+class ApplicationError(Exception):
+    pass
+
+
+class Interpreter:
+    __slots__ = ('id', 'request_fd', 'response_fd', 'host_request_fd', 'host_response_fd', 'thread')
+
+    def __init__(self, id: Any) -> None:
+        self.id: Any = id
+        # The subinterpreter reads the requests from one pipe and writes the responses to the other
+        self.request_fd, self.host_request_fd = os.pipe()
+        self.host_response_fd, self.response_fd = os.pipe()
+        self.thread: Thread | None = None
+
+    def close_request_pipe(self) -> None:
+        # Ends the loop of the subinterpreter once it finishes its request
+        if self.host_request_fd != -1:
+            os.close(self.host_request_fd)
+            self.host_request_fd = -1
+
+    def close_response_pipe(self) -> None:
+        # Unblocks the server if the loop ended before the request pipe was closed
+        if self.response_fd != -1:
+            os.close(self.response_fd)
+            self.response_fd = -1
+
+    def close(self) -> None:
+        self.close_request_pipe()
+        self.close_response_pipe()
+        os.close(self.request_fd)
+        os.close(self.host_response_fd)
+
+
+class InterpreterPool:
+    # Runs a WSGI application in subinterpreters (Python 3.12+), each one with its own GIL,
+    # so the requests are handled in parallel inside a single process
+
+    __slots__ = (
+        'app_path', 'size', 'server_addr', 'multiprocess', 'warmup_path', '_interpreters', '_idle', '_lock', '_closed'
+    )
+
+    def __init__(
+        self,
+        app_path: str,
+        size: int,
+        server_addr: Address,
+        multiprocess: bool = False,
+        warmup_path: str | None = None
+    ) -> None:
+        assert size > 0
+
+        if interpreters is None:
+            raise RuntimeError(f'Subinterpreters require Python 3.12+, running {sys.version.split()[0]}')
+
+        self.app_path: str = app_path
+        self.size: int = size
+        self.server_addr: Address = server_addr
+        self.multiprocess: bool = multiprocess
+        self.warmup_path: str | None = warmup_path
+
+        self._interpreters: list[Interpreter] = []
+        self._idle: queue.SimpleQueue[Interpreter] = queue.SimpleQueue()
+        self._lock = Lock()
+        self._closed: bool = False
+
+    def start(self) -> None:
+        started_at = time.perf_counter()
+        started = [self._spawn() for _ in range(self.size)]
+
+        # Each one reports whether it imported the application
+        for interpreter in started:
+            error = self._wait_loaded(interpreter)
+
+            if error is not None:
+                self.close()
+                raise ApplicationError(f'The application could not be loaded in a subinterpreter:\n{error}')
+
+            self._idle.put(interpreter)
+
+        print(f'INFO: Interpreters: {self.size}, started in {time.perf_counter() - started_at:.2f} s')
+
+    def handle_request(self, request: HTTPRequest, addr: Address) -> HTTPResponse:
+        body = request['body'].read() if request['body'] is not None else None
+        data = marshal.dumps((request['method'], request['url'], request['version'], request['headers'], body, addr))
+
+        # Every one ended and could not be replaced, the application can't be loaded anymore
+        if not self._interpreters:
+            raise ApplicationError('There are no subinterpreters left.')
+
+        interpreter = self._idle.get()
+
+        try:
+            write_message(interpreter.host_request_fd, data)
+            response = read_message(interpreter.host_response_fd)
+        except (OSError, EOFError) as error:
+            # Not a `ConnectionError`, the client is still connected
+            self._replace(interpreter)
+            raise ApplicationError('The subinterpreter ended.') from error
+
+        if response is None:
+            self._replace(interpreter)
+            raise ApplicationError('The subinterpreter ended.')
+
+        self._idle.put(interpreter)
+        result = marshal.loads(response)
+
+        if isinstance(result, str):
+            raise ApplicationError(f'The application failed in a subinterpreter:\n{result}')
+
+        status, headers, response_body = result
+
+        return {
+            'status': status,
+            'headers': headers,
+            'body': response_body
+        }
+
+    def close(self, timeout: float | None = 10) -> None:
+        with self._lock:
+            self._closed = True
+            closing = list(self._interpreters)
+            self._interpreters.clear()
+
+        for interpreter in closing:
+            interpreter.close_request_pipe()
+
+        for interpreter in closing:
+            self._join(interpreter, timeout)
+
+    def _spawn(self) -> Interpreter:
+        assert interpreters is not None
+
+        interpreter = Interpreter(interpreters.create())
+
+        with self._lock:
+            self._interpreters.append(interpreter)
+
+        # Runs the loop of the subinterpreter until its pipe is closed
+        interpreter.thread = Thread(target=self._run, args=(interpreter,), name=f'interpreter-{interpreter.id}', daemon=True)
+        interpreter.thread.start()
+
+        return interpreter
+
+    @staticmethod
+    def _wait_loaded(interpreter: Interpreter) -> str | None:
+        # The traceback if the application could not be loaded
+        data = read_message(interpreter.host_response_fd)
+        return marshal.loads(data) if data is not None else 'The interpreter ended while starting.'
+
+    @staticmethod
+    def _join(interpreter: Interpreter, timeout: float | None) -> None:
+        if interpreter.thread is not None:
+            interpreter.thread.join(timeout=timeout)
+
+            if interpreter.thread.is_alive():
+                print(f'WARNING: Interpreter {interpreter.id} could not end.')
+                return
+
+        interpreter.close()
+
+    def _replace(self, interpreter: Interpreter) -> None:
+        # A dead interpreter is never handed a request again, a new one takes its place
+        with self._lock:
+            if interpreter not in self._interpreters:
+                return
+
+            self._interpreters.remove(interpreter)
+            closed = self._closed
+
+        interpreter.close_request_pipe()
+        self._join(interpreter, 10)
+
+        if closed:
+            return
+
+        replacement = self._spawn()
+        error = self._wait_loaded(replacement)
+
+        if error is not None:
+            with self._lock:
+                self._interpreters.remove(replacement)
+
+            replacement.close_request_pipe()
+            self._join(replacement, 10)
+
+            print(f'WARNING: Interpreter {interpreter.id} ended and could not be replaced, {len(self._interpreters)} left:\n{error}')
+            return
+
+        print(f'WARNING: Interpreter {interpreter.id} ended, replaced by interpreter {replacement.id}')
+        self._idle.put(replacement)
+
+    def _run(self, interpreter: Interpreter) -> None:
+        assert interpreters is not None
+
+        # Python 3.12 only shares str, bytes, int and None between interpreters
+        shared = {
+            'path': '\0'.join(sys.path),
+            'app_path': self.app_path,
+            'warmup_path': self.warmup_path,
+            'request_fd': interpreter.request_fd,
+            'response_fd': interpreter.response_fd,
+            'server_host': self.server_addr[0],
+            'server_port': self.server_addr[1],
+            'multiprocess': int(self.multiprocess),
+        }
+
+        try:
+            # Python 3.13 returns the error, 3.12 raises it
+            error = interpreters.run_string(interpreter.id, SCRIPT, shared)
+        except Exception as exception:
+            error = exception
+
+        if error is not None:
+            # Python 3.13 describes it with a namespace
+            print(f"WARNING: Interpreter {interpreter.id} failed: {getattr(error, 'formatted', error)}")
+
+        interpreter.close_response_pipe()
+
+        # Python 3.12 hangs destroying it from another thread once it imported `threading`
+        interpreters.destroy(interpreter.id)
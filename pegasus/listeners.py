@@ -0,0 +1,108 @@
+from typing import Any
+import socket
+import stat
+import os
+
+
+Address = tuple[str, int]
+
+# Clients of Unix domain sockets have no address, only the proxy in front of the server knows it
+UNIX_CLIENT_ADDR: Address = ('unix', 0)
+
+
+def parse_bind(bind: str) -> tuple[socket.AddressFamily, Address | str]:
+    # "HOST:PORT", "[HOST]:PORT" for IPv6, or "unix:PATH"
+    if bind.startswith('unix:'):
+        return socket.AF_UNIX, bind[len('unix:'):]
+
+    host, _, port = bind.rpartition(':')
+
+    if host.startswith('[') and host.endswith(']'):
+        return socket.AF_INET6, (host[1:-1], int(port))
+
+    return socket.AF_INET6 if ':' in host else socket.AF_INET, (host or '0.0.0.0', int(port))
+
+
+def format_bind(family: socket.AddressFamily, address: Address | str) -> str:
+    if isinstance(address, str):
+        return f'unix:{address}'
+
+    if family == socket.AF_INET6:
+        return f'[{address[0]}]:{address[1]}'
+
+    return f'{address[0]}:{address[1]}'
+
+
+def get_bind(addr: Address) -> str:
+    return format_bind(socket.AF_INET6 if ':' in addr[0] else socket.AF_INET, addr)
+
+
+def create_listener(
+    bind: str,
+    defer_accept: int | None = None,
+    fastopen: int | None = None,
+    rcvbuf: int | None = None,
+    sndbuf: int | None = None
+) -> socket.socket:
+    # Bound but not listening yet, so the workers forked afterwards share it
+    family, address = parse_bind(bind)
+    listener = socket.socket(family, socket.SOCK_STREAM)
+
+    try:
+        if isinstance(address, str):
+            # Left by a previous run that didn't exit cleanly
+            if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+                os.unlink(address)
+
+        else:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+            # Otherwise "[::]:PORT" would also take the IPv4 port, and binding "0.0.0.0:PORT" as well would fail
+            if family == socket.AF_INET6:
+                listener.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+
+            # The connection is accepted once the request arrives, instead of waking a thread just to wait for it
+            if defer_accept is not None:
+                set_tcp_option(listener, 'TCP_DEFER_ACCEPT', defer_accept)
+
+            # The request can arrive with the SYN of returning clients, saving a round trip
+            if fastopen is not None:
+                set_tcp_option(listener, 'TCP_FASTOPEN', fastopen)
+
+        # Set before listening, so the accepted sockets inherit them and the TCP window scale is negotiated for them
+        if rcvbuf is not None:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+
+        if sndbuf is not None:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+
+        listener.bind(address)
+
+    except BaseException:
+        listener.close()
+        raise
+
+    return listener
+
+
+def set_tcp_option(listener: socket.socket, name: str, value: int) -> None:
+    option = getattr(socket, name, None)
+
+    if option is None:
+        print(f'WARNING: {name} is not supported on this platform')
+        return
+
+    listener.setsockopt(socket.IPPROTO_TCP, option, value)
+
+
+def prepare_client(client_socket: socket.socket, addr: Any, tcp_nodelay: bool) -> Address:
+    # Returns the address of the client as (host, port), IPv6 addresses also include the flow info and scope id
+    if not addr:
+        return UNIX_CLIENT_ADDR
+
+    # Small responses are sent right away, instead of waiting for the ACK of the previous segment
+    if tcp_nodelay:
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    return addr[0], addr[1]
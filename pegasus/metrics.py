@@ -0,0 +1,244 @@
+from http_parser import HTTPRequestParser
+from typing import Callable, Literal, TypedDict
+from threading import Lock, Thread
+import bisect
+import socket
+import os
+
+
+Phase = Literal['accept_to_first_byte', 'header_parse', 'body_read', 'app', 'send']
+
+PHASES: tuple[Phase, ...] = ('accept_to_first_byte', 'header_parse', 'body_read', 'app', 'send')
+
+Counter = Literal[
+    'connections', 'requests', 'timeouts', 'parse_errors', 'rejected', 'cache_hits', 'cache_misses', 'static_files',
+    'http2_connections', 'http2_streams'
+]
+
+COUNTERS: tuple[Counter, ...] = (
+    'connections', 'requests', 'timeouts', 'parse_errors', 'rejected', 'cache_hits', 'cache_misses', 'static_files',
+    'http2_connections', 'http2_streams'
+)
+
+# Upper bounds of the buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS_PREFIX = 'pegasus'
+
+
+class MemoryUsage(TypedDict):
+    # In bytes
+    rss: int
+    pss: int
+    shared: int
+    private: int
+
+
+def get_memory_usage(pid: int | None = None) -> MemoryUsage | None:
+    # Only available on Linux. The PSS splits each shared page between the processes that map it,
+    # so the PSS of the master and the workers adds up to the memory they use together
+    try:
+        with open(f'/proc/{pid if pid is not None else "self"}/smaps_rollup') as file:
+            lines = file.readlines()
+    except OSError:
+        return None
+
+    values: dict[str, int] = {}
+
+    # The first line is the address range
+    for line in lines[1:]:
+        key, _, value = line.partition(':')
+        values[key] = int(value.split()[0]) * 1024
+
+    return {
+        'rss': values.get('Rss', 0),
+        'pss': values.get('Pss', 0),
+        'shared': values.get('Shared_Clean', 0) + values.get('Shared_Dirty', 0),
+        'private': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0),
+    }
+
+
+def format_memory_usage(usage: MemoryUsage) -> str:
+    return ', '.join(f'{key.upper() if len(key) == 3 else key} {value / 1048576:.1f} MiB' for key, value in usage.items())
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets: tuple[float, ...] = buckets
+        # The last one counts what is above every bucket
+        self.counts: list[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0
+        self.count: int = 0
+        self._lock = Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name: str, labels: str) -> list[str]:
+        with self._lock:
+            counts = list(self.counts)
+            total_sum = self.sum
+            total_count = self.count
+
+        lines: list[str] = []
+
+        cumulative = 0
+        for bucket, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bucket}"}} {cumulative}')
+
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {total_count}')
+        lines.append(f'{name}_sum{{{labels}}} {total_sum}')
+        lines.append(f'{name}_count{{{labels}}} {total_count}')
+
+        return lines
+
+
+class Metrics:
+    __slots__ = ('phases', 'counters', 'active_connections', '_lock')
+
+    def __init__(self) -> None:
+        self.phases: dict[Phase, Histogram] = {phase: Histogram() for phase in PHASES}
+        self.counters: dict[Counter, int] = {counter: 0 for counter in COUNTERS}
+        self.active_connections: int = 0
+        self._lock = Lock()
+
+    def observe(self, phase: Phase, seconds: float) -> None:
+        self.phases[phase].observe(seconds)
+
+    def increment(self, counter: Counter) -> None:
+        with self._lock:
+            self.counters[counter] += 1
+
+    def connection_opened(self) -> None:
+        with self._lock:
+            self.counters['connections'] += 1
+            self.active_connections += 1
+
+    def connection_closed(self) -> None:
+        with self._lock:
+            self.active_connections -= 1
+
+    def render(self, gauges: dict[str, float]) -> str:
+        # Prometheus text format
+        name = f'{METRICS_PREFIX}_phase_seconds'
+        lines = [
+            f'# HELP {name} Seconds spent in each phase of a request.',
+            f'# TYPE {name} histogram',
+        ]
+
+        for phase, histogram in self.phases.items():
+            lines.extend(histogram.render(name, f'phase="{phase}"'))
+
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = {'active_connections': self.active_connections, **gauges}
+
+        for counter, value in counters.items():
+            name = f'{METRICS_PREFIX}_{counter}_total'
+            lines.extend((f'# TYPE {name} counter', f'{name} {value}'))
+
+        for gauge, value in gauges.items():
+            name = f'{METRICS_PREFIX}_{gauge}'
+            lines.extend((f'# TYPE {name} gauge', f'{name} {value}'))
+
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics_address(bind: str, worker_index: int | None = None) -> str:
+    # Every worker process has its own metrics, so each one listens on the next port or on a numbered socket
+    if worker_index is None:
+        return bind
+
+    if bind.startswith('unix:'):
+        return f'{bind}.{worker_index}'
+
+    host, port = bind.rsplit(':', 1)
+    return f'{host}:{int(port) + worker_index}'
+
+
+class MetricsServer:
+    # Admin endpoint, served from its own thread so it answers even while every worker thread is busy
+
+    __slots__ = ('bind', 'render', '_socket', '_thread', '_unix_path')
+
+    def __init__(self, bind: str, render: Callable[[], str]) -> None:
+        # "HOST:PORT" or "unix:PATH"
+        self.bind: str = bind
+        self.render: Callable[[], str] = render
+
+        self._socket: socket.socket | None = None
+        self._thread: Thread | None = None
+        self._unix_path: str | None = None
+
+    def start(self) -> None:
+        if self.bind.startswith('unix:'):
+            self._unix_path = self.bind[len('unix:'):]
+
+            if os.path.exists(self._unix_path):
+                os.unlink(self._unix_path)
+
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.bind(self._unix_path)
+        else:
+            host, port = self.bind.rsplit(':', 1)
+            host = host.strip('[]')
+
+            self._socket = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._socket.bind((host, int(port)))
+
+        self._socket.listen()
+
+        self._thread = Thread(target=self._serve, name='metrics', daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+        if self._unix_path is not None and os.path.exists(self._unix_path):
+            os.unlink(self._unix_path)
+            self._unix_path = None
+
+    def _serve(self) -> None:
+        while self._socket is not None:
+            try:
+                client_socket, _ = self._socket.accept()
+            except OSError:
+                return
+
+            with client_socket:
+                try:
+                    self._handle_client(client_socket)
+                except OSError:
+                    pass
+
+    def _handle_client(self, client_socket: socket.socket) -> None:
+        client_socket.settimeout(5)
+        parser = HTTPRequestParser(max_headers=100, max_header_size=8192, max_url_length=1024, max_body_size=0)
+
+        while not parser.headers_completed:
+            data = client_socket.recv(8192)
+
+            if not data or parser.feed(data):
+                return
+
+        request = parser.get_result()
+
+        if request['method'] == 'GET' and request['url'].split('?', 1)[0] in ('/', '/metrics'):
+            body = self.render().encode()
+            head = b'HTTP/1.1 200 OK\r\ncontent-type: text/plain; version=0.0.4; charset=utf-8\r\n'
+        else:
+            body = b'Not Found\n'
+            head = b'HTTP/1.1 404 Not Found\r\ncontent-type: text/plain\r\n'
+
+        client_socket.sendall(head + b'content-length: %d\r\nconnection: close\r\n\r\n' % len(body) + body)
@@ -0,0 +1,230 @@
+from metrics import format_memory_usage, get_memory_usage
+from typing import TYPE_CHECKING, Callable, NoReturn
+import traceback
+import selectors
+import signal
+import time
+import sys
+import os
+
+
+if TYPE_CHECKING:
+    from web_server import WebServer
+
+
+SHUTDOWN_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT)
+FORWARDED_SIGNALS = (signal.SIGUSR1,)
+
+# Makes the master log the memory usage of every process
+MEMORY_REPORT_SIGNAL = signal.SIGUSR2
+
+
+class Master:
+    __slots__ = (
+        'server', 'workers', 'on_worker_start', 'graceful_timeout', '_workers', '_spawned_at', '_running', '_wakeup_reader',
+        '_wakeup_writer', '_pending_signals'
+    )
+
+    def __init__(
+        self,
+        server: 'WebServer',
+        workers: int,
+        on_worker_start: Callable[[], None] | None = None,
+        graceful_timeout: float = 30
+    ) -> None:
+        assert workers > 0
+
+        self.server: WebServer = server
+        self.workers: int = workers
+        self.on_worker_start: Callable[[], None] | None = on_worker_start
+        self.graceful_timeout: float = graceful_timeout
+
+        self._workers: dict[int, int] = {}
+        self._spawned_at: dict[int, float] = {}
+        self._running: bool = False
+        self._wakeup_reader, self._wakeup_writer = os.pipe()
+        self._pending_signals: list[int] = []
+
+    def _handle_signal(self, signum: int, _) -> None:
+        self._pending_signals.append(signum)
+
+    def _install_signal_handlers(self) -> None:
+        os.set_blocking(self._wakeup_writer, False)
+        signal.set_wakeup_fd(self._wakeup_writer)
+
+        for signum in (*SHUTDOWN_SIGNALS, *FORWARDED_SIGNALS, MEMORY_REPORT_SIGNAL, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, self._handle_signal)
+
+    def _run_worker(self, index: int) -> NoReturn:
+        signal.set_wakeup_fd(-1)
+        os.close(self._wakeup_reader)
+        os.close(self._wakeup_writer)
+
+        for signum in (MEMORY_REPORT_SIGNAL, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+
+        # Their default action ends the process, the worker installs a handler only for the features that use them
+        for signum in FORWARDED_SIGNALS:
+            signal.signal(signum, signal.SIG_IGN)
+
+        def handle_shutdown(*_) -> None:
+            raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, handle_shutdown)
+        signal.signal(signal.SIGQUIT, handle_shutdown)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+        self.server.worker_index = index
+
+        exit_code = 0
+        try:
+            if self.on_worker_start is not None:
+                self.on_worker_start()
+
+            self.server.listen()
+
+        except (KeyboardInterrupt, SystemExit):
+            pass
+
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+
+        finally:
+            try:
+                self.server.close()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+
+    def _spawn_worker(self, index: int) -> None:
+        pid = os.fork()
+
+        if pid == 0:
+            self._run_worker(index)
+
+        self._workers[pid] = index
+        self._spawned_at[pid] = time.monotonic()
+        print(f'INFO: Booting worker {index} with pid {pid}')
+
+    def _reap_workers(self) -> None:
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+
+            if pid == 0:
+                return
+
+            index = self._workers.pop(pid, None)
+            spawned_at = self._spawned_at.pop(pid, 0)
+
+            if index is None:
+                continue
+
+            exit_code = os.waitstatus_to_exitcode(status)
+
+            if not self._running:
+                continue
+
+            print(f'WARNING: Worker {index} with pid {pid} exited with code {exit_code}')
+
+            # Avoid respawning in a tight loop when workers crash while booting
+            if exit_code != 0 and time.monotonic() - spawned_at < 1:
+                time.sleep(1)
+
+            self._spawn_worker(index)
+
+    def _signal_workers(self, signum: int) -> None:
+        for pid in self._workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _report_memory(self) -> None:
+        processes = [('master', os.getpid())]
+        processes.extend((f'worker {index}', pid) for pid, index in sorted(self._workers.items(), key=lambda worker: worker[1]))
+
+        total_rss = 0
+        total_pss = 0
+
+        for name, pid in processes:
+            usage = get_memory_usage(pid)
+
+            if usage is None:
+                print(f'WARNING: The memory usage of {name} with pid {pid} is not available')
+                continue
+
+            total_rss += usage['rss']
+            total_pss += usage['pss']
+            print(f'INFO: Memory of {name} with pid {pid}: {format_memory_usage(usage)}')
+
+        # Shared pages are counted once per process in the RSS, but only once in total in the PSS
+        print(f'INFO: Memory of every process: RSS {total_rss / 1048576:.1f} MiB, PSS {total_pss / 1048576:.1f} MiB')
+
+    def _stop_workers(self) -> None:
+        self._signal_workers(signal.SIGTERM)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while self._workers and time.monotonic() < deadline:
+            self._reap_workers()
+            time.sleep(0.1)
+
+        if self._workers:
+            print(f'WARNING: Killing {len(self._workers)} workers that did not exit in time')
+            self._signal_workers(signal.SIGKILL)
+
+            while self._workers:
+                pid, _ = os.waitpid(-1, 0)
+                self._workers.pop(pid, None)
+
+    def _handle_pending_signals(self) -> None:
+        while self._pending_signals:
+            signum = self._pending_signals.pop(0)
+
+            if signum in SHUTDOWN_SIGNALS:
+                self._running = False
+            elif signum == signal.SIGHUP:
+                print('INFO: Restarting workers')
+                self._signal_workers(signal.SIGTERM)
+            elif signum == MEMORY_REPORT_SIGNAL:
+                self._report_memory()
+            elif signum in FORWARDED_SIGNALS:
+                self._signal_workers(signum)
+
+    def run(self) -> None:
+        print(f'INFO: Workers: {self.workers}')
+
+        self._running = True
+        self._install_signal_handlers()
+
+        for index in range(self.workers):
+            self._spawn_worker(index)
+
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_reader, selectors.EVENT_READ)
+
+        try:
+            while self._running:
+                if selector.select(timeout=1):
+                    try:
+                        os.read(self._wakeup_reader, 4096)
+                    except BlockingIOError:
+                        pass
+
+                self._handle_pending_signals()
+                self._reap_workers()
+
+        finally:
+            self._running = False
+            signal.set_wakeup_fd(-1)
+            selector.close()
+
+            print('INFO: Shutting down workers')
+            self._stop_workers()
+
+            os.close(self._wakeup_reader)
+            os.close(self._wakeup_writer)
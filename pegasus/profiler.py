@@ -0,0 +1,154 @@
+from http_parser import HTTPRequest
+from threading import Lock, get_ident
+import ipaddress
+import cProfile
+import pstats
+import random
+import signal
+import time
+import re
+import os
+
+
+Address = tuple[str, int]
+IPNetwork = ipaddress.IPv4Network | ipaddress.IPv6Network
+
+# Requests from trusted addresses with this header are always profiled
+TRIGGER_HEADER = 'x-pegasus-profile'
+
+# Makes each process save what it profiled
+DUMP_SIGNAL = signal.SIGUSR1
+
+# Path segments that are identifiers are replaced, so "/users/1" and "/users/2" are the same route
+ID_SEGMENT = re.compile(r'^(?:\d+|[0-9a-fA-F-]{16,})$')
+
+# Past it, the requests of new routes are aggregated together
+MAX_ROUTES = 256
+
+
+def get_route(request: HTTPRequest) -> str:
+    path = request['url'].partition('?')[0]
+    return request['method'] + ' ' + '/'.join('{id}' if ID_SEGMENT.match(segment) else segment for segment in path.split('/'))
+
+
+class Sample:
+    __slots__ = ('profile', 'route', 'thread', 'started_at', 'app_time')
+
+    def __init__(self, profile: cProfile.Profile, route: str) -> None:
+        self.profile: cProfile.Profile = profile
+        self.route: str = route
+        self.thread: int = get_ident()
+        self.started_at: float = time.perf_counter()
+        self.app_time: float = 0
+
+
+class RouteProfile:
+    __slots__ = ('stats', 'requests', 'phases')
+
+    def __init__(self, profile: cProfile.Profile) -> None:
+        self.stats = pstats.Stats(profile)
+        self.requests: int = 0
+        # Seconds spent in each phase by every request together
+        self.phases: dict[str, float] = {'header_parse': 0, 'app': 0, 'server': 0}
+
+
+class RequestProfiler:
+    # Profiles a fraction of the requests with `cProfile`, so the overhead is only paid by them
+
+    __slots__ = ('sample_rate', 'trusted_networks', 'output_dir', '_routes', '_active', '_lock', '_profile_lock')
+
+    def __init__(self, sample_rate: float, trusted_networks: tuple[str, ...] = (), output_dir: str = 'profiles') -> None:
+        assert 0 <= sample_rate <= 1
+
+        self.sample_rate: float = sample_rate
+        # Addresses allowed to request a profile with the trigger header, none by default
+        self.trusted_networks: tuple[IPNetwork, ...] = tuple(ipaddress.ip_network(network) for network in trusted_networks)
+        self.output_dir: str = output_dir
+
+        self._routes: dict[str, RouteProfile] = {}
+        self._active: Sample | None = None
+        self._lock = Lock()
+        # Only one profiler can be active at a time, and since Python 3.12 it sees every thread
+        self._profile_lock = Lock()
+
+    def _is_trusted(self, addr: Address) -> bool:
+        try:
+            address = ipaddress.ip_address(addr[0])
+        except ValueError:
+            return False
+
+        return any(address in network for network in self.trusted_networks)
+
+    def _is_sampled(self, request: HTTPRequest, addr: Address) -> bool:
+        if self.trusted_networks:
+            for key, _ in request['headers']:
+                if key == TRIGGER_HEADER and self._is_trusted(addr):
+                    return True
+
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, request: HTTPRequest, addr: Address) -> Sample | None:
+        # Returns None if the request is not sampled, or another one is already being profiled
+        if not self._is_sampled(request, addr) or not self._profile_lock.acquire(blocking=False):
+            return None
+
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is running, e.g. the whole server is being profiled
+            self._profile_lock.release()
+            return None
+
+        self._active = Sample(profile, get_route(request))
+        return self._active
+
+    def record_app_time(self, seconds: float) -> None:
+        sample = self._active
+
+        if sample is not None and sample.thread == get_ident():
+            sample.app_time = seconds
+
+    def finish(self, sample: Sample, header_parse_time: float) -> None:
+        sample.profile.disable()
+        total_time = time.perf_counter() - sample.started_at
+
+        self._active = None
+        self._profile_lock.release()
+
+        with self._lock:
+            route = sample.route
+            if route not in self._routes and len(self._routes) >= MAX_ROUTES:
+                route = route.split(' ', 1)[0] + ' *'
+
+            route_profile = self._routes.get(route)
+
+            if route_profile is None:
+                route_profile = self._routes[route] = RouteProfile(sample.profile)
+            else:
+                route_profile.stats.add(sample.profile)
+
+            route_profile.requests += 1
+            route_profile.phases['header_parse'] += header_parse_time
+            route_profile.phases['app'] += sample.app_time
+            # Cache lookups, compression and serialization, streamed bodies are produced later while being sent
+            route_profile.phases['server'] += max(0.0, total_time - sample.app_time)
+
+    def dump(self, prefix: str = '') -> None:
+        with self._lock:
+            if not self._routes:
+                print('INFO: No requests were profiled yet')
+                return
+
+            os.makedirs(self.output_dir, exist_ok=True)
+
+            for route, route_profile in self._routes.items():
+                name = re.sub(r'[^A-Za-z0-9]+', '_', route.replace('{id}', 'id')).strip('_')
+                path = os.path.join(self.output_dir, f'{prefix}{name}.pstats')
+                route_profile.stats.dump_stats(path)
+
+                phases = ', '.join(
+                    f'{phase} {seconds / route_profile.requests * 1000:.3f} ms' for phase, seconds in route_profile.phases.items()
+                )
+                print(f'INFO: Profile of "{route}" ({route_profile.requests} requests, {phases}) saved to "{path}"')
@@ -0,0 +1,83 @@
+from http_parser import HTTPRequestParser
+from typing import IO, TYPE_CHECKING
+import socket
+import time
+import io
+
+
+if TYPE_CHECKING:
+    from _typeshed import WriteableBuffer
+
+
+CONTINUE_RESPONSE = b'HTTP/1.1 100 Continue\r\n\r\n'
+
+
+class RequestBodyError(OSError):
+    pass
+
+
+class SocketBodyReader(io.RawIOBase):
+    # Pulls the body from the socket as the application reads it, the parser limits it to the "Content-Length"
+
+    def __init__(self, socket: socket.socket, parser: HTTPRequestParser, recv_size: int = 65536) -> None:
+        self._socket = socket
+        self._parser = parser
+        self._recv_size = recv_size
+        # Seconds spent waiting for the body
+        self.read_time: float = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: 'WriteableBuffer') -> int:
+        view = memoryview(buffer)
+
+        while True:
+            data = self._parser.take_body(len(view))
+
+            if data:
+                view[:len(data)] = data
+                return len(data)
+
+            if self._parser.completed:
+                return 0
+
+            # The client is waiting for confirmation before sending the body
+            if self._parser.expect_continue:
+                self._parser.expect_continue = False
+                self._socket.sendall(CONTINUE_RESPONSE)
+
+            started_at = time.perf_counter()
+            chunk = self._socket.recv(self._recv_size)
+            self.read_time += time.perf_counter() - started_at
+
+            if chunk == b'':
+                raise RequestBodyError('The client disconnected before sending the whole body.')
+
+            error = self._parser.feed(chunk)
+            if error:
+                raise RequestBodyError(error.msg)
+
+
+def drain_body(body: IO[bytes], parser: HTTPRequestParser, limit: int = 65536) -> bool:
+    # Discards what the application did not read, so the connection is ready for the next request
+    body_left = parser.body_left
+
+    if body_left is not None and body_left > limit:
+        return False
+
+    drained = 0
+
+    try:
+        while drained <= limit:
+            data = body.read(65536)
+
+            if not data:
+                return True
+
+            drained += len(data)
+
+    except OSError:
+        pass
+
+    return False
@@ -0,0 +1,184 @@
+from http_parser import parse_digits, HTTPHeader, HTTPRequest, HTTPResponse
+from collections import OrderedDict
+from threading import Event, Lock
+import time
+
+
+# Method, host, URL, the values of the headers the responses vary on and the content encoding
+CacheKey = tuple[str, str, str, tuple[str, ...], str]
+
+# Statuses that can be reused without revalidation (RFC 9111, section 4.2.2)
+CACHEABLE_STATUSES = ('200', '203', '204', '300', '301', '308', '404', '405', '410', '414', '501')
+
+# Bytes counted for each entry besides the response itself
+ENTRY_OVERHEAD = 256
+
+
+def get_cache_control(headers: list[HTTPHeader]) -> dict[str, str]:
+    directives: dict[str, str] = {}
+
+    for key, value in headers:
+        if key.lower() != 'cache-control':
+            continue
+
+        for directive in value.split(','):
+            name, _, argument = directive.partition('=')
+            directives[name.strip().lower()] = argument.strip().strip('"')
+
+    return directives
+
+
+class CacheEntry:
+    __slots__ = ('response', 'head', 'body', 'size', 'stored_at', 'expires_at')
+
+    def __init__(self, response: HTTPResponse, head: bytes, body: bytes, max_age: int) -> None:
+        # The response is kept without its body, to know whether the connection can be kept alive
+        self.response: HTTPResponse = response
+        # Serialized status line and headers, except the ones that change on each response
+        self.head: bytes = head
+        self.body: bytes = body
+        self.size: int = len(head) + len(body) + ENTRY_OVERHEAD
+        self.stored_at: float = time.monotonic()
+        self.expires_at: float = self.stored_at + max_age
+
+    @property
+    def age(self) -> int:
+        return int(time.monotonic() - self.stored_at)
+
+
+class ResponseCache:
+    # Shared cache of whole responses, only used for GET requests whose response allows it with "max-age"
+
+    __slots__ = ('max_size', 'max_entry_size', 'vary', 'max_wait', 'size', '_entries', '_pending', '_lock')
+
+    def __init__(self, max_size: int, vary: tuple[str, ...] = (), max_entry_size: int | None = None, max_wait: float = 10) -> None:
+        assert max_size > 0
+        assert max_entry_size is None or max_entry_size > 0
+        assert max_wait > 0
+
+        # Bytes of every entry together, the least recently used ones are evicted past it
+        self.max_size: int = max_size
+        self.max_entry_size: int = max_entry_size if max_entry_size is not None else max_size // 8
+        # Request headers that are part of the key, responses varying on other headers are not cached
+        self.vary: tuple[str, ...] = tuple(header.lower() for header in vary)
+        # Seconds a request waits for another one that is already producing the same response
+        self.max_wait: float = max_wait
+        self.size: int = 0
+
+        self._entries: OrderedDict[CacheKey, CacheEntry] = OrderedDict()
+        self._pending: dict[CacheKey, Event] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_key(self, request: HTTPRequest, encoding: str = '') -> CacheKey | None:
+        if request['method'] != 'GET' or request['body'] is not None:
+            return None
+
+        host = ''
+        values = [''] * len(self.vary)
+
+        for key, value in request['headers']:
+            key = key.lower()
+
+            # Responses to authenticated requests are private
+            if key == 'authorization':
+                return None
+
+            # Virtual hosts served by the same application don't share responses
+            if key == 'host':
+                host = value.lower()
+
+            if key in self.vary:
+                index = self.vary.index(key)
+                values[index] = value if not values[index] else values[index] + ',' + value
+
+        return request['method'], host, request['url'], tuple(values), encoding
+
+    def get_max_age(self, response: HTTPResponse) -> int | None:
+        # Seconds the response can be reused for, or None if it can't be cached
+        if response['status'][:3] not in CACHEABLE_STATUSES or not isinstance(response['body'], (bytes, type(None))):
+            return None
+
+        for key, value in response['headers']:
+            key = key.lower()
+
+            if key == 'set-cookie':
+                return None
+
+            if key == 'vary':
+                for header in value.split(','):
+                    header = header.strip().lower()
+
+                    if header and header != 'host' and header not in self.vary:
+                        return None
+
+        directives = get_cache_control(response['headers'])
+
+        if 'no-store' in directives or 'no-cache' in directives or 'private' in directives:
+            return None
+
+        # "s-maxage" is meant for shared caches like this one
+        max_age = parse_digits(directives.get('s-maxage', directives.get('max-age', '')))
+
+        # Zero, missing or invalid
+        if not max_age:
+            return None
+
+        return max_age
+
+    def acquire(self, key: CacheKey) -> tuple[CacheEntry | None, bool]:
+        # Returns a fresh entry, or whether the caller has to produce the response and then call `release`.
+        # Concurrent misses of the same key wait for the first one, so the application runs only once
+        with self._lock:
+            entry = self._get(key)
+
+            if entry is not None:
+                return entry, False
+
+            event = self._pending.get(key)
+
+            if event is None:
+                self._pending[key] = Event()
+                return None, True
+
+        event.wait(self.max_wait)
+
+        with self._lock:
+            # If the response couldn't be cached, each waiting request produces its own
+            return self._get(key), False
+
+    def release(self, key: CacheKey, entry: CacheEntry | None) -> None:
+        with self._lock:
+            if entry is not None and entry.size <= self.max_entry_size:
+                self._remove(key)
+                self._entries[key] = entry
+                self.size += entry.size
+
+                while self.size > self.max_size:
+                    self._remove(next(iter(self._entries)))
+
+            event = self._pending.pop(key, None)
+
+        if event is not None:
+            event.set()
+
+    def _get(self, key: CacheKey) -> CacheEntry | None:
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return entry
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self.size -= entry.size
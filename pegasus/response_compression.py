@@ -0,0 +1,325 @@
+from http_parser import parse_digits, HTTPHeader, HTTPResponse
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterable, Iterator
+from types import ModuleType
+from threading import Lock
+import importlib
+import hashlib
+import zlib
+
+
+def import_optional(name: str) -> ModuleType | None:
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+brotli = import_optional('brotli')
+zstandard = import_optional('zstandard')
+
+# Preferred first when the client accepts several with the same quality
+SUPPORTED_ENCODINGS: tuple[str, ...] = tuple(
+    encoding
+    for encoding, module in (('zstd', zstandard), ('br', brotli), ('gzip', zlib), ('deflate', zlib))
+    if module is not None
+)
+
+# Faster than the defaults, responses are compressed while the client waits
+COMPRESSION_LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6, 'deflate': 6}
+
+# Ending with "/" matches the whole type, and starting with "+" matches the suffix
+DEFAULT_CONTENT_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'application/xml', 'application/wasm', 'image/svg+xml', '+json',
+    '+xml'
+)
+
+# Statuses whose body is not the representation, or has no body at all
+UNCOMPRESSED_STATUSES = ('100', '101', '204', '206', '304')
+
+# Parsed "Accept-Encoding" values, clients send a handful of different ones
+MAX_ACCEPT_ENCODINGS = 256
+
+# Bytes counted for each entry of the cache besides the compressed body
+CACHE_ENTRY_OVERHEAD = 128
+
+# Compresses a chunk and returns what can be sent so far, and finishes the stream
+StreamCompressor = tuple[Callable[[bytes], bytes], Callable[[], bytes]]
+
+
+def create_stream_compressor(encoding: str) -> StreamCompressor:
+    level = COMPRESSION_LEVELS[encoding]
+
+    if encoding == 'br':
+        assert brotli is not None
+        compressor = brotli.Compressor(quality=level)
+        return (lambda data: compressor.process(data) + compressor.flush()), compressor.finish
+
+    if encoding == 'zstd':
+        assert zstandard is not None
+        zstd_compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return (lambda data: zstd_compressor.compress(data) + zstd_compressor.flush(flush_block)), zstd_compressor.flush
+
+    # "gzip" has a gzip header, and "deflate" a zlib one
+    zlib_compressor = zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+    return (lambda data: zlib_compressor.compress(data) + zlib_compressor.flush(zlib.Z_SYNC_FLUSH)), zlib_compressor.flush
+
+
+def compress(encoding: str, data: bytes) -> bytes:
+    level = COMPRESSION_LEVELS[encoding]
+
+    if encoding == 'br':
+        assert brotli is not None
+        return brotli.compress(data, quality=level)
+
+    if encoding == 'zstd':
+        assert zstandard is not None
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(encoding: str, body: Iterable[bytes]) -> Iterator[bytes]:
+    compress_chunk, finish = create_stream_compressor(encoding)
+
+    try:
+        for chunk in body:
+            # Each chunk is flushed, so streamed responses still arrive as they are produced
+            if chunk:
+                yield compress_chunk(chunk)
+
+        yield finish()
+
+    finally:
+        close = getattr(body, 'close', None)
+
+        if close is not None:
+            close()
+
+
+class CompressionCache:
+    # Compressed bodies of payloads that are sent again and again, the least recently used are evicted past `max_size`
+
+    __slots__ = ('max_size', 'size', '_entries', '_lock')
+
+    def __init__(self, max_size: int) -> None:
+        assert max_size > 0
+
+        self.max_size: int = max_size
+        self.size: int = 0
+
+        self._entries: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> bytes | None:
+        with self._lock:
+            data = self._entries.get(key)
+
+            if data is not None:
+                self._entries.move_to_end(key)
+
+            return data
+
+    def put(self, key: Hashable, data: bytes) -> None:
+        size = len(data) + CACHE_ENTRY_OVERHEAD
+
+        if size > self.max_size // 8:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous) + CACHE_ENTRY_OVERHEAD
+
+            self._entries[key] = data
+            self.size += size
+
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted) + CACHE_ENTRY_OVERHEAD
+
+
+class ResponseCompression:
+    __slots__ = ('encodings', 'min_size', 'content_types', 'cache', '_accept_encodings')
+
+    def __init__(
+        self,
+        encodings: tuple[str, ...] = SUPPORTED_ENCODINGS,
+        min_size: int = 1024,
+        content_types: tuple[str, ...] = DEFAULT_CONTENT_TYPES,
+        cache_size: int | None = None
+    ) -> None:
+        assert all(encoding in SUPPORTED_ENCODINGS for encoding in encodings)
+        assert min_size >= 0
+
+        # In order of preference
+        self.encodings: tuple[str, ...] = encodings
+        self.min_size: int = min_size
+        self.content_types: tuple[str, ...] = tuple(content_type.lower() for content_type in content_types)
+        self.cache: CompressionCache | None = CompressionCache(cache_size) if cache_size is not None else None
+
+        self._accept_encodings: dict[str, str | None] = {}
+
+    def negotiate(self, accept_encoding: str) -> str | None:
+        # The encoding to use for an "Accept-Encoding" value, or None for the identity
+        try:
+            return self._accept_encodings[accept_encoding]
+        except KeyError:
+            pass
+
+        qualities: dict[str, float] = {}
+
+        for item in accept_encoding.split(','):
+            name, *params = item.split(';')
+            quality = 1.0
+
+            for param in params:
+                key, _, value = param.partition('=')
+
+                if key.strip().lower() == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0
+
+            qualities[name.strip().lower()] = quality
+
+        wildcard = qualities.get('*', 0)
+        best: str | None = None
+        best_quality = 0.0
+
+        for encoding in self.encodings:
+            quality = qualities.get(encoding, wildcard)
+
+            if quality > best_quality:
+                best = encoding
+                best_quality = quality
+
+        if len(self._accept_encodings) < MAX_ACCEPT_ENCODINGS:
+            self._accept_encodings[accept_encoding] = best
+
+        return best
+
+    def _is_compressible_type(self, content_type: str) -> bool:
+        media_type = content_type.split(';', 1)[0].strip().lower()
+
+        for allowed in self.content_types:
+            if allowed.endswith('/'):
+                if media_type.startswith(allowed):
+                    return True
+
+            elif allowed.startswith('+'):
+                if media_type.endswith(allowed):
+                    return True
+
+            elif media_type == allowed:
+                return True
+
+        return False
+
+    def compress_response(self, response: HTTPResponse, encoding: str | None) -> HTTPResponse:
+        # Returns the same response if it shouldn't be compressed.
+        # Without an encoding, it's only marked as varying on "Accept-Encoding", since other clients get it compressed
+        body = response['body']
+
+        if body is None or response['status'][:3] in UNCOMPRESSED_STATUSES:
+            return response
+
+        if isinstance(body, bytes) and len(body) < self.min_size:
+            return response
+
+        content_type = ''
+        content_length: str | None = None
+        # Whether the same payload is likely to be sent again, so its compressed version is cached
+        cacheable = False
+        no_store = False
+
+        for key, value in response['headers']:
+            key = key.lower()
+
+            if key == 'content-encoding':
+                return response
+
+            if key == 'content-type':
+                content_type = value
+            elif key == 'content-length':
+                content_length = value
+            elif key == 'etag' or key == 'last-modified':
+                cacheable = True
+            elif key == 'cache-control':
+                value = value.lower()
+
+                if 'no-transform' in value:
+                    return response
+
+                if 'no-store' in value:
+                    no_store = True
+                elif 'max-age' in value:
+                    cacheable = True
+
+        if not self._is_compressible_type(content_type):
+            return response
+
+        if content_length is not None:
+            length = parse_digits(content_length)
+
+            if length is not None and length < self.min_size:
+                return response
+
+        headers: list[HTTPHeader] = []
+        has_vary = False
+
+        for key, value in response['headers']:
+            lower_key = key.lower()
+
+            if encoding is not None:
+                if lower_key == 'content-length':
+                    continue
+
+                # A strong validator must change with the encoding
+                if lower_key == 'etag' and not value.startswith('W/'):
+                    value = 'W/' + value
+
+            if lower_key == 'vary':
+                has_vary = True
+
+                if value.strip() != '*' and 'accept-encoding' not in value.lower():
+                    value += ', Accept-Encoding'
+
+            headers.append((key, value))
+
+        if not has_vary:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if encoding is None:
+            return {'status': response['status'], 'headers': headers, 'body': body}
+
+        headers.append(('Content-Encoding', encoding))
+
+        if isinstance(body, bytes):
+            return {
+                'status': response['status'],
+                'headers': headers,
+                'body': self._compress_body(encoding, body, cacheable and not no_store)
+            }
+
+        return {'status': response['status'], 'headers': headers, 'body': compress_stream(encoding, body)}
+
+    def _compress_body(self, encoding: str, body: bytes, cacheable: bool) -> bytes:
+        if self.cache is None or not cacheable:
+            return compress(encoding, body)
+
+        # Hashing is much cheaper than compressing again
+        key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+        data = self.cache.get(key)
+
+        if data is None:
+            data = compress(encoding, body)
+            self.cache.put(key, data)
+
+        return data
@@ -0,0 +1,318 @@
+from http_parser import generate_http_status, http_status, parse_digits, HTTPHeader, HTTPRequest, HTTPResponse
+from file_wrapper import FileWrapper
+from collections import OrderedDict
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from urllib.parse import unquote
+from threading import Lock
+import mimetypes
+import stat
+import time
+import os
+
+
+# Each cached file keeps a descriptor open
+MAX_OPEN_FILES = 1024
+
+# Seconds a cached file is served before checking whether it changed on disk
+CHECK_INTERVAL = 1.0
+
+
+class StaticFile:
+    __slots__ = ('path', 'fd', 'size', 'mtime_ns', 'ino', 'etag', 'last_modified', 'content_type', 'checked_at')
+
+    def __init__(self, path: str, fd: int, file_stat: os.stat_result) -> None:
+        self.path: str = path
+        self.fd: int = fd
+        self.size: int = file_stat.st_size
+        self.mtime_ns: int = file_stat.st_mtime_ns
+        self.ino: int = file_stat.st_ino
+        self.etag: str = '"%x-%x"' % (file_stat.st_mtime_ns, file_stat.st_size)
+        self.last_modified: str = formatdate(file_stat.st_mtime, usegmt=True)
+
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/'):
+            content_type += '; charset=utf-8'
+
+        self.content_type: str = content_type
+        self.checked_at: float = time.monotonic()
+
+    def is_current(self, file_stat: os.stat_result) -> bool:
+        return (
+            file_stat.st_mtime_ns == self.mtime_ns
+            and file_stat.st_size == self.size
+            and file_stat.st_ino == self.ino
+        )
+
+    def is_modified(self, request: HTTPRequest) -> bool:
+        # "If-None-Match" takes precedence over "If-Modified-Since" (RFC 9110, section 13.2.2)
+        if_none_match: str | None = None
+        if_modified_since: str | None = None
+
+        for key, value in request['headers']:
+            key = key.lower()
+
+            if key == 'if-none-match':
+                if_none_match = value if if_none_match is None else if_none_match + ',' + value
+            elif key == 'if-modified-since':
+                if_modified_since = value
+
+        if if_none_match is not None:
+            for etag in if_none_match.split(','):
+                etag = etag.strip()
+
+                # Weak comparison, the representation is the same
+                if etag == '*' or etag.removeprefix('W/') == self.etag:
+                    return False
+
+            return True
+
+        if if_modified_since is not None:
+            if if_modified_since == self.last_modified:
+                return False
+
+            date = parsedate_tz(if_modified_since)
+            if date is not None and self.mtime_ns // 1000000000 <= mktime_tz(date):
+                return False
+
+        return True
+
+    def get_range(self, request: HTTPRequest) -> tuple[int, int] | None | bool:
+        # The first and last byte of the requested range, None for the whole file, or False if it can't be satisfied
+        range_value: str | None = None
+        if_range: str | None = None
+
+        for key, value in request['headers']:
+            key = key.lower()
+
+            if key == 'range':
+                range_value = value
+            elif key == 'if-range':
+                if_range = value.strip()
+
+        if range_value is None or not range_value.startswith('bytes='):
+            return None
+
+        # The client has a different version, so it gets the whole file
+        if if_range is not None and if_range != self.etag and if_range != self.last_modified:
+            return None
+
+        ranges = range_value[len('bytes='):].split(',')
+
+        # Several ranges would need a multipart body, the whole file is sent instead
+        if len(ranges) != 1:
+            return None
+
+        first, _, last = ranges[0].strip().partition('-')
+
+        if not first:
+            suffix = parse_digits(last)
+
+            if suffix is None:
+                return None
+
+            # The last N bytes
+            if suffix == 0 or self.size == 0:
+                return False
+
+            return max(0, self.size - suffix), self.size - 1
+
+        start = parse_digits(first)
+        end = parse_digits(last) if last else self.size - 1
+
+        if start is None or end is None:
+            return None
+
+        end = min(end, self.size - 1)
+
+        if start >= self.size:
+            return False
+
+        if end < start:
+            return None
+
+        return start, end
+
+
+class StaticFiles:
+    # Files under URL prefixes answered by the server itself, without calling the application
+
+    __slots__ = ('mounts', 'max_open_files', 'check_interval', '_files', '_lock')
+
+    def __init__(self, mounts: tuple[tuple[str, str], ...], max_open_files: int = MAX_OPEN_FILES, check_interval: float = CHECK_INTERVAL) -> None:
+        assert max_open_files > 0
+        assert check_interval >= 0
+
+        # Longest prefixes first, so nested mounts take precedence
+        self.mounts: list[tuple[str, str]] = sorted(
+            ((prefix.rstrip('/'), os.path.realpath(directory)) for prefix, directory in mounts),
+            key=lambda mount: len(mount[0]),
+            reverse=True
+        )
+        self.max_open_files: int = max_open_files
+        self.check_interval: float = check_interval
+
+        # By URL path, so resolving and opening the file is skipped for the following requests
+        self._files: OrderedDict[str, StaticFile] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def close(self) -> None:
+        with self._lock:
+            while self._files:
+                os.close(self._files.popitem()[1].fd)
+
+    def match(self, request: HTTPRequest) -> tuple[str, str] | None:
+        # The mount directory and the path relative to it, only requests without a body are served
+        if request['body'] is not None:
+            return None
+
+        path = request['url'].partition('?')[0]
+
+        for prefix, directory in self.mounts:
+            if path.startswith(prefix) and (len(path) == len(prefix) or path[len(prefix)] == '/'):
+                return directory, path[len(prefix):]
+
+        return None
+
+    def serve(self, request: HTTPRequest) -> HTTPResponse | None:
+        # Returns None if the request is not under any prefix
+        mount = self.match(request)
+        if mount is None:
+            return None
+
+        if request['method'] != 'GET':
+            return {
+                'status': generate_http_status(http_status.HTTP_405_METHOD_NOT_ALLOWED),
+                'headers': [('Allow', 'GET')],
+                'body': None
+            }
+
+        url_path = request['url'].partition('?')[0]
+        fd, file = self._open(url_path, *mount)
+
+        if file is None:
+            return {
+                'status': generate_http_status(http_status.HTTP_404_NOT_FOUND),
+                'headers': [('Content-Type', 'text/plain')],
+                'body': b'Not Found\n'
+            }
+
+        headers: list[HTTPHeader] = [
+            ('ETag', file.etag),
+            ('Last-Modified', file.last_modified),
+            ('Accept-Ranges', 'bytes'),
+        ]
+
+        try:
+            if not file.is_modified(request):
+                return {'status': generate_http_status(http_status.HTTP_304_NOT_MODIFIED), 'headers': headers, 'body': None}
+
+            headers.append(('Content-Type', file.content_type))
+
+            byte_range = file.get_range(request)
+
+            if byte_range is False:
+                headers.append(('Content-Range', 'bytes */%d' % file.size))
+
+                return {
+                    'status': generate_http_status(http_status.HTTP_416_RANGE_NOT_SATISFIABLE),
+                    'headers': headers,
+                    'body': None
+                }
+
+            status = http_status.HTTP_200_OK
+            offset = 0
+            length = file.size
+
+            if isinstance(byte_range, tuple):
+                status = http_status.HTTP_206_PARTIAL_CONTENT
+                offset = byte_range[0]
+                length = byte_range[1] - byte_range[0] + 1
+                headers.append(('Content-Range', 'bytes %d-%d/%d' % (byte_range[0], byte_range[1], file.size)))
+
+            headers.append(('Content-Length', str(length)))
+
+            if length == 0:
+                return {'status': generate_http_status(status), 'headers': headers, 'body': None}
+
+            body = FileWrapper(open(fd, 'rb', buffering=0), offset=offset, length=length)
+            fd = None
+
+            return {'status': generate_http_status(status), 'headers': headers, 'body': body}
+
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _open(self, url_path: str, directory: str, relative_path: str) -> tuple[int | None, StaticFile | None]:
+        # Returns a duplicate of the cached descriptor, owned by the caller.
+        # The cached one may be closed by another thread once the file is evicted or changes
+        with self._lock:
+            file = self._files.get(url_path)
+
+            if file is not None and time.monotonic() - file.checked_at < self.check_interval:
+                self._files.move_to_end(url_path)
+                return os.dup(file.fd), file
+
+        if file is not None:
+            try:
+                file_stat = os.stat(file.path)
+            except OSError:
+                file_stat = None
+
+            if file_stat is not None and file.is_current(file_stat):
+                with self._lock:
+                    if self._files.get(url_path) is file:
+                        file.checked_at = time.monotonic()
+                        return os.dup(file.fd), file
+
+        path = self._resolve(directory, relative_path)
+        new_file: StaticFile | None = None
+
+        if path is not None:
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+            except OSError:
+                pass
+            else:
+                try:
+                    file_stat = os.fstat(fd)
+                except OSError:
+                    file_stat = None
+
+                if file_stat is not None and stat.S_ISREG(file_stat.st_mode):
+                    new_file = StaticFile(path, fd, file_stat)
+                else:
+                    os.close(fd)
+
+        with self._lock:
+            previous = self._files.pop(url_path, None)
+            if previous is not None:
+                os.close(previous.fd)
+
+            if new_file is None:
+                return None, None
+
+            self._files[url_path] = new_file
+
+            while len(self._files) > self.max_open_files:
+                os.close(self._files.popitem(last=False)[1].fd)
+
+            return os.dup(new_file.fd), new_file
+
+    @staticmethod
+    def _resolve(directory: str, relative_path: str) -> str | None:
+        relative_path = unquote(relative_path)
+
+        if '\x00' in relative_path:
+            return None
+
+        # Symbolic links are followed, but they can't lead outside of the directory either
+        path = os.path.realpath(os.path.join(directory, relative_path.lstrip('/')))
+
+        if os.path.commonpath((directory, path)) != directory:
+            return None
+
+        return path
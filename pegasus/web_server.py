@@ -1,40 +1,287 @@
-from http_parser import generate_http_status, http_status, HTTPRequest, HTTPRequestParser, HTTPResponse, ParsingError
-from typing import Callable
+from http_parser import generate_http_status, http_status, parse_digits, HTTPHeader, HTTPRequest, HTTPRequestParser, HTTPResponse, ParsingError
+from request_body import SocketBodyReader, drain_body
+from event_loop import Dispatch, EventLoop
+from asgi_server import ASGIApplication, ASGIServer
+from file_wrapper import FileWrapper
+from access_log import DEFAULT_ACCESS_LOG_FORMAT, AccessLog, AccessLogPolicy
+from metrics import Metrics, MetricsServer, get_memory_usage, get_metrics_address
+from response_cache import CacheEntry, CacheKey, ResponseCache
+from response_compression import DEFAULT_CONTENT_TYPES, ResponseCompression
+from static_files import StaticFiles
+from listeners import create_listener, get_bind, parse_bind, prepare_client
+from profiler import DUMP_SIGNAL, RequestProfiler
+from http2 import INTERNAL_ERROR, PREFACE, SWITCHING_PROTOCOLS_RESPONSE, HTTP2Connection, HTTP2Stream, get_upgrade_settings
+from worker_pool import WorkerPool, is_gil_enabled
+from typing import Any, Callable, Iterable, Iterator, Literal
+from email.utils import formatdate
 from threading import Thread
+import selectors
+import signal
 import socket
+import time
+import io
 import os
 
 
 WEB_SERVER_NAME = 'pegasus'
 
+NO_CONTENT_STATUSES = ('100', '101', '204', '304')
+
+# Headers added to every response are encoded only once
+SERVER_HEADER = b'server: %s\r\n' % WEB_SERVER_NAME.encode()
+KEEP_ALIVE_HEADER = b'connection: keep-alive\r\n'
+CLOSE_HEADER = b'connection: close\r\n'
+CHUNKED_HEADER = b'transfer-encoding: chunked\r\n'
+EMPTY_CONTENT_LENGTH_HEADER = b'content-length: 0\r\n'
+
+_date_header: tuple[int, bytes] = (0, b'')
+
 
 Address = tuple[str, int]
-Client = tuple[socket.socket, Address]
+# The last item is when the connection was accepted
+Client = tuple[socket.socket, Address, float]
 
 OnRequest = Callable[[HTTPRequest, Address], HTTPResponse]
 
+Engine = Literal['threaded', 'eventloop']
+
+
+def get_date_header() -> bytes:
+    # The date has a resolution of seconds, so it's formatted at most once per second
+    global _date_header
+
+    now = int(time.time())
+
+    if _date_header[0] != now:
+        _date_header = (now, b'date: %s\r\n' % formatdate(now, usegmt=True).encode())
+
+    return _date_header[1]
+
+
+def send_buffers(socket: socket.socket, buffers: list[bytes]) -> None:
+    # Gathers the buffers with a single system call, without joining them first
+    views = [memoryview(buffer) for buffer in buffers if buffer]
+
+    while views:
+        sent = socket.sendmsg(views)
+
+        while sent:
+            if sent < len(views[0]):
+                views[0] = views[0][sent:]
+                break
+
+            sent -= len(views.pop(0))
+
 
 class WebServer:
-    __slots__ = ('addr', 'on_request', 'backlog', 'max_threads', '_thread_pool', '_free_thread_slots', '_socket')
+    __slots__ = (
+        'addr', 'on_request', 'backlog', 'min_threads', 'max_threads', 'keepalive_timeout', 'max_requests_per_connection',
+        'header_timeout', 'body_timeout', 'write_timeout', 'recv_size', 'engine', 'event_loops', 'max_headers', 'max_header_size',
+        'max_url_length', 'max_body_size', 'body_spool_size', 'max_pipelined_requests', 'max_in_flight', 'max_queue_wait',
+        'retry_after', 'metrics_bind', 'binds', 'tcp_nodelay', 'worker_index', 'asgi_app', '_access_log', '_metrics', '_metrics_server', '_overload_response',
+        '_response_cache', '_compression', '_static_files', '_profiler', '_worker_pool', '_event_loops', '_event_loop_threads', '_listeners',
+        '_unix_paths', '_pid', 'http2', 'http2_max_streams', '_http2_stream_pool'
+    )
 
-    def __init__(self, addr: Address, on_request: OnRequest, max_threads: int | None = None, backlog: int | None = 1024) -> None:
+    def __init__(
+        self,
+        addr: Address,
+        on_request: OnRequest,
+        max_threads: int | None = None,
+        backlog: int | None = 1024,
+        keepalive_timeout: float = 5,
+        max_requests_per_connection: int = 1000,
+        min_threads: int = 1,
+        queue_size: int = 256,
+        header_timeout: float = 5,
+        engine: Engine = 'threaded',
+        event_loops: int = 1,
+        max_headers: int = 100,
+        max_header_size: int = 16384,
+        max_url_length: int = 8192,
+        max_body_size: int | None = None,
+        body_spool_size: int = 1048576,
+        max_pipelined_requests: int = 16,
+        access_log: str | None = '-',
+        access_log_format: str = DEFAULT_ACCESS_LOG_FORMAT,
+        access_log_policy: AccessLogPolicy = 'drop',
+        metrics_bind: str | None = None,
+        body_timeout: float = 5,
+        write_timeout: float = 5,
+        recv_size: int = 65536,
+        max_in_flight: int | None = None,
+        max_queue_wait: float | None = None,
+        retry_after: int = 1,
+        cache_size: int | None = None,
+        cache_vary: tuple[str, ...] = (),
+        compression: tuple[str, ...] = (),
+        compression_min_size: int = 1024,
+        compression_types: tuple[str, ...] = DEFAULT_CONTENT_TYPES,
+        compression_cache_size: int | None = 16777216,
+        static: tuple[tuple[str, str], ...] = (),
+        binds: tuple[str, ...] = (),
+        tcp_nodelay: bool = False,
+        tcp_defer_accept: int | None = None,
+        tcp_fastopen: int | None = None,
+        socket_rcvbuf: int | None = None,
+        socket_sndbuf: int | None = None,
+        profile_sample_rate: float = 0,
+        profile_trusted: tuple[str, ...] = (),
+        profile_dir: str = 'profiles',
+        http2: bool = False,
+        http2_max_streams: int = 100
+    ) -> None:
         assert max_threads is None or max_threads > 0
+        assert min_threads > 0
+        assert queue_size > 0
+        assert header_timeout > 0
+        assert body_timeout > 0
+        assert write_timeout > 0
+        assert recv_size > 0
+        assert max_in_flight is None or max_in_flight > 0
+        assert max_queue_wait is None or max_queue_wait > 0
+        assert retry_after >= 0
+        assert cache_size is None or cache_size > 0
+        assert compression_min_size >= 0
+        assert compression_cache_size is None or compression_cache_size > 0
+        assert tcp_defer_accept is None or tcp_defer_accept > 0
+        assert tcp_fastopen is None or tcp_fastopen > 0
+        assert socket_rcvbuf is None or socket_rcvbuf > 0
+        assert socket_sndbuf is None or socket_sndbuf > 0
+        assert 0 <= profile_sample_rate <= 1
+        assert http2_max_streams > 0
+        assert event_loops > 0
+        assert max_headers >= 0
+        assert max_header_size > 0
+        assert max_url_length > 0
+        assert max_body_size is None or max_body_size >= 0
+        assert body_spool_size >= 0
+        assert max_pipelined_requests > 0
         assert backlog is None or backlog >= 0
+        assert keepalive_timeout >= 0
+        assert max_requests_per_connection > 0
 
         if max_threads is None:
             max_threads = (os.cpu_count() or 1) * 2
 
+        # Without the GIL the threads handle requests in parallel, so one per core is kept ready
+        if not is_gil_enabled():
+            min_threads = max(min_threads, os.cpu_count() or 1)
+
+        min_threads = min(min_threads, max_threads)
+
         self.addr: Address = addr
         self.on_request: OnRequest = on_request
         self.backlog: int | None = backlog
+        self.min_threads: int = min_threads
         self.max_threads: int = max_threads
+        self.keepalive_timeout: float = keepalive_timeout
+        self.max_requests_per_connection: int = max_requests_per_connection
+        # Seconds to receive the status line and headers of a request, in total
+        self.header_timeout: float = header_timeout
+        # Seconds without receiving anything while reading a body, or without sending anything while writing a response
+        self.body_timeout: float = body_timeout
+        self.write_timeout: float = write_timeout
+        self.recv_size: int = recv_size
+        self.engine: Engine = engine
+        self.event_loops: int = event_loops
+        self.max_headers: int = max_headers
+        self.max_header_size: int = max_header_size
+        self.max_url_length: int = max_url_length
+        self.max_body_size: int | None = max_body_size
+        # Bodies buffered by the event loops are moved from memory to a temporary file past this size
+        self.body_spool_size: int = body_spool_size
+        # Requests of a single connection handled at the same time by the event loops
+        self.max_pipelined_requests: int = max_pipelined_requests
+        # Past these limits, requests are rejected with "503 Service Unavailable" instead of waiting for a thread
+        self.max_in_flight: int | None = max_in_flight
+        self.max_queue_wait: float | None = max_queue_wait
+        self.retry_after: int = retry_after
+
+        # "HOST:PORT" or "unix:PATH" where the metrics are exposed
+        self.metrics_bind: str | None = metrics_bind
+        # "HOST:PORT", "[HOST]:PORT" or "unix:PATH" of each listening socket, by default only `addr`
+        self.binds: tuple[str, ...] = binds or (get_bind(addr),)
+        self.tcp_nodelay: bool = tcp_nodelay
+        # Cleartext HTTP/2, with prior knowledge or upgrading from HTTP/1.1. Only the "threaded" engine supports it
+        self.http2: bool = http2
+        # Streams of a connection handled at the same time
+        self.http2_max_streams: int = http2_max_streams
+        # Set by the master process in each worker
+        self.worker_index: int | None = None
+        # Served from an asyncio event loop instead of calling `on_request`, set once the application is loaded
+        self.asgi_app: ASGIApplication | None = None
+
+        self._metrics = Metrics()
+        self._metrics_server: MetricsServer | None = None
+
+        # Rejecting has to be cheaper than serving, so the response is serialized only once
+        overload_body = b'The server is overloaded, try again later.\n'
+        self._overload_response = (
+            b'HTTP/1.1 %s\r\nretry-after: %d\r\n' % (generate_http_status(http_status.HTTP_503_SERVICE_UNAVAILABLE).encode(), retry_after)
+            + SERVER_HEADER
+            + CLOSE_HEADER
+            + b'content-length: %d\r\n\r\n' % len(overload_body)
+            + overload_body
+        )
+
+        # Disabled by default, applications have to opt in with "Cache-Control: max-age"
+        self._response_cache: ResponseCache | None = None
+        if cache_size is not None:
+            self._response_cache = ResponseCache(cache_size, cache_vary)
+
+        # Without encodings, responses are never compressed
+        self._compression: ResponseCompression | None = None
+        if compression:
+            self._compression = ResponseCompression(compression, compression_min_size, compression_types, compression_cache_size)
+
+        # URL prefixes and the directories whose files are served without calling the application
+        self._static_files: StaticFiles | None = None
+        if static:
+            self._static_files = StaticFiles(static)
+
+        # Only a fraction of the requests, or the ones asking for it from trusted addresses, are profiled
+        self._profiler: RequestProfiler | None = None
+        if profile_sample_rate > 0 or profile_trusted:
+            self._profiler = RequestProfiler(profile_sample_rate, profile_trusted, profile_dir)
+
+        # Without a path, requests are not logged
+        self._access_log: AccessLog | None = None
+        if access_log is not None:
+            self._access_log = AccessLog(access_log, access_log_format, access_log_policy)
+
+        self._worker_pool: WorkerPool[Any]
+        if engine == 'eventloop':
+            self._worker_pool = WorkerPool(self._handle_dispatch, min_threads, max_threads, queue_size)
+        else:
+            self._worker_pool = WorkerPool(self._handle_client, min_threads, max_threads, queue_size)
+
+        # The thread of each connection reads its frames, and the streams are handled by a pool of their own.
+        # Sharing the connections' pool could leave every thread waiting for a stream with none left to handle it
+        self._http2_stream_pool: WorkerPool[HTTP2Stream] = WorkerPool(
+            self._handle_http2_stream, min_threads, max_threads, queue_size
+        )
+
+        self._event_loops: list[EventLoop] = []
+        self._event_loop_threads: list[Thread] = []
+
+        self._listeners: list[socket.socket] = []
+        # Socket files are removed by the process that created them, not by the workers
+        self._unix_paths: list[str] = []
+        self._pid: int = os.getpid()
+
+        try:
+            for bind in self.binds:
+                self._listeners.append(create_listener(bind, tcp_defer_accept, tcp_fastopen, socket_rcvbuf, socket_sndbuf))
 
-        self._thread_pool: list[Thread | None] = [None for _ in range(max_threads)]
-        self._free_thread_slots: set[int] = set(range(max_threads))
+                family, address = parse_bind(bind)
+                if family == socket.AF_UNIX:
+                    assert isinstance(address, str)
+                    self._unix_paths.append(address)
 
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR | socket.SO_REUSEPORT, 1)
-        self._socket.bind(addr)
+        except BaseException:
+            self.close()
+            raise
 
     def __enter__(self) -> 'WebServer':
         return self
@@ -43,129 +290,823 @@ class WebServer:
         self.close()
 
     def close(self) -> None:
-        self._socket.close()
-        for thread in self._thread_pool:
-            if thread is None:
-                continue
+        for event_loop in self._event_loops:
+            event_loop.stop()
 
+        for thread in self._event_loop_threads:
             thread.join(timeout=10)
 
-            if thread.is_alive():
-                assert not thread.is_alive(), f'WARNING: Thread "{thread.name}" could not end.'
+        for listener in self._listeners:
+            listener.close()
+
+        if os.getpid() == self._pid:
+            for path in self._unix_paths:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+        # Workers waiting to push a response are stopped by closing its connection
+        for event_loop in self._event_loops:
+            event_loop.close()
+
+        self._worker_pool.close()
+
+        if self.http2:
+            self._http2_stream_pool.close()
+
+        if self._static_files is not None:
+            self._static_files.close()
+
+        if self._access_log is not None:
+            self._access_log.close()
+
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+
+    def _render_metrics(self) -> str:
+        gauges: dict[str, float] = {
+            'threads': self._worker_pool.threads,
+            'idle_threads': self._worker_pool.idle_threads,
+            'queue_depth': self._worker_pool.queue_depth,
+            'queue_wait_seconds': self._worker_pool.queue_wait,
+        }
+
+        if self._response_cache is not None:
+            gauges['cache_entries'] = len(self._response_cache)
+            gauges['cache_bytes'] = self._response_cache.size
+
+        if self._compression is not None and self._compression.cache is not None:
+            gauges['compression_cache_bytes'] = self._compression.cache.size
+
+        if self._static_files is not None:
+            gauges['static_open_files'] = len(self._static_files)
+
+        if self.http2:
+            gauges['http2_stream_threads'] = self._http2_stream_pool.threads
+            gauges['http2_stream_queue_depth'] = self._http2_stream_pool.queue_depth
+
+        memory_usage = get_memory_usage()
+        if memory_usage is not None:
+            gauges['memory_rss_bytes'] = memory_usage['rss']
+            gauges['memory_pss_bytes'] = memory_usage['pss']
+
+        return self._metrics.render(gauges)
+
+    def _dump_profiles(self) -> None:
+        assert self._profiler is not None
+
+        # Workers save their profiles side by side
+        self._profiler.dump(f'worker-{self.worker_index}-' if self.worker_index is not None else '')
+
+    def _is_overloaded(self) -> bool:
+        if self.max_in_flight is not None and self._worker_pool.pending_tasks >= self.max_in_flight:
+            return True
+
+        return self.max_queue_wait is not None and self._worker_pool.oldest_task_wait > self.max_queue_wait
+
+    def _log_rejected(self, addr: Address) -> None:
+        self._metrics.increment('rejected')
+        self._log_client_error(addr, {
+            'status': generate_http_status(http_status.HTTP_503_SERVICE_UNAVAILABLE),
+            'headers': [],
+            'body': None
+        })
+
+    def _reject_client(self, socket: socket.socket, addr: Address) -> None:
+        # Called from the accepting thread, so it never blocks
+        self._log_rejected(addr)
+
+        try:
+            socket.setblocking(False)
+            socket.send(self._overload_response)
+
+            # Closing with unread data resets the connection, and the client could lose the response
+            socket.recv(self.recv_size)
+        except OSError:
+            pass
+
+        finally:
+            socket.close()
+
+    def _create_parser(self) -> HTTPRequestParser:
+        return HTTPRequestParser(self.max_headers, self.max_header_size, self.max_url_length, self.max_body_size)
 
     @staticmethod
-    def _serialize_http_response(http_response: HTTPResponse) -> bytes:
-        http_response['headers'].extend((
-            ('server', WEB_SERVER_NAME),
-            ('connection', 'close'),
-        ))
+    def _get_connection_tokens(headers: list[HTTPHeader]) -> list[str]:
+        tokens: list[str] = []
+
+        for key, value in headers:
+            if key.lower() == 'connection':
+                tokens.extend(token.strip().lower() for token in value.split(','))
+
+        return tokens
 
-        response = b'HTTP/1.1 %s\r\n' % http_response['status'].encode()
+    def _should_keep_alive(self, request: HTTPRequest, response: HTTPResponse, requests_served: int) -> bool:
+        if self.keepalive_timeout == 0 or requests_served >= self.max_requests_per_connection:
+            return False
+
+        if 'close' in self._get_connection_tokens(response['headers']):
+            return False
+
+        request_tokens = self._get_connection_tokens(request['headers'])
+
+        if request['version'] == 'HTTP/1.0':
+            return 'keep-alive' in request_tokens
+
+        return 'close' not in request_tokens
+
+    @staticmethod
+    def _serialize_http_response(
+        http_response: HTTPResponse,
+        keep_alive: bool = False,
+        chunked: bool = False,
+        content_length: int | None = None
+    ) -> list[bytes]:
+        # Returns the head and the body as separate buffers, so the body is never copied
+        status = http_response['status']
+        body = http_response['body']
+
+        head = ['HTTP/1.1 ', status, '\r\n']
 
         has_content_length = False
+        has_date = False
+        has_server = False
         for key, value in http_response['headers']:
             key = key.lower()
 
+            if key == 'connection' or key == 'transfer-encoding':
+                continue
+
             if key == 'content-length':
                 has_content_length = True
+            elif key == 'date':
+                has_date = True
+            elif key == 'server':
+                has_server = True
+
+            head.extend((key, ': ', value, '\r\n'))
+
+        buffers = [''.join(head).encode('latin-1')]
+
+        if not has_date:
+            buffers.append(get_date_header())
+
+        if not has_server:
+            buffers.append(SERVER_HEADER)
+
+        buffers.append(KEEP_ALIVE_HEADER if keep_alive else CLOSE_HEADER)
+
+        if body is None:
+            # Without a length the client has to wait for the connection to be closed to know the body is empty
+            if not has_content_length and status[:3] not in NO_CONTENT_STATUSES:
+                buffers.append(EMPTY_CONTENT_LENGTH_HEADER)
+
+        elif not isinstance(body, bytes):
+            # Only the head is serialized, the body is streamed
+            if chunked:
+                buffers.append(CHUNKED_HEADER)
+            elif content_length is not None and not has_content_length:
+                buffers.append(b'content-length: %d\r\n' % content_length)
 
-            response += b'%s: %s\r\n' % (key.encode(), value.encode())
+        elif not has_content_length:
+            buffers.append(b'content-length: %d\r\n' % len(body))
 
-        if http_response['body'] is None:
-            return response + b'\r\n'
+        buffers.append(b'\r\n')
 
-        if not has_content_length:
-            response += b'content-length: %d\r\n' % len(http_response['body'])
+        if isinstance(body, bytes) and body:
+            return [b''.join(buffers), body]
 
-        return response + b'\r\n' + http_response['body']
+        return [b''.join(buffers)]
 
     @staticmethod
-    def _log_client(addr: Address, request: HTTPRequest, response: HTTPResponse) -> None:
-        print(f"INFO: {addr[0]}:{addr[1]} - \"{request['method']} {request['url']} HTTP/1.1\" {response['status']}")
+    def _serialize_cached_response(entry: CacheEntry, keep_alive: bool) -> list[bytes]:
+        head = b''.join((
+            entry.head,
+            get_date_header(),
+            b'age: %d\r\n' % entry.age,
+            KEEP_ALIVE_HEADER if keep_alive else CLOSE_HEADER,
+            b'\r\n'
+        ))
+
+        return [head, entry.body] if entry.body else [head]
+
+    def _get_encoding(self, request: HTTPRequest) -> str | None:
+        assert self._compression is not None
+
+        accept_encoding = ','.join(value for key, value in request['headers'] if key.lower() == 'accept-encoding')
+        return self._compression.negotiate(accept_encoding) if accept_encoding else None
+
+    def _create_cache_entry(self, response: HTTPResponse, encoding: str | None) -> CacheEntry | None:
+        assert self._response_cache is not None
+
+        max_age = self._response_cache.get_max_age(response)
+        if max_age is None:
+            return None
+
+        # Each encoding is a different entry, so hits are sent without compressing them again
+        if self._compression is not None:
+            response = self._compression.compress_response(response, encoding)
+
+        status = response['status']
+        body = response['body']
+        assert body is None or isinstance(body, bytes)
+
+        head = ['HTTP/1.1 ', status, '\r\n']
+
+        has_server = False
+        for key, value in response['headers']:
+            key = key.lower()
+
+            # They are added to each response
+            if key in ('connection', 'transfer-encoding', 'content-length', 'date', 'age'):
+                continue
+
+            if key == 'server':
+                has_server = True
+
+            head.extend((key, ': ', value, '\r\n'))
+
+        if not has_server:
+            head.append(SERVER_HEADER.decode())
+
+        if body or status[:3] not in NO_CONTENT_STATUSES:
+            head.append('content-length: %d\r\n' % len(body or b''))
+
+        return CacheEntry(
+            {'status': status, 'headers': response['headers'], 'body': None},
+            ''.join(head).encode('latin-1'),
+            body or b'',
+            max_age
+        )
+
+    @staticmethod
+    def _get_content_length(headers: list[HTTPHeader]) -> int | None:
+        for key, value in headers:
+            if key.lower() == 'content-length':
+                return parse_digits(value)
 
     @staticmethod
-    def _log_client_error(addr: Address, response: HTTPResponse) -> None:
-        log = f"ERROR: {addr[0]}:{addr[1]} - {response['status']}"
+    def _encode_chunked(body: Iterable[bytes]) -> Iterator[bytes]:
+        try:
+            for chunk in body:
+                if chunk:
+                    yield b'%x\r\n%s\r\n' % (len(chunk), chunk)
+
+            yield b'0\r\n\r\n'
+
+        finally:
+            close = getattr(body, 'close', None)
+
+            if close is not None:
+                close()
+
+    @staticmethod
+    def _send_body_stream(write: Callable[[bytes], object], body: Iterator[bytes]) -> None:
+        try:
+            for data in body:
+                write(data)
+
+        finally:
+            close = getattr(body, 'close', None)
+
+            if close is not None:
+                close()
+
+    def _log_client(self, addr: Address, request: HTTPRequest, response: HTTPResponse, duration: float) -> None:
+        if self._access_log is not None:
+            self._access_log.log(addr, request['method'], request['url'], request['version'], response['status'], duration)
+
+    def _log_client_error(self, addr: Address, response: HTTPResponse) -> None:
+        if self._access_log is not None:
+            body = response['body']
+            self._access_log.log_error(addr, response['status'], body.decode() if isinstance(body, bytes) else '')
+
+    def _process_request(
+        self,
+        request: HTTPRequest,
+        addr: Address,
+        requests_served: int,
+        parser: HTTPRequestParser | None,
+        header_parse_time: float = 0
+    ) -> tuple[list[bytes], Iterator[bytes] | FileWrapper | None, bool]:
+        if self._static_files is not None:
+            response = self._serve_static(request, addr)
+
+            if response is not None:
+                keep_alive = self._should_keep_alive(request, response, requests_served)
+                return self._serialize_response(request, response, keep_alive)
+
+        if self._profiler is not None:
+            sample = self._profiler.start(request, addr)
+
+            if sample is not None:
+                try:
+                    return self._process_application_request(request, addr, requests_served, parser)
+                finally:
+                    self._profiler.finish(sample, header_parse_time)
+
+        return self._process_application_request(request, addr, requests_served, parser)
+
+    def _process_application_request(
+        self,
+        request: HTTPRequest,
+        addr: Address,
+        requests_served: int,
+        parser: HTTPRequestParser | None
+    ) -> tuple[list[bytes], Iterator[bytes] | FileWrapper | None, bool]:
+        encoding = self._get_encoding(request) if self._compression is not None else None
+        cache_key = self._response_cache.get_key(request, encoding or '') if self._response_cache is not None else None
+
+        if cache_key is not None:
+            return self._process_cacheable_request(request, addr, requests_served, parser, cache_key, encoding)
+
+        response, keep_alive = self._call_application(request, addr, requests_served, parser)
+        return self._serialize_response(request, response, keep_alive, encoding)
+
+    def _serve_static(self, request: HTTPRequest, addr: Address) -> HTTPResponse | None:
+        assert self._static_files is not None
+
+        started_at = time.perf_counter()
+        response = self._static_files.serve(request)
+
+        if response is not None:
+            self._log_client(addr, request, response, time.perf_counter() - started_at)
+            self._metrics.increment('requests')
+            self._metrics.increment('static_files')
 
-        if response['body']:
-            log += f" - {response['body'].decode()}"
+        return response
 
-        print(log)
+    def _process_cacheable_request(
+        self,
+        request: HTTPRequest,
+        addr: Address,
+        requests_served: int,
+        parser: HTTPRequestParser | None,
+        cache_key: CacheKey,
+        encoding: str | None
+    ) -> tuple[list[bytes], Iterator[bytes] | FileWrapper | None, bool]:
+        response, entry, keep_alive = self._get_cacheable_response(request, addr, requests_served, parser, cache_key, encoding)
 
-    def _handle_client_thread(self, client: Client, slot: int) -> None:
-        socket, addr = client
-        socket.settimeout(5)
+        if entry is not None:
+            return self._serialize_cached_response(entry, keep_alive), None, keep_alive
 
-        parser = HTTPRequestParser()
+        return self._serialize_response(request, response, keep_alive, encoding)
 
-        response: HTTPResponse | None = None
+    def _get_cacheable_response(
+        self,
+        request: HTTPRequest,
+        addr: Address,
+        requests_served: int,
+        parser: HTTPRequestParser | None,
+        cache_key: CacheKey,
+        encoding: str | None
+    ) -> tuple[HTTPResponse, CacheEntry | None, bool]:
+        # Returns the entry to send if there is one, otherwise the response of the application
+        assert self._response_cache is not None
+
+        started_at = time.perf_counter()
+        entry, must_release = self._response_cache.acquire(cache_key)
+
+        if entry is not None:
+            keep_alive = self._should_keep_alive(request, entry.response, requests_served)
+            self._log_client(addr, request, entry.response, time.perf_counter() - started_at)
+
+            self._metrics.increment('requests')
+            self._metrics.increment('cache_hits')
+
+            return entry.response, entry, keep_alive
+
+        self._metrics.increment('cache_misses')
+
+        try:
+            response, keep_alive = self._call_application(request, addr, requests_served, parser)
+
+            # Only the first of the concurrent misses stores the response, the rest were waiting for it
+            if must_release:
+                entry = self._create_cache_entry(response, encoding)
+
+        finally:
+            if must_release:
+                self._response_cache.release(cache_key, entry)
+
+        return response, entry, keep_alive
+
+    def _call_application(
+        self,
+        request: HTTPRequest,
+        addr: Address,
+        requests_served: int,
+        parser: HTTPRequestParser | None
+    ) -> tuple[HTTPResponse, bool]:
+        body = request['body']
+        started_at = time.perf_counter()
 
         try:
-            while not parser.completed:
+            response = self.on_request(request, addr)
+            app_time = time.perf_counter() - started_at
+
+            # Without a parser, the body was already received in full
+            # If the client is still waiting for "100 Continue", the body will never arrive
+            body_consumed = (
+                body is None
+                or parser is None
+                or parser.completed
+                or (not parser.expect_continue and drain_body(body, parser))
+            )
+
+        finally:
+            if body is not None:
+                body.close()
+
+        keep_alive = body_consumed and self._should_keep_alive(request, response, requests_served)
+        self._log_client(addr, request, response, app_time)
+
+        self._metrics.increment('requests')
+        self._metrics.observe('app', app_time)
+
+        if self._profiler is not None:
+            self._profiler.record_app_time(app_time)
+
+        return response, keep_alive
+
+    def _serialize_response(
+        self,
+        request: HTTPRequest,
+        response: HTTPResponse,
+        keep_alive: bool,
+        encoding: str | None = None
+    ) -> tuple[list[bytes], Iterator[bytes] | FileWrapper | None, bool]:
+        # Files are sent as they are, with `sendfile`
+        if self._compression is not None and not isinstance(response['body'], FileWrapper):
+            response = self._compression.compress_response(response, encoding)
+
+        body = response['body']
+
+        if body is None or isinstance(body, bytes):
+            return self._serialize_http_response(response, keep_alive), None, keep_alive
+
+        if isinstance(body, FileWrapper) and body.resolve_range():
+            assert body.length is not None
+            content_length = self._get_content_length(response['headers'])
+
+            if content_length is not None and content_length < body.length:
+                body.length = content_length
+
+            # The file is shorter than announced, the client can only know the body ended when the connection is closed
+            elif content_length is not None and content_length > body.length:
+                keep_alive = False
+
+            return self._serialize_http_response(response, keep_alive, content_length=body.length), body, keep_alive
+
+        if any(key.lower() == 'content-length' for key, _ in response['headers']):
+            return self._serialize_http_response(response, keep_alive), iter(body), keep_alive
+
+        # HTTP/1.0 clients don't understand chunks, the end of the body is signaled by closing the connection
+        if request['version'] == 'HTTP/1.0':
+            return self._serialize_http_response(response), iter(body), False
+
+        return self._serialize_http_response(response, keep_alive, chunked=True), self._encode_chunked(body), keep_alive
+
+    def _process_error(self, response: HTTPResponse, addr: Address) -> bytes:
+        self._log_client_error(addr, response)
+
+        return b''.join(self._serialize_http_response(response))
+
+    def _handle_dispatch(self, dispatch: Dispatch) -> None:
+        conn, request, slot, requests_served, header_parse_time = dispatch
+
+        keep_alive = False
+        try:
+            serialized_response, body_stream, keep_alive = self._process_request(
+                request, conn.addr, requests_served, None, header_parse_time
+            )
+
+            # The event loop writes the responses of the connection in the order the requests arrived
+            for data in serialized_response:
+                slot.push(data)
+
+            if isinstance(body_stream, FileWrapper):
+                slot.push_file(body_stream)
+            elif body_stream is not None:
+                self._send_body_stream(slot.push, body_stream)
+
+        except ConnectionError:
+            keep_alive = False
+
+        finally:
+            slot.finish(keep_alive)
+
+    def _process_http2_request(self, request: HTTPRequest, addr: Address, header_parse_time: float) -> HTTPResponse:
+        # The same as `_process_request`, but the response is framed by the HTTP/2 connection instead of serialized
+        if self._static_files is not None:
+            response = self._serve_static(request, addr)
+
+            if response is not None:
+                return response
+
+        if self._profiler is not None:
+            sample = self._profiler.start(request, addr)
+
+            if sample is not None:
                 try:
-                    data = socket.recv(1024)
-                except TimeoutError:
-                    response = {
-                        'status': generate_http_status(http_status.HTTP_408_REQUEST_TIMEOUT),
-                        'headers': [],
-                        'body': None
-                    }
-                    break
+                    return self._process_http2_application_request(request, addr)
+                finally:
+                    self._profiler.finish(sample, header_parse_time)
 
-                if data == b'':
-                    response = {
-                        'status': generate_http_status(http_status.HTTP_400_BAD_REQUEST),
-                        'headers': [],
-                        'body': b'Empty package received.\n'
-                    }
-                    break
+        return self._process_http2_application_request(request, addr)
+
+    def _process_http2_application_request(self, request: HTTPRequest, addr: Address) -> HTTPResponse:
+        encoding = self._get_encoding(request) if self._compression is not None else None
+        cache_key = self._response_cache.get_key(request, encoding or '') if self._response_cache is not None else None
+
+        if cache_key is not None:
+            response, entry, _ = self._get_cacheable_response(request, addr, 0, None, cache_key, encoding)
+
+            if entry is not None:
+                return {
+                    'status': entry.response['status'],
+                    'headers': [*entry.response['headers'], ('age', str(entry.age))],
+                    'body': entry.body or None
+                }
+        else:
+            response, _ = self._call_application(request, addr, 0, None)
+
+        if self._compression is not None and not isinstance(response['body'], FileWrapper):
+            response = self._compression.compress_response(response, encoding)
+
+        return response
+
+    def _handle_http2_stream(self, stream: HTTP2Stream) -> None:
+        conn = stream.conn
+
+        try:
+            if stream.error is not None:
+                response = stream.error
+                self._log_client_error(conn.addr, response)
+            else:
+                assert stream.request is not None
+                response = self._process_http2_request(stream.request, conn.addr, stream.header_parse_time)
+
+        except BaseException:
+            # The error is printed by the pool
+            conn.reset_stream(stream, INTERNAL_ERROR)
+            conn.finish_stream(stream)
+            raise
+
+        conn.send_response(stream, response)
+
+    def _serve_http2(
+        self,
+        socket: socket.socket,
+        addr: Address,
+        data: bytes,
+        upgrade_request: HTTPRequest | None = None,
+        upgrade_settings: bytes = b''
+    ) -> None:
+        # Takes over the connection until it's closed
+        self._metrics.increment('http2_connections')
+
+        socket.settimeout(self.write_timeout)
+        HTTP2Connection(self, socket, addr, WEB_SERVER_NAME).run(data, upgrade_request, upgrade_settings)
+
+    def _handle_client(self, client: Client) -> None:
+        socket, addr, accepted_at = client
+
+        parser = self._create_parser()
+        requests_served = 0
+
+        self._metrics.connection_opened()
+
+        try:
+            while True:
+                response: HTTPResponse | None = None
+                received_data = False
+                error: ParsingError | None = None
+                started_at = 0.0
+
+                # The headers have `header_timeout` seconds in total since the request started, so slow clients
+                # can't hold a thread by sending them a byte at a time.
+                # An idle persistent connection is only kept open for `keepalive_timeout` seconds
+                deadline: float | None = None if requests_served else accepted_at + self.header_timeout
+
+                # Pipelined requests are already in the buffer
+                if parser.has_buffered_data:
+                    received_data = True
+                    started_at = time.perf_counter()
+                    deadline = started_at + self.header_timeout
+                    error = parser.feed(b'')
+
+                while not parser.headers_completed and error is None:
+                    timeout = self.keepalive_timeout if deadline is None else deadline - time.perf_counter()
+
+                    try:
+                        if timeout <= 0:
+                            raise TimeoutError
+
+                        socket.settimeout(timeout)
+                        data = socket.recv(self.recv_size)
+                    except TimeoutError:
+                        if requests_served and not received_data:
+                            return
+
+                        self._metrics.increment('timeouts')
+                        response = {
+                            'status': generate_http_status(http_status.HTTP_408_REQUEST_TIMEOUT),
+                            'headers': [],
+                            'body': None
+                        }
+                        break
+
+                    if data == b'':
+                        if requests_served and not received_data:
+                            return
+
+                        response = {
+                            'status': generate_http_status(http_status.HTTP_400_BAD_REQUEST),
+                            'headers': [],
+                            'body': b'Empty package received.\n'
+                        }
+                        break
+
+                    # With prior knowledge, the client starts with the HTTP/2 preface instead of a request
+                    if self.http2 and not requests_served and not received_data and data[:3] == PREFACE[:3]:
+                        self._serve_http2(socket, addr, data)
+                        return
+
+                    if not received_data:
+                        received_data = True
+                        started_at = time.perf_counter()
+
+                        if deadline is None:
+                            deadline = started_at + self.header_timeout
+
+                        if not requests_served:
+                            self._metrics.observe('accept_to_first_byte', started_at - accepted_at)
+
+                    error = parser.feed(data)
 
-                error = parser.feed(data)
                 if error:
+                    self._metrics.increment('parse_errors')
+
                     body = (error.msg + '\n') if error.msg and error.msg[-1] != '\n' else error.msg
                     response = {
                         'status': generate_http_status(error.status),
                         'headers': [],
                         'body': body.encode()
                     }
-                    break
 
-            if response is None:
-                request = parser.get_result()
-                response = self.on_request(request, addr)
-                self._log_client(addr, request, response)
-            else:
-                self._log_client_error(addr, response)
+                keep_alive = False
+
+                if response is None:
+                    header_parse_time = time.perf_counter() - started_at
+                    self._metrics.observe('header_parse', header_parse_time)
+
+                    request = parser.get_result()
+                    body_reader: SocketBodyReader | None = None
+
+                    # Requests with a body are answered in HTTP/1.1, it would have to be received before switching
+                    if self.http2 and not parser.has_body:
+                        upgrade_settings = get_upgrade_settings(request)
+
+                        if upgrade_settings is not None:
+                            socket.settimeout(self.write_timeout)
+                            socket.sendall(SWITCHING_PROTOCOLS_RESPONSE)
+
+                            self._serve_http2(socket, addr, parser.take_buffered_data(), request, upgrade_settings)
+                            return
+
+                    if parser.has_body:
+                        socket.settimeout(self.body_timeout)
+                        body_reader = SocketBodyReader(socket, parser, self.recv_size)
+                        request['body'] = io.BufferedReader(body_reader, buffer_size=self.recv_size)
+
+                    requests_served += 1
+                    serialized_response, body_stream, keep_alive = self._process_request(
+                        request, addr, requests_served, parser, header_parse_time
+                    )
+
+                    if body_reader is not None:
+                        self._metrics.observe('body_read', body_reader.read_time)
 
-            serialized_response = self._serialize_http_response(response)
-            socket.sendall(serialized_response)
+                    sending_started_at = time.perf_counter()
+                    socket.settimeout(self.write_timeout)
+
+                    send_buffers(socket, serialized_response)
+
+                    if isinstance(body_stream, FileWrapper):
+                        try:
+                            body_stream.send(socket)
+                        finally:
+                            body_stream.close()
+
+                    elif body_stream is not None:
+                        self._send_body_stream(socket.sendall, body_stream)
+
+                    self._metrics.observe('send', time.perf_counter() - sending_started_at)
+                else:
+                    socket.settimeout(self.write_timeout)
+                    socket.sendall(self._process_error(response, addr))
+
+                if not keep_alive:
+                    return
+
+                parser.reset()
+
+        except (ConnectionError, TimeoutError):
+            pass
 
         finally:
-            self._free_thread_slots.add(slot)
             socket.close()
+            self._metrics.connection_closed()
 
     def listen(self) -> None:
-        if self.backlog is None:
-            self._socket.listen()
-        else:
-            self._socket.listen(self.backlog)
+        for bind, listener in zip(self.binds, self._listeners):
+            if self.backlog is None:
+                listener.listen()
+            else:
+                listener.listen(self.backlog)
 
-        print(f'INFO: Listen at "{self.addr[0]}:{self.addr[1]}"')
-        print(f'INFO: Threads: {self.max_threads}')
+            print(f'INFO: Listen at "{bind}"')
+
+        if self._access_log is not None:
+            self._access_log.start()
+
+        if self.metrics_bind is not None:
+            metrics_address = get_metrics_address(self.metrics_bind, self.worker_index)
+
+            self._metrics_server = MetricsServer(metrics_address, self._render_metrics)
+            self._metrics_server.start()
+            print(f'INFO: Metrics at "{metrics_address}"')
+
+        if self._profiler is not None:
+            # Dumped from another thread, the signal may interrupt one that is adding a profile
+            signal.signal(DUMP_SIGNAL, lambda *_: Thread(target=self._dump_profiles, name='profiler', daemon=True).start())
+
+            if self.asgi_app is not None:
+                print('WARNING: Profiling is only available for WSGI applications')
+
+        if self.asgi_app is not None:
+            if self.http2:
+                print('WARNING: HTTP/2 is only available for WSGI applications')
+
+            print('INFO: Interface: ASGI')
+            ASGIServer(self, self.asgi_app).run()
+            return
+
+        threads = f'{self.min_threads}-{self.max_threads}'
+        print(f'INFO: Threads: {threads}' if is_gil_enabled() else f'INFO: Threads: {threads} (free-threaded)')
+        self._worker_pool.start()
+
+        if self.http2:
+            if self.engine == 'threaded':
+                print(f'INFO: HTTP/2: {self.http2_max_streams} streams per connection')
+                self._http2_stream_pool.start()
+            else:
+                print('WARNING: HTTP/2 is only available with the "threaded" engine')
+
+        if self.engine == 'eventloop':
+            print(f'INFO: Event loops: {self.event_loops}')
+            self._listen_event_loops()
+            return
+
+        if len(self._listeners) == 1:
+            listener = self._listeners[0]
 
-        slot: int | None = None
-        try:
             while True:
-                while not self._free_thread_slots:
-                    pass
+                self._accept(listener)
 
-                client = self._socket.accept()
-                slot = self._free_thread_slots.pop()
+        # Several listeners are waited on together, and each one is accepted from until it has no pending connections
+        with selectors.DefaultSelector() as selector:
+            for listener in self._listeners:
+                listener.setblocking(False)
+                selector.register(listener, selectors.EVENT_READ, listener)
 
-                t = Thread(target=self._handle_client_thread, args=(client, slot), daemon=False)
-                t.start()
+            while True:
+                for key, _ in selector.select():
+                    try:
+                        while True:
+                            self._accept(key.data)
+                    except BlockingIOError:
+                        pass
 
-                self._thread_pool[slot] = t
-        finally:
-            if slot is not None:
-                self._free_thread_slots.add(slot)
+    def _accept(self, listener: socket.socket) -> None:
+        client_socket, addr = listener.accept()
+        addr = prepare_client(client_socket, addr, self.tcp_nodelay)
+
+        if self._is_overloaded():
+            self._reject_client(client_socket, addr)
+            return
+
+        self._worker_pool.submit((client_socket, addr, time.perf_counter()))
+
+    def _listen_event_loops(self) -> None:
+        for listener in self._listeners:
+            listener.setblocking(False)
+
+        self._event_loops = [EventLoop(self, self._listeners) for _ in range(self.event_loops)]
+
+        for event_loop in self._event_loops[1:]:
+            thread = Thread(target=event_loop.run, name='event-loop', daemon=True)
+            self._event_loop_threads.append(thread)
+            thread.start()
+
+        self._event_loops[0].run()
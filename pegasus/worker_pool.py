@@ -0,0 +1,166 @@
+from typing import Callable, Generic, TypeVar
+from threading import Lock, Thread, current_thread
+import traceback
+import queue
+import time
+import sys
+
+
+Task = TypeVar('Task')
+
+
+def is_gil_enabled() -> bool:
+    # False on free-threaded builds (3.13t) running without the GIL, their threads run Python code in parallel
+    is_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_enabled() if is_enabled is not None else True
+
+
+class WorkerPool(Generic[Task]):
+    __slots__ = (
+        'handler', 'min_threads', 'max_threads', 'max_queue_wait', 'idle_timeout',
+        '_queue', '_threads', '_idle_threads', '_pending_tasks', '_lock', '_thread_ids', '_queue_wait', '_closed'
+    )
+
+    def __init__(
+        self,
+        handler: Callable[[Task], None],
+        min_threads: int,
+        max_threads: int,
+        queue_size: int,
+        max_queue_wait: float = 0.005,
+        idle_timeout: float = 30
+    ) -> None:
+        assert 0 < min_threads <= max_threads
+        assert queue_size > 0
+
+        self.handler: Callable[[Task], None] = handler
+        self.min_threads: int = min_threads
+        self.max_threads: int = max_threads
+        self.max_queue_wait: float = max_queue_wait
+        self.idle_timeout: float = idle_timeout
+
+        self._queue: queue.Queue[tuple[Task, float] | None] = queue.Queue(queue_size)
+        self._threads: set[Thread] = set()
+        self._idle_threads: int = 0
+        self._pending_tasks: int = 0
+        self._lock = Lock()
+        self._thread_ids: int = 0
+        self._queue_wait: float = 0
+        self._closed: bool = False
+
+    @property
+    def threads(self) -> int:
+        return len(self._threads)
+
+    @property
+    def idle_threads(self) -> int:
+        return self._idle_threads
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def queue_wait(self) -> float:
+        # Moving average of the seconds tasks spend in the queue before being handled
+        return self._queue_wait
+
+    @property
+    def oldest_task_wait(self) -> float:
+        # Seconds the next task has been waiting, grows even while every thread is stuck
+        with self._queue.mutex:
+            item = self._queue.queue[0] if self._queue.queue else None
+
+        return time.monotonic() - item[1] if item is not None else 0
+
+    @property
+    def pending_tasks(self) -> int:
+        # Queued and being handled
+        return self._pending_tasks
+
+    def start(self) -> None:
+        with self._lock:
+            while len(self._threads) < self.min_threads:
+                self._spawn_thread()
+
+    def submit(self, task: Task, block: bool = True) -> bool:
+        # Blocks while the queue is full, or returns False right away if not `block`
+        assert not self._closed
+
+        with self._lock:
+            if not self._idle_threads and len(self._threads) < self.max_threads:
+                self._spawn_thread()
+
+            self._pending_tasks += 1
+
+        try:
+            self._queue.put((task, time.monotonic()), block)
+        except queue.Full:
+            with self._lock:
+                self._pending_tasks -= 1
+            return False
+
+        return True
+
+    def close(self, timeout: float | None = 10) -> None:
+        self._closed = True
+
+        with self._lock:
+            threads = list(self._threads)
+
+        for _ in threads:
+            self._queue.put(None)
+
+        for thread in threads:
+            thread.join(timeout=timeout)
+
+            if thread.is_alive():
+                print(f'WARNING: Thread "{thread.name}" could not end.')
+
+    def _spawn_thread(self) -> None:
+        self._thread_ids += 1
+
+        thread = Thread(target=self._worker, name=f'worker-{self._thread_ids}', daemon=True)
+        self._threads.add(thread)
+        self._idle_threads += 1
+        thread.start()
+
+    def _worker(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    if len(self._threads) > self.min_threads:
+                        self._retire_current_thread()
+                        return
+                continue
+
+            if item is None:
+                with self._lock:
+                    self._retire_current_thread()
+                return
+
+            task, enqueued_at = item
+            queue_wait = time.monotonic() - enqueued_at
+
+            with self._lock:
+                self._idle_threads -= 1
+                self._queue_wait += (queue_wait - self._queue_wait) * 0.1
+
+                # Tasks are waiting too long for a thread, so there are not enough of them
+                if queue_wait > self.max_queue_wait and len(self._threads) < self.max_threads and not self._closed:
+                    self._spawn_thread()
+
+            try:
+                self.handler(task)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._idle_threads += 1
+                    self._pending_tasks -= 1
+
+    def _retire_current_thread(self) -> None:
+        self._threads.discard(current_thread())
+        self._idle_threads -= 1
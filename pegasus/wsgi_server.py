@@ -1,5 +1,7 @@
-from http_parser import HTTPHeader, HTTPRequest, HTTPResponse
-from typing import TYPE_CHECKING, Callable
+from http_parser import parse_digits, HTTPHeader, HTTPRequest, HTTPResponse
+from file_wrapper import FileWrapper
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
+from collections import deque
 import socket
 import io
 import sys
@@ -14,69 +16,211 @@ if TYPE_CHECKING:
     from _typeshed import OptExcInfo
     from _typeshed.wsgi import WSGIApplication, WSGIEnvironment
 
+# Translations of header names to environ keys, e.g. "User-Agent" -> "HTTP_USER_AGENT".
+# Clients choose the names, so it stops growing once full
+ENVIRON_KEYS: dict[str, str] = {}
+MAX_ENVIRON_KEYS = 1024
+
+
+def iterate_wsgi_body(written: deque[bytes], iterator: Iterator[bytes], result: Iterable[bytes]) -> Iterator[bytes]:
+    try:
+        while written:
+            yield written.popleft()
+
+        for chunk in iterator:
+            while written:
+                yield written.popleft()
+
+            if chunk:
+                yield chunk
+
+        while written:
+            yield written.popleft()
+
+    finally:
+        close_wsgi_result(result)
+
+
+def close_wsgi_result(result: Iterable[bytes]) -> None:
+    close = getattr(result, 'close', None)
+
+    if close is not None:
+        close()
+
+
+def get_content_length(headers: list[HTTPHeader]) -> int | None:
+    for key, value in headers:
+        if key.lower() == 'content-length':
+            return parse_digits(value)
+
+
+def get_environ_key(header: str) -> str:
+    key = ENVIRON_KEYS.get(header)
+
+    if key is None:
+        key = header.upper().replace('-', '_')
+
+        # They are the only headers without the "HTTP_" prefix
+        if key != 'CONTENT_TYPE' and key != 'CONTENT_LENGTH':
+            key = 'HTTP_' + key
+
+        if len(ENVIRON_KEYS) < MAX_ENVIRON_KEYS:
+            ENVIRON_KEYS[header] = key
+
+    return key
+
 
 def run_wsgi_application(app: 'WSGIApplication', environ: 'WSGIEnvironment') -> HTTPResponse:
     status = ''
     headers: list[HTTPHeader] = []
-    body = b''
+    written: deque[bytes] = deque()
+    headers_sent = False
 
     def write_body(data: bytes) -> int:
-        nonlocal body
-        body += data
+        written.append(data)
         return len(data)
 
     def start_response(status_: str, headers_: list[HTTPHeader], exc_info: 'OptExcInfo | None' = None) -> Callable[[bytes], int]:
         nonlocal status, headers
 
-        if status:
-            raise Exception('`start_response` called tweice.')
+        if exc_info:
+            try:
+                if headers_sent:
+                    raise exc_info[1].with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+
+        elif status:
+            raise Exception('`start_response` called twice.')
 
         status = status_
         headers = headers_
 
         return write_body
 
-    body += b''.join(app(environ, start_response))
-    assert status
+    result = app(environ, start_response)
+
+    # Most applications produce the whole body at once
+    if isinstance(result, (list, tuple)):
+        assert status
+        body = b''.join((*written, *result))
+
+        return {
+            'status': status,
+            'headers': headers,
+            'body': body or None
+        }
+
+    # Reading it here would prevent the server from sending it with `sendfile`
+    if isinstance(result, FileWrapper) and not written:
+        assert status
+
+        return {
+            'status': status,
+            'headers': headers,
+            'body': result
+        }
+
+    try:
+        iterator = iter(result)
+
+        # The headers can't be sent until the application yields something, it may call `start_response` again
+        for chunk in iterator:
+            if chunk:
+                written.append(chunk)
+                break
+        else:
+            assert status
+            body = b''.join(written)
+            close_wsgi_result(result)
+
+            return {
+                'status': status,
+                'headers': headers,
+                'body': body or None
+            }
+
+        assert status
+        content_length = get_content_length(headers)
+
+        # The first chunk is the whole body, so it can be sent without streaming
+        if content_length is not None and sum(len(chunk) for chunk in written) >= content_length:
+            body = b''.join(written)
+            close_wsgi_result(result)
+
+            return {
+                'status': status,
+                'headers': headers,
+                'body': body
+            }
+
+    except BaseException:
+        close_wsgi_result(result)
+        raise
+
+    headers_sent = True
 
     return {
         'status': status,
         'headers': headers,
-        'body': body or None
+        'body': iterate_wsgi_body(written, iterator, result)
     }
 
 
-def wsgi_server(app: 'WSGIApplication', request: HTTPRequest, request_addr: Address, server_addr: Address) -> HTTPResponse:
-    wsgi_input = io.BytesIO(request['body'] or b'')
-    environ: 'WSGIEnvironment' = {
+def create_environ_template(server_addr: Address, multiprocess: bool = False) -> 'WSGIEnvironment':
+    # The keys that are the same for every request, each one copies it
+    return {
         'wsgi.version': (1, 0),
         'wsgi.url_scheme': 'http',
-        'wsgi.input': wsgi_input,
         'wsgi.errors': sys.stderr,
         'wsgi.multithread': True,
-        'wsgi.multiprocess': False,
+        'wsgi.multiprocess': multiprocess,
         'wsgi.run_once': False,
-        'REQUEST_METHOD': request['method'],
-        'RAW_URI': request['url'],
-        'REMOTE_ADDR': request_addr[0],
-        'REMOTE_PORT': request_addr[1],
+        # The input returns EOF at the end of the body, even without "Content-Length" (chunked bodies)
+        'wsgi.input_terminated': True,
+        'wsgi.file_wrapper': FileWrapper,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
         'SERVER_NAME': server_addr[0],
-        'SERVER_PORT': server_addr[1],
-        'SERVER_PROTOCOL': 'HTTP/1.1'
+        'SERVER_PORT': str(server_addr[1]),
     }
 
-    path_info, *query_string = request['url'].split('?', 1)
+
+def wsgi_server(
+    app: 'WSGIApplication',
+    request: HTTPRequest,
+    request_addr: Address,
+    server_addr: Address,
+    multiprocess: bool = False,
+    environ_template: 'WSGIEnvironment | None' = None
+) -> HTTPResponse:
+    if environ_template is None:
+        environ_template = create_environ_template(server_addr, multiprocess)
+
+    environ = environ_template.copy()
+    url = request['url']
+
+    environ['wsgi.input'] = request['body'] if request['body'] is not None else io.BytesIO()
+    environ['REQUEST_METHOD'] = request['method']
+    environ['RAW_URI'] = url
+    environ['REMOTE_ADDR'] = request_addr[0]
+    environ['REMOTE_PORT'] = str(request_addr[1])
+    environ['SERVER_PROTOCOL'] = request['version']
+
+    path_info, _, query_string = url.partition('?')
     environ['PATH_INFO'] = path_info
     if query_string:
-        environ['QUERY_STRING'] = query_string[0]
+        environ['QUERY_STRING'] = query_string
 
-    for key, value in request['headers']:
-        environ['HTTP_' + key.upper().replace('-', '_')] = value
+    get_key = ENVIRON_KEYS.get
 
-    if request['body']:
-        environ['CONTENT_LENGTH'] = environ.get('HTTP_CONTENT_LENGTH') or len(request['body'])
+    for header, value in request['headers']:
+        key = get_key(header) or get_environ_key(header)
 
-    try:
-        return run_wsgi_application(app, environ)
-    finally:
-        wsgi_input.close()
+        # Repeated headers are joined, as they would be in a single one
+        if key in environ:
+            environ[key] += ',' + value
+        else:
+            environ[key] = value
+
+    return run_wsgi_application(app, environ)
@@ -0,0 +1,132 @@
+from unittest import mock
+from typing import Iterator
+import threading
+import unittest
+import time
+import socket
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pegasus'))
+
+from http_parser import HTTPRequest, HTTPResponse
+from web_server import Address, WebServer
+from event_loop import EventLoop, Connection
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def connect(port: int) -> socket.socket:
+    # The server starts listening from another thread
+    deadline = time.monotonic() + 5
+
+    while True:
+        try:
+            return socket.create_connection(('127.0.0.1', port), timeout=5)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def stream_large_response(request: HTTPRequest, addr: Address) -> HTTPResponse:
+    def body() -> Iterator[bytes]:
+        for _ in range(256):
+            yield b'x' * 65536
+
+    return {'status': '200 OK', 'headers': [], 'body': body()}
+
+
+def small_response(request: HTTPRequest, addr: Address) -> HTTPResponse:
+    return {'status': '200 OK', 'headers': [('Content-Length', '2')], 'body': b'ok'}
+
+
+class EventLoopTest(unittest.TestCase):
+    def test_saturated_workers_do_not_block_the_loop(self) -> None:
+        # The only worker waits for the loop to write a response its client doesn't read, and the queue fills up
+        port = get_free_port()
+        server = WebServer(
+            ('127.0.0.1', port),
+            stream_large_response,
+            max_threads=1,
+            queue_size=1,
+            engine='eventloop',
+            access_log=None,
+            write_timeout=30
+        )
+        thread = threading.Thread(target=server.listen, daemon=True)
+        thread.start()
+
+        clients: list[socket.socket] = []
+
+        try:
+            for _ in range(3):
+                client = connect(port)
+                client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+                client.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+                clients.append(client)
+
+            client = connect(port)
+            clients.append(client)
+            client.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+
+            self.assertTrue(client.recv(4096).startswith(b'HTTP/1.1 503 '))
+
+        finally:
+            for client in clients:
+                client.close()
+
+            for event_loop in server._event_loops:
+                event_loop.stop()
+
+            thread.join(timeout=5)
+            server.close()
+
+    def test_failing_connection_does_not_stop_the_loop(self) -> None:
+        parse = EventLoop._parse
+
+        def failing_parse(event_loop: EventLoop, conn: Connection, data: bytes) -> None:
+            if data.startswith(b'GET /fail '):
+                raise RuntimeError('Failing on purpose.')
+
+            parse(event_loop, conn, data)
+
+        port = get_free_port()
+        server = WebServer(('127.0.0.1', port), small_response, engine='eventloop', access_log=None)
+        thread = threading.Thread(target=server.listen, daemon=True)
+        clients: list[socket.socket] = []
+
+        with mock.patch.object(EventLoop, '_parse', failing_parse), mock.patch('traceback.print_exc'):
+            thread.start()
+
+            try:
+                client = connect(port)
+                clients.append(client)
+                client.sendall(b'GET /fail HTTP/1.1\r\nHost: localhost\r\n\r\n')
+
+                # Only the failing connection is closed
+                self.assertEqual(client.recv(4096), b'')
+
+                client = connect(port)
+                clients.append(client)
+                client.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+
+                self.assertTrue(client.recv(4096).startswith(b'HTTP/1.1 200 '))
+
+            finally:
+                for client in clients:
+                    client.close()
+
+                for event_loop in server._event_loops:
+                    event_loop.stop()
+
+                thread.join(timeout=5)
+                server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import tempfile
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pegasus'))
+
+from file_wrapper import FileWrapper
+
+
+class FileWrapperTest(unittest.TestCase):
+    def test_duplicated_descriptors_are_read_independently(self) -> None:
+        # Like the descriptors handed out by the static files cache, both share the file position
+        with tempfile.TemporaryFile() as file:
+            data = bytes(range(256)) * 64
+            file.write(data)
+            file.flush()
+
+            first = FileWrapper(open(os.dup(file.fileno()), 'rb', buffering=0), blksize=1000, offset=0)
+            second = FileWrapper(open(os.dup(file.fileno()), 'rb', buffering=0), blksize=1000, offset=100, length=5000)
+
+            first_chunks: list[bytes] = []
+            second_chunks: list[bytes] = []
+
+            try:
+                for second_chunk, first_chunk in zip(second, first):
+                    first_chunks.append(first_chunk)
+                    second_chunks.append(second_chunk)
+
+                first_chunks.extend(first)
+
+            finally:
+                first.close()
+                second.close()
+
+            self.assertEqual(b''.join(first_chunks), data)
+            self.assertEqual(b''.join(second_chunks), data[100:5100])
+
+
+if __name__ == '__main__':
+    unittest.main()
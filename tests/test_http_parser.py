@@ -0,0 +1,29 @@
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pegasus'))
+
+from http_parser import HTTPRequestParser, http_status
+
+
+class HTTPRequestParserTest(unittest.TestCase):
+    def test_content_length(self) -> None:
+        parser = HTTPRequestParser()
+
+        self.assertIsNone(parser.feed(b'POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: 5\r\n\r\nhello'))
+        self.assertTrue(parser.completed)
+        self.assertEqual(parser.take_body(), b'hello')
+
+    def test_non_ascii_content_length(self) -> None:
+        # "²" is a digit for `str.isdigit`, but not for `int`
+        parser = HTTPRequestParser()
+        error = parser.feed('POST / HTTP/1.1\r\nHost: localhost\r\nContent-Length: ²\r\n\r\n'.encode('latin-1'))
+
+        self.assertIsNotNone(error)
+        assert error is not None
+        self.assertEqual(error.status, http_status.HTTP_400_BAD_REQUEST)
+
+
+if __name__ == '__main__':
+    unittest.main()